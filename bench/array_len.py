@@ -0,0 +1,50 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# array_len.py
+#
+# Times a loop that reads len(a) on every iteration and writes to a (so
+# len(a) is not hoisted out of the loop), for growing arrays.  len is
+# O(1) for Array, so the time per element should stay flat as n grows
+# (with dict-backed arrays it grew with n).
+#
+#   python3 bench/array_len.py [n ...]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+from common import ENGINES, measure, arguments
+
+
+PROGRAM = """
+begin
+    n := %d;
+    i := 0;
+    while i < n do begin
+        a[i] := n - i;
+        i++
+    end;
+    s := 0;
+    i := 0;
+    while i < len(a) do begin
+        a[i] := a[i] + 1;
+        s := s + a[i];
+        i++
+    end;
+    print(s)
+end
+"""
+
+
+def main(sizes):
+    for n in sizes:
+        source = PROGRAM % n
+        for (label, steps) in ENGINES:
+            elapsed = measure(source, steps)
+            print("%-10s n=%-8d %8.3fs  (%6.2fus / element)" %
+                  (label, n, elapsed, elapsed / n * 1e6))
+
+
+if __name__ == '__main__':
+    main(arguments([1000, 10000, 100000]))
@@ -0,0 +1,60 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# common.py
+#
+# Helpers shared by the benchmark scripts: time eval_all on a program
+# through the compiled closures or through the task stack, and read the
+# sizes or iteration counts from the command line.
+#
+#   from common import ENGINES, measure, arguments
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.Evaluator import Evaluator
+
+
+# (表示する名前, eval_all の前に1行実行する回数)
+# 1行でも実行してから eval_all を呼ぶと、タスクスタックの続きを実行する
+ENGINES = [('compiled', 0), ('task', 1)]
+
+
+def run(source, steps=0, **options):
+    """
+    Evaluator(**options) で source を setup し、steps 回1行実行してから
+    eval_all を呼ぶ。(eval_all にかかった秒数, Evaluator) を返す。
+    """
+    evaluator = Evaluator(GUI=True, callback=lambda mes, error=False: None,
+                          **options)
+    evaluator.setup(source)
+    for i in range(steps):
+        evaluator.eval_onestep()
+
+    start = time.perf_counter()
+    evaluator.eval_all()
+    return (time.perf_counter() - start, evaluator)
+
+
+def measure(source, steps=0, **options):
+    """
+    run と同じように実行し、eval_all にかかった秒数を返す
+    """
+    return run(source, steps, **options)[0]
+
+
+def arguments(default):
+    """
+    コマンドラインの引数の整数のリスト（引数がなければ default）
+    """
+    if len(sys.argv) > 1:
+        return [int(x) for x in sys.argv[1:]]
+
+    return default
@@ -0,0 +1,45 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# counting_loop.py
+#
+# Times a `while i < n do begin ...; i++ end` loop with and without the
+# optimiser, once through the compiled closures (a fresh eval_all) and
+# once through the task stack (eval_all after one step).  The trace JIT
+# is turned off so that only the fused loop is measured.
+#
+#   python3 bench/counting_loop.py [iterations]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+from common import ENGINES, measure, arguments
+
+
+PROGRAM = """
+begin
+    n := %d;
+    i := 0;
+    s := 0;
+    while i < n do begin
+        s := s + i;
+        i++
+    end;
+    print(s)
+end
+"""
+
+
+def main(iterations):
+    source = PROGRAM % iterations
+
+    for (label, steps) in ENGINES:
+        plain = measure(source, steps, optimize=False, jit=False)
+        fused = measure(source, steps, optimize=True, jit=False)
+        print("%-10s %8.3fs -> %8.3fs  (x%.2f)" % (label, plain, fused,
+                                                  plain / fused))
+
+
+if __name__ == '__main__':
+    main(*arguments([100000]))
@@ -0,0 +1,57 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# cow.py
+#
+# Times a loop that assigns an n-element array to another variable and
+# passes it to a procedure on every iteration, for growing n.  Arrays
+# are copied on write, so neither the assignment nor saving the
+# environment for the call copies the elements and the time per
+# iteration should stay flat as n grows (with deepcopy it grew with n).
+#
+#   python3 bench/cow.py [n ...]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+from common import ENGINES, measure, arguments
+
+
+ITERATIONS = 2000
+
+PROGRAM = """
+procedure r := get(x, k): begin
+    r := x[k]
+end
+
+begin
+    n := %d;
+    i := 0;
+    while i < n do begin
+        a[i] := i;
+        i++
+    end;
+    s := 0;
+    i := 0;
+    while i < %d do begin
+        b := a;
+        s := s + get(b, i mod n);
+        i++
+    end;
+    print(s)
+end
+"""
+
+
+def main(sizes):
+    for n in sizes:
+        source = PROGRAM % (n, ITERATIONS)
+        for (label, steps) in ENGINES:
+            elapsed = measure(source, steps)
+            print("%-10s n=%-8d %8.3fs  (%8.2fus / iteration)" %
+                  (label, n, elapsed, elapsed / ITERATIONS * 1e6))
+
+
+if __name__ == '__main__':
+    main(arguments([100, 1000, 10000]))
@@ -0,0 +1,167 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# dispatch.py
+#
+# A per-opcode microbenchmark of the dispatch in Evaluator.eval_sentence.
+#
+# For every sample program the task-stack engine is run once while
+# counting how often each opcode is dispatched.  Then, for each opcode,
+# the time to find its handler is measured both with the old if/elif
+# ladder on node type strings (rebuilt here in the original order) and
+# with the opcode table, and the saving is weighted by the counts.
+#
+#   python3 bench/dispatch.py [program.while ...]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import glob
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.Evaluator import Evaluator, NUM_OPCODES
+
+
+# eval_sentence で比較していたノードの種類（元の順番）
+LADDER_TYPES = ['binop', 'remove_callparams', 'call', 'array_subst',
+                'array_element', 'unarrayop', 'print', 'while', 'if',
+                'multi', 'procedure', 'singleop', 'builtin', 'array',
+                'push', 'critical_error', 'nop', 'nop-end-procedure']
+
+# binop で比較していた演算子（元の順番）
+LADDER_BINOPS = ['+', '-', '*', 'div', 'mod', '!=', '=',
+                 '>=', '>', '<=', '<', 'and', 'or']
+
+LADDER_BUILTINS = ['len', 'left', 'right', 'mid', 'int', 'str']
+
+
+def make_ladder():
+    """
+    元の eval_sentence と同じ順番で文字列を比較する if/elif の連鎖を
+    組み立てる。戻り値は見つかった処理の番号。
+    """
+    lines = ["def ladder_dispatch(aNode):"]
+    for i, node_type in enumerate(LADDER_TYPES):
+        keyword = "if" if i == 0 else "elif"
+        lines += ["    %s aNode.type == %r:" % (keyword, node_type)]
+
+        if node_type == 'binop':
+            lines += ["        if aNode.leaf == ':=':",
+                      "            return 0",
+                      "        if aNode.leaf not in ['+', '*', '=', '!=',"
+                      " '<', '>', '<=', '>=']:",
+                      "            pass"]
+            candidates = LADDER_BINOPS
+        elif node_type == 'builtin':
+            candidates = LADDER_BUILTINS
+        elif node_type == 'unarrayop':
+            candidates = ['++', '--']
+        else:
+            candidates = []
+
+        for j, leaf in enumerate(candidates):
+            keyword = "if" if j == 0 else "elif"
+            lines += ["        %s aNode.leaf == %r:" % (keyword, leaf),
+                      "            return %d" % (100 * i + j)]
+
+        lines += ["        return %d" % (100 * i)]
+
+    lines += ["    return -1"]
+
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    return namespace['ladder_dispatch']
+
+
+ladder_dispatch = make_ladder()
+
+
+def table_dispatch(aNode, table):
+    return table[aNode.op]
+
+
+def run_counting(path):
+    """
+    タスクスタックで実行し、opcode ごとの実行回数と代表のノードを返す
+    """
+    evaluator = Evaluator(GUI=True, callback=lambda mes, error=False: None)
+    evaluator.setup(open(path, encoding='utf-8').read())
+
+    counts = [0] * NUM_OPCODES
+    samples = [None] * NUM_OPCODES
+
+    start = time.perf_counter()
+    while not evaluator.task.is_empty():
+        task = evaluator.task.pop()
+        counts[task.node.op] += 1
+        samples[task.node.op] = task.node
+        evaluator.eval_sentence(task)
+    elapsed = time.perf_counter() - start
+
+    return (counts, samples, elapsed)
+
+
+def measure(func, *args, number=200000):
+    """
+    func(*args) の1回あたりの時間（関数呼び出しそのものの時間は除く）
+    """
+    def best(f):
+        timer = timeit.Timer(lambda: f(*args))
+        return min(timer.repeat(repeat=5, number=number)) / number
+
+    return max(best(func) - best(empty), 0.0)
+
+
+def empty(*args):
+    pass
+
+
+def main(paths):
+    table = Evaluator(GUI=True).sentence_table
+
+    for path in paths:
+        (counts, samples, elapsed) = run_counting(path)
+
+        print("=== %s (task engine %.3f s) ===" % (os.path.basename(path),
+                                                  elapsed))
+        print("%-22s %10s %10s %10s %10s" % ("opcode", "count",
+                                              "ladder ns", "table ns",
+                                              "saved ms"))
+        saved_total = 0.0
+        for op in range(NUM_OPCODES):
+            if counts[op] == 0:
+                continue
+
+            aNode = samples[op]
+            ladder = measure(ladder_dispatch, aNode)
+            direct = measure(table_dispatch, aNode, table)
+            saved = (ladder - direct) * counts[op]
+            saved_total += saved
+
+            name = aNode.type
+            if aNode.type in ['binop', 'builtin', 'unarrayop']:
+                name = "%s %s" % (aNode.type, aNode.leaf)
+
+            print("%-22s %10d %10.1f %10.1f %10.2f" % (name, counts[op],
+                                                        ladder * 1e9,
+                                                        direct * 1e9,
+                                                        saved * 1e3))
+
+        print("dispatch time saved: %.2f ms (%.1f%% of the run)\n"
+              % (saved_total * 1e3, 100 * saved_total / elapsed))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        paths = sys.argv[1:]
+    else:
+        sample_dir = os.path.join(os.path.dirname(__file__), '..', 'sample')
+        paths = sorted(glob.glob(os.path.join(sample_dir, '*.while')))
+
+    main(paths)
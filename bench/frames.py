@@ -0,0 +1,52 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# frames.py
+#
+# Times a loop that calls a one-argument procedure on every iteration
+# from a top level with n other variables, for growing n.  A call only
+# builds a frame holding the procedure's arguments and keeps the
+# caller's environment as it is, so the time per call should stay flat
+# as n grows (copying the caller's environment made it grow with n).
+#
+#   python3 bench/frames.py [n ...]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+from common import measure, arguments
+
+
+ITERATIONS = 2000
+
+PROGRAM = """
+procedure r := inc(x): begin
+    r := x + 1
+end
+
+begin
+%s
+    s := 0;
+    i := 0;
+    while i < %d do begin
+        s := inc(s);
+        i++
+    end;
+    print(s)
+end
+"""
+
+
+def main(sizes):
+    for n in sizes:
+        variables = "".join("    v%d := %d;\n" % (i, i) for i in range(n))
+        source = PROGRAM % (variables, ITERATIONS)
+        # 変数の代入を1行ずつ実行してから、タスクスタックで続きを実行する
+        elapsed = measure(source, n + 1, optimize=False)
+        print("task  n=%-8d %8.3fs  (%8.2fus / call)" %
+              (n, elapsed, elapsed / ITERATIONS * 1e6))
+
+
+if __name__ == '__main__':
+    main(arguments([10, 100, 1000]))
@@ -0,0 +1,52 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# inline.py
+#
+# Times a loop that calls a small procedure with and without inlining,
+# once through the compiled closures (a fresh eval_all) and once through
+# the task stack (eval_all after one step).
+#
+#   python3 bench/inline.py [iterations]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+from common import ENGINES, measure, arguments
+from src.Optimizer import INLINE_MAX_NODES
+
+
+PROGRAM = """
+procedure z := dist(a, b): begin
+    if a < b then z := b - a
+    else z := a - b
+end
+
+begin
+    n := %d;
+    m := n div 2;
+    i := 0;
+    s := 0;
+    while i < n do begin
+        d := dist(i, m);
+        s := s + d;
+        i++
+    end;
+    print(s)
+end
+"""
+
+
+def main(iterations):
+    source = PROGRAM % iterations
+
+    for (label, steps) in ENGINES:
+        plain = measure(source, steps, inline_threshold=0)
+        inlined = measure(source, steps, inline_threshold=INLINE_MAX_NODES)
+        print("%-10s %8.3fs -> %8.3fs  (x%.2f)" % (label, plain, inlined,
+                                                  plain / inlined))
+
+
+if __name__ == '__main__':
+    main(*arguments([100000]))
@@ -0,0 +1,48 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# memo.py
+#
+# Times a doubly recursive fib with and without memoisation of pure
+# procedures, once through the compiled closures (a fresh eval_all) and
+# once through the task stack (eval_all after one step), and prints how
+# often the cache was used.
+#
+#   python3 bench/memo.py [n]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+from common import ENGINES, run, arguments
+
+
+PROGRAM = """
+procedure r := fib(n): begin
+    if n < 2 then r := n
+    else begin
+        a := fib(n - 1);
+        b := fib(n - 2);
+        r := a + b
+    end
+end
+
+begin
+    print(fib(%d))
+end
+"""
+
+
+def main(n):
+    source = PROGRAM % n
+
+    for (label, steps) in ENGINES:
+        (plain, evaluator) = run(source, steps, memoize=False)
+        (cached, evaluator) = run(source, steps, memoize=True)
+        memo = evaluator.memo
+        print("%-10s %8.3fs -> %8.3fs  (x%.2f)  hits %d  misses %d" %
+              (label, plain, cached, plain / cached, memo.hits, memo.misses))
+
+
+if __name__ == '__main__':
+    main(*arguments([20]))
@@ -0,0 +1,139 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# memory.py
+#
+# Reports the memory held by the syntax tree and by the tasks of the
+# task-stack interpreter.  Each sample is scaled up by repeating the
+# statements of its main block; the bytes per AST node are the bytes
+# kept after setup divided by the number of Node objects.  Every step of
+# the task-stack interpreter pops one Task, so the bytes per executed
+# step are the bytes of one Task object, and the steps and peak bytes of
+# running the whole scaled program with the task stack are shown too.
+#
+#   python3 bench/memory.py [copies]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.Evaluator import Evaluator, Node, Task
+
+
+SAMPLES = ['bubblesort', 'factorial1', 'getPrime', 'isPrime', 'quicksort',
+           'TuringMachine']
+
+# 一つの Task の大きさを測るときに作る個数
+TASK_COUNT = 100000
+
+
+def scale(source, copies):
+    """
+    最後の begin ... end（一番左から書かれたもの）の中の文を copies 回
+    繰り返したプログラム
+    """
+    lines = source.split('\n')
+    begin = max(i for i, aline in enumerate(lines)
+                if aline.rstrip() == 'begin')
+    end = max(i for i, aline in enumerate(lines)
+              if aline.rstrip() == 'end')
+
+    body = [aline for aline in lines[begin + 1:end]
+            if aline.strip() and not aline.strip().startswith('#')]
+    body[-1] = body[-1].split('#')[0].rstrip()
+    if not body[-1].endswith(';'):
+        body[-1] += ';'
+
+    return '\n'.join(lines[:begin + 1] + body * copies + ['end'])
+
+
+def count_nodes(value, seen):
+    """
+    value から辿れる Node の個数（手続きの本体も含む）
+    """
+    if type(value) is Node:
+        if id(value) in seen:
+            return 0
+        seen.add(id(value))
+        return 1 + count_nodes(value.children, seen)
+
+    if type(value) in (list, tuple):
+        return sum(count_nodes(x, seen) for x in value)
+
+    return 0
+
+
+def new_evaluator():
+    return Evaluator(GUI=True, callback=lambda mes, error=False: None,
+                     optimize=False)
+
+
+def measure_ast(source):
+    evaluator = new_evaluator()
+    gc.collect()
+    tracemalloc.start()
+    evaluator.setup(source)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    nodes = count_nodes(evaluator.node_list, set())
+    return (nodes, size)
+
+
+def measure_run(source):
+    evaluator = new_evaluator()
+    evaluator.setup(source)
+    evaluator.is_fresh = False
+
+    gc.collect()
+    tracemalloc.start()
+    steps = 0
+    while not evaluator.task.is_empty():
+        evaluator.eval_sentence(evaluator.task.pop())
+        steps += 1
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return (steps, peak)
+
+
+def measure_task():
+    aNode = Node('nop')
+    gc.collect()
+    tracemalloc.start()
+    tasks = [Task(aNode, cnt=1) for i in range(TASK_COUNT)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # list の分を除く
+    return (size - sys.getsizeof(tasks)) / len(tasks)
+
+
+def main(copies):
+    samples = os.path.join(os.path.dirname(__file__), '..', 'sample')
+    for name in SAMPLES:
+        with open(os.path.join(samples, name + '.while'),
+                  encoding='utf-8') as f:
+            source = scale(f.read(), copies)
+
+        (nodes, size) = measure_ast(source)
+        (steps, peak) = measure_run(source)
+        print("%-14s %8d nodes %7.1f bytes/node  %9d steps  peak %8.1fKB" %
+              (name, nodes, size / nodes, steps, peak / 1024))
+
+    print("Task           %7.1f bytes/step" % measure_task())
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(200)
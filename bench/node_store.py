@@ -0,0 +1,102 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# node_store.py
+#
+# Compares the peak memory of Evaluator.setup with the syntax tree kept
+# as Node objects and kept in a NodeStore (Evaluator(..., node_store=True)),
+# on a machine-generated program: a Turing machine with n states whose
+# transition table is unrolled into one if statement per rule.  The run
+# time of eval_all (the machine stops after its first STEPS states) is
+# shown for both as well, and both must print the same result.
+#
+#   python3 bench/node_store.py [n ...]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.Evaluator import Evaluator
+
+
+# 実行する状態の数
+STEPS = 5
+
+RULE = """
+        if (done = 0) and (q = %d) and (kigou = "1") then begin
+            q := %d;  x0[h] := "1";  h++;  done := 1
+        end;
+        if (done = 0) and (q = %d) and (kigou = "_") then begin
+            q := %d;  x0[h] := "1";  h := h + 0;  done := 1
+        end;"""
+
+PROGRAM = """
+begin
+    x0 := ["_"];
+    h := 0;
+    q := 0;
+    steps := 0;
+    while q < %d do begin
+        kigou := x0[h];
+        if kigou = 0 then kigou := "_";
+        done := 0;
+%s
+        steps++
+    end;
+    print(steps, len(x0))
+end
+"""
+
+
+def program(n):
+    """
+    状態 i で 1 を書いて、状態 i+1 に移る機械（状態 STEPS で止める）
+    """
+    rules = "".join([RULE % (i, i, i, i + 1) for i in range(n)])
+    return PROGRAM % (min(n, STEPS), rules)
+
+
+def measure(source, node_store):
+    output = []
+    evaluator = Evaluator(GUI=True,
+                          callback=lambda mes, error=False: output.append(mes),
+                          node_store=node_store)
+    gc.collect()
+    tracemalloc.start()
+    evaluator.setup(source)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    evaluator.eval_all()
+    elapsed = time.perf_counter() - start
+    return (peak, elapsed, output)
+
+
+def main(sizes):
+    for n in sizes:
+        source = program(n)
+        lines = source.count("\n")
+        (node_peak, node_time, node_output) = measure(source, False)
+        (store_peak, store_time, store_output) = measure(source, True)
+        assert node_output == store_output
+
+        print("n=%-6d %7d lines  setup peak %8.1fMB -> %7.1fMB (x%.1f)"
+              "  eval_all %6.2fs -> %6.2fs" %
+              (n, lines, node_peak / 2**20, store_peak / 2**20,
+               node_peak / store_peak, node_time, store_time))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main([int(x) for x in sys.argv[1:]])
+    else:
+        main([1000, 10000])
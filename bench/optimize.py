@@ -0,0 +1,60 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# optimize.py
+#
+# Reports how many syntax tree nodes each optimisation pass of
+# src/Optimizer.py removes from (or, for licm, adds to) while programs.
+#
+#   python3 bench/optimize.py [program.while ...]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import glob
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.Evaluator import Evaluator
+from src.Optimizer import count_nodes
+
+
+def main(paths):
+    totals = {}
+    total_nodes = 0
+
+    for path in paths:
+        evaluator = Evaluator(GUI=True, callback=lambda mes, error=False: None)
+        info = evaluator.setup(open(path, encoding='utf-8').read())
+        if not info['noerror']:
+            print("%-24s syntax error" % os.path.basename(path))
+            continue
+
+        removed = evaluator.optimizer_report
+        nodes = sum([count_nodes(aNode) for aNode in evaluator.node_list])
+        nodes += sum(removed.values())
+        total_nodes += nodes
+
+        print("%-24s %6d nodes  %s" % (os.path.basename(path), nodes,
+              "  ".join(["%s %+d" % (name, -count)
+                     for name, count in removed.items()])))
+
+        for name, count in removed.items():
+            totals[name] = totals.get(name, 0) + count
+
+    print("%-24s %6d nodes  %s" % ("total", total_nodes,
+          "  ".join(["%s %+d" % (name, -count)
+                     for name, count in totals.items()])))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        paths = sys.argv[1:]
+    else:
+        sample_dir = os.path.join(os.path.dirname(__file__), '..', 'sample')
+        paths = sorted(glob.glob(os.path.join(sample_dir, '*.while')))
+
+    main(paths)
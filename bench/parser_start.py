@@ -0,0 +1,67 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# parser_start.py
+#
+# Times a fresh process that imports the interpreter and runs a one-line
+# program, first with no cached LALR tables (they are generated and
+# written to src/__pycache__) and then with the tables from the first
+# run.  The time to build the parser on the first parse is shown as well.
+#
+#   python3 bench/parser_start.py [runs]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import glob
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = """
+import time
+start = time.perf_counter()
+from src.Evaluator import Evaluator, get_parser
+imported = time.perf_counter()
+get_parser()
+built = time.perf_counter()
+evaluator = Evaluator(GUI=True, callback=lambda mes, error=False: None)
+evaluator.setup("x := 1")
+evaluator.eval_all()
+print(imported - start, built - imported, time.perf_counter() - start)
+"""
+
+
+def run():
+    output = subprocess.check_output([sys.executable, '-c', CHILD], cwd=ROOT)
+    return [float(x) for x in output.split()]
+
+
+def remove_tables():
+    for path in glob.glob(os.path.join(ROOT, 'src', '__pycache__',
+                                       'Evaluator.*.parsetab')):
+        os.remove(path)
+
+
+def main(runs):
+    for cached in [False, True]:
+        results = []
+        for i in range(runs):
+            if not cached:
+                remove_tables()
+            results += [run()]
+        (imported, built, total) = [min(x) for x in zip(*results)]
+        print("%-10s import %6.1fms  parser %6.1fms  total %6.1fms" %
+              ("cached" if cached else "generated",
+               imported * 1e3, built * 1e3, total * 1e3))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(5)
@@ -0,0 +1,88 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# persistent_vector.py
+#
+# Times a loop that keeps a snapshot of an n-element array (b := a) and
+# then updates one element of it on every iteration, for growing n.
+# The update has to copy the shared array: large arrays are persistent
+# vectors, so only the path to the element is copied and the time per
+# iteration should grow as O(log n).  The same loop with VECTOR_MIN set
+# so large that arrays stay lists (the whole list is copied) is shown on
+# the left.  The time to fill the array is not counted, and the trace
+# JIT is turned off so that only the arrays are measured.
+#
+#   python3 bench/persistent_vector.py [n ...]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import src.Array
+from src.Evaluator import Evaluator
+
+
+ITERATIONS = 2000
+
+PROGRAM = """
+begin
+    n := %d;
+    i := 0;
+    while i < n do begin
+        a[i] := i;
+        i++
+    end;
+    i := 0;
+    while i < %d do begin
+        b := a;
+        a[i mod n] := b[i mod n] + 1;
+        i++
+    end;
+    print(a[0])
+end
+"""
+
+
+def run(source, steps):
+    evaluator = Evaluator(GUI=True, callback=lambda mes, error=False: None,
+                          jit=False)
+    evaluator.setup(source)
+    for i in range(steps):
+        evaluator.eval_onestep()
+
+    start = time.perf_counter()
+    evaluator.eval_all()
+    return time.perf_counter() - start
+
+
+def measure(n, steps, vector_min):
+    """
+    ITERATIONS 回の繰り返しにかかった 1 回あたりの時間（us）
+    """
+    src.Array.VECTOR_MIN = vector_min
+    elapsed = run(PROGRAM % (n, ITERATIONS), steps) - \
+        run(PROGRAM % (n, 0), steps)
+    return elapsed / ITERATIONS * 1e6
+
+
+def main(sizes):
+    vector_min = src.Array.VECTOR_MIN
+    for n in sizes:
+        for (label, steps) in [('compiled', 0), ('task', 1)]:
+            copied = measure(n, steps, float('inf'))
+            shared = measure(n, steps, vector_min)
+            print("%-10s n=%-8d %8.2fus -> %8.2fus / iteration  (x%.2f)" %
+                  (label, n, copied, shared, copied / shared))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main([int(x) for x in sys.argv[1:]])
+    else:
+        main([1000, 10000, 100000])
@@ -0,0 +1,51 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# rope.py
+#
+# Times a loop that builds a string of n characters by appending a
+# 100-character piece on every iteration (s := s + "..."), with ropes
+# (right) and with ROPE_MIN set so large that every + copies both
+# strings (left).  The string is read once at the end (left and len), so
+# the time to join the rope is counted.
+#
+#   python3 bench/rope.py [n ...]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+from common import ENGINES, measure, arguments
+import src.Rope
+
+
+PIECE = "0123456789" * 10
+
+PROGRAM = """
+begin
+    n := %d;
+    s := "";
+    while len(s) < n do
+        s := s + "%s";
+    print(len(s), left(s, 10))
+end
+"""
+
+
+def measure_rope(n, steps, rope_min):
+    src.Rope.ROPE_MIN = rope_min
+    return measure(PROGRAM % (n, PIECE), steps)
+
+
+def main(sizes):
+    rope_min = src.Rope.ROPE_MIN
+    for n in sizes:
+        for (label, steps) in ENGINES:
+            copied = measure_rope(n, steps, float('inf'))
+            roped = measure_rope(n, steps, rope_min)
+            print("%-10s n=%-8d %9.2fms -> %9.2fms  (x%.2f)" %
+                  (label, n, copied * 1e3, roped * 1e3, copied / roped))
+
+
+if __name__ == '__main__':
+    main(arguments([10000, 100000, 1000000]))
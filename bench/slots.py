@@ -0,0 +1,89 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# slots.py
+#
+# Times eval_all on loop-heavy programs: a nested loop of assignments
+# at the top level and the same loop in a procedure body.  Compiled
+# code reads and writes variables through integer slots of a list per
+# frame instead of a dict keyed by name.  The optimizer and the tracing
+# JIT are turned off so that every variable access goes through the
+# compiled closures.
+#
+#   python3 bench/slots.py [n]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.Evaluator import Evaluator
+
+
+TOP_LEVEL = """
+begin
+    n := %d;
+    s := 0;
+    i := 0;
+    while i < n do begin
+        j := 0;
+        while j < 10 do begin
+            t := i * j;
+            s := s + t mod 7;
+            j := j + 1
+        end;
+        i := i + 1
+    end;
+    print(s)
+end
+"""
+
+PROCEDURE = """
+procedure s := sum(n): begin
+    s := 0;
+    i := 0;
+    while i < n do begin
+        j := 0;
+        while j < 10 do begin
+            t := i * j;
+            s := s + t mod 7;
+            j := j + 1
+        end;
+        i := i + 1
+    end
+end
+
+begin
+    print(sum(%d))
+end
+"""
+
+
+def measure(source):
+    evaluator = Evaluator(GUI=True, callback=lambda mes, error=False: None,
+                          optimize=False, jit=False)
+    evaluator.setup(source)
+
+    start = time.perf_counter()
+    evaluator.eval_all()
+    return time.perf_counter() - start
+
+
+def main(n):
+    for (label, program) in [('top level', TOP_LEVEL),
+                             ('procedure', PROCEDURE)]:
+        elapsed = measure(program % n)
+        print("%-10s n=%-8d %8.3fs  (%8.3fus / inner iteration)" %
+              (label, n, elapsed, elapsed / (n * 10) * 1e6))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(20000)
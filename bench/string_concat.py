@@ -0,0 +1,47 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# string_concat.py
+#
+# Times a loop that builds a string one character at a time and cuts it
+# up again with left, right and mid, the way tape-manipulation programs
+# do.  Strings are kept without their surrounding quotes, so none of
+# these operations has to strip and re-add them.
+#
+#   python3 bench/string_concat.py [iterations]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+from common import ENGINES, measure, arguments
+
+
+PROGRAM = """
+begin
+    n := %d;
+    tape := "";
+    i := 0;
+    while i < n do begin
+        tape := tape + str(i mod 10);
+        h := len(tape) - 1;
+        c := right(tape, 1);
+        tape := left(tape, h) + mid(c, 1, 1);
+        i++
+    end;
+    print(len(tape))
+end
+"""
+
+
+def main(iterations):
+    source = PROGRAM % iterations
+
+    for (label, steps) in ENGINES:
+        elapsed = measure(source, steps)
+        print("%-10s %8.3fs  (%6.2fus / iteration)" %
+              (label, elapsed, elapsed / iterations * 1e6))
+
+
+if __name__ == '__main__':
+    main(*arguments([20000]))
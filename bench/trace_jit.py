@@ -0,0 +1,59 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# trace_jit.py
+#
+# Times sample/getPrime.while with a larger bound, with and without the
+# trace JIT of src/TraceJIT.py, once through the compiled closures (a
+# fresh eval_all) and once through the task stack (eval_all after one
+# step).
+#
+#   python3 bench/trace_jit.py [n]
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.Evaluator import Evaluator
+
+
+SAMPLE = os.path.join(os.path.dirname(__file__), '..', 'sample',
+                      'getPrime.while')
+
+
+def measure(source, jit, steps):
+    evaluator = Evaluator(GUI=True, callback=lambda mes, error=False: None,
+                          jit=jit)
+    evaluator.setup(source)
+    for i in range(steps):
+        evaluator.eval_onestep()
+
+    start = time.perf_counter()
+    result = evaluator.eval_all()
+    return (time.perf_counter() - start, result['pretty_env'])
+
+
+def main(n):
+    source = open(SAMPLE, encoding='utf-8').read()
+    source = source.replace("getPrime(5)", "getPrime(%d)" % n)
+
+    for (label, steps) in [('compiled', 0), ('task', 1)]:
+        (plain, env) = measure(source, False, steps)
+        (traced, traced_env) = measure(source, True, steps)
+        assert env == traced_env
+
+        print("%-10s %8.3fs -> %8.3fs  (x%.2f)  z = %s" %
+              (label, plain, traced, plain / traced, env['z']))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main(300)
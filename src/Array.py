@@ -0,0 +1,519 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# Array.py
+#
+# The array values of while programs.  An array keeps its elements in a
+# list while they are packed and switches to a dict when an assignment
+# leaves a large hole, so that a[1000000] := 1 does not allocate a
+# million elements.  The largest index is kept up to date, so len() is
+# O(1).  Elements that were never assigned read as 0.
+#
+# Copies are copy-on-write: copy.deepcopy(array) (and so assignment,
+# passing arguments and saving the environment for a procedure call)
+# returns a new Array sharing the elements, and the elements are copied
+# only when one of the sharing arrays is first written to.  A large
+# array that has to be copied becomes a PersistentVector (a 32-way trie),
+# so that further copies and updates only copy the nodes on the path to
+# the element, O(log n).
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+# list で持つ配列に、これより大きく（かつ今の長さより大きく）離れた
+# index へ代入したときは dict で持つようにする
+SPARSE_GAP = 1024
+
+# 共有している list の配列に代入するとき、長さがこれ以上なら、list を
+# コピーする代わりに PersistentVector にする
+VECTOR_MIN = 1024
+
+# PersistentVector の節の子の個数（2 ** VECTOR_BITS）
+VECTOR_BITS = 5
+VECTOR_WIDTH = 1 << VECTOR_BITS
+VECTOR_MASK = VECTOR_WIDTH - 1
+
+
+
+def share_elements(elements):
+    """
+    elements（list）の要素の配列を share したものに置き換えた list
+    """
+    return [value.share() if type(value) is Array else value
+            for value in elements]
+
+
+
+class PersistentVector:
+    def __init__(self, elements):
+        """
+        PersistentVector(elements)
+
+         32 分木（trie）で要素を持つ list。elements（list）はそのまま
+         持つので、ほかと共有していないものを渡す。
+
+         節は要素（子）を VECTOR_WIDTH 個並べて、最後に持ち主（owner）を
+         置いた list。持ち主が自分の owner の節だけをそのまま書き換え、
+         ほかの節は書き換える前にコピーする（path copying）。
+         fork で作ったものとは節を共有し、どちらの owner も新しくする。
+         最後の VECTOR_WIDTH 個以下の要素は tail に持つ
+         （tail_owned が False なら、tail も書き換える前にコピーする）。
+        """
+        self.owner = object()
+        self.count = len(elements)
+
+        # tail 以外の要素を、VECTOR_WIDTH 個ずつの葉にする
+        tail_offset = ((self.count - 1) >> VECTOR_BITS) << VECTOR_BITS \
+            if self.count > 0 else 0
+        self.tail = elements[tail_offset:]
+        self.tail_offset = tail_offset
+        self.tail_owned = True
+
+        nodes = [elements[i:i + VECTOR_WIDTH] + [self.owner]
+                 for i in range(0, tail_offset, VECTOR_WIDTH)]
+
+        # 根の子が VECTOR_WIDTH 個以下になるまで、節にまとめていく
+        self.shift = VECTOR_BITS
+        while len(nodes) > VECTOR_WIDTH:
+            nodes = [self.new_node(nodes[i:i + VECTOR_WIDTH])
+                     for i in range(0, len(nodes), VECTOR_WIDTH)]
+            self.shift += VECTOR_BITS
+
+        self.root = self.new_node(nodes)
+
+
+    def new_node(self, children):
+        return children + [None] * (VECTOR_WIDTH - len(children)) + \
+            [self.owner]
+
+
+    def __len__(self):
+        return self.count
+
+
+    def get(self, index):
+        """
+        index（0 <= index < len(self)）の要素
+        """
+        if index >= self.tail_offset:
+            return self.tail[index - self.tail_offset]
+
+        node = self.root
+        level = self.shift
+        while level > 0:
+            node = node[(index >> level) & VECTOR_MASK]
+            level -= VECTOR_BITS
+        return node[index & VECTOR_MASK]
+
+
+    def leaf_for(self, index):
+        """
+        index（0 <= index < len(self)）の要素を持つ、書き換えてよい
+        葉（または tail）と、その中の位置を返す
+        """
+        if index >= self.tail_offset:
+            if not self.tail_owned:
+                self.tail = share_elements(self.tail)
+                self.tail_owned = True
+            return (self.tail, index - self.tail_offset)
+
+        owner = self.owner
+        node = self.root
+        if node[VECTOR_WIDTH] is not owner:
+            node = self.root = node[:VECTOR_WIDTH] + [owner]
+
+        level = self.shift
+        while level > 0:
+            i = (index >> level) & VECTOR_MASK
+            child = node[i]
+            if child[VECTOR_WIDTH] is not owner:
+                if level == VECTOR_BITS:
+                    # 葉のコピーでは、要素の配列も別のものにする
+                    child = share_elements(child[:VECTOR_WIDTH]) + [owner]
+                else:
+                    child = child[:VECTOR_WIDTH] + [owner]
+                node[i] = child
+            node = child
+            level -= VECTOR_BITS
+
+        return (node, index & VECTOR_MASK)
+
+
+    def set(self, index, value):
+        (node, i) = self.leaf_for(index)
+        node[i] = value
+
+
+    def append(self, value):
+        if len(self.tail) < VECTOR_WIDTH:
+            if not self.tail_owned:
+                self.tail = share_elements(self.tail)
+                self.tail_owned = True
+            self.tail.append(value)
+            self.count += 1
+            return
+
+        # いっぱいになった tail を葉にして木に入れる
+        if self.tail_owned:
+            leaf = self.tail + [self.owner]
+        else:
+            leaf = share_elements(self.tail) + [self.owner]
+
+        if (self.count >> VECTOR_BITS) > (1 << self.shift):
+            # 根がいっぱいなので一段深くする
+            self.root = self.new_node([self.root,
+                                       self.new_path(self.shift, leaf)])
+            self.shift += VECTOR_BITS
+        else:
+            self.root = self.push_leaf(self.shift, self.root, leaf)
+
+        self.tail = [value]
+        self.tail_owned = True
+        self.tail_offset = self.count
+        self.count += 1
+
+
+    def push_leaf(self, level, node, leaf):
+        """
+        node（level の節）の最後の葉の次に leaf を入れた節を返す
+        """
+        if node[VECTOR_WIDTH] is not self.owner:
+            node = node[:VECTOR_WIDTH] + [self.owner]
+
+        i = ((self.count - 1) >> level) & VECTOR_MASK
+        if level == VECTOR_BITS:
+            node[i] = leaf
+        elif node[i] is None:
+            node[i] = self.new_path(level - VECTOR_BITS, leaf)
+        else:
+            node[i] = self.push_leaf(level - VECTOR_BITS, node[i], leaf)
+        return node
+
+
+    def new_path(self, level, leaf):
+        """
+        leaf だけを持つ level の節
+        """
+        if level == 0:
+            return leaf
+        return self.new_node([self.new_path(level - VECTOR_BITS, leaf)])
+
+
+    def fork(self):
+        """
+        節を共有する新しい PersistentVector（どちらも、書き換えるときに
+        その道筋の節だけをコピーする）
+        """
+        result = PersistentVector.__new__(PersistentVector)
+        result.count = self.count
+        result.shift = self.shift
+        result.root = self.root
+        result.tail = self.tail
+        result.tail_offset = self.tail_offset
+        result.owner = object()
+        result.tail_owned = False
+
+        self.owner = object()
+        self.tail_owned = False
+        return result
+
+
+    def to_list(self):
+        result = []
+        self.collect(self.root, self.shift, result)
+        return result + self.tail
+
+
+    def collect(self, node, level, result):
+        if level == 0:
+            result.extend(node[:VECTOR_WIDTH])
+            return
+
+        for child in node[:VECTOR_WIDTH]:
+            if child is None:
+                return
+            self.collect(child, level - VECTOR_BITS, result)
+
+
+
+class Array:
+    def __init__(self, elements=None):
+        """
+        Array(elements)
+
+         while プログラムの配列。elements には要素の list
+         （index 0 から順に並べたもの）か、index -> 要素 の dict を渡す。
+
+         要素が詰まっているあいだは dense（list）に、大きな穴があるときは
+         sparse（dict）に要素を持つ。大きな配列をコピーしなければならない
+         ときは、list の代わりに vector（PersistentVector）に持つ。
+         dense・sparse・vector のうち、一つだけが None でない。
+         length は最大の index + 1（配列の長さ）。
+         代入されていない要素は 0 として読める。
+
+         dense・sparse・vector は、share で作った配列と共有していることがある。
+         refs はそれらの配列で共有する [共有している配列の個数]
+         （参照カウント。使われなくなった配列の分は __del__ で減らす）。
+         書き換えるときに refs[0] が 1 より大きければ、先に要素をコピーする。
+         要素の配列も、ほかの配列や変数とは共有しているものとして持つ。
+        """
+        self.dense = []
+        self.sparse = None
+        self.vector = None
+        self.length = 0
+        self.refs = [1]
+
+        if type(elements) is list:
+            self.dense = share_elements(elements)
+            self.length = len(elements)
+
+        elif elements is not None:
+            for index, value in elements.items():
+                self[index] = value
+
+
+    def __len__(self):
+        return self.length
+
+
+    def __getitem__(self, index):
+        if self.dense is not None:
+            if type(index) is int and 0 <= index < self.length:
+                return self.dense[index]
+            return 0
+
+        if self.vector is not None:
+            if type(index) is int and 0 <= index < self.length:
+                return self.vector.get(index)
+            return 0
+
+        return self.sparse.get(index, 0)
+
+
+    def __setitem__(self, index, value):
+        if type(value) is Array:
+            # a[i] := a のときは、ここで a が共有されてコピーされる
+            value = value.share()
+
+        if self.refs[0] > 1:
+            self.unshare()
+
+        self.store(index, value)
+
+
+    def store(self, index, value):
+        dense = self.dense
+        if dense is not None and type(index) is int and index >= 0:
+            length = self.length
+            if index < length:
+                dense[index] = value
+                return
+
+            if index == length:
+                dense.append(value)
+                self.length = length + 1
+                return
+
+            if index - length <= max(SPARSE_GAP, length):
+                # 間の要素は 0 で埋める
+                dense.extend([0] * (index - length))
+                dense.append(value)
+                self.length = index + 1
+                return
+
+        vector = self.vector
+        if vector is not None and type(index) is int and index >= 0:
+            length = self.length
+            if index < length:
+                vector.set(index, value)
+                return
+
+            if index - length <= max(SPARSE_GAP, length):
+                for i in range(index - length):
+                    vector.append(0)
+                vector.append(value)
+                self.length = index + 1
+                return
+
+        if self.sparse is None:
+            self.to_sparse()
+
+        self.sparse[index] = value
+        if type(index) is int and index >= self.length:
+            self.length = index + 1
+
+        if len(self.sparse) * 4 >= self.length * 3:
+            # 穴が埋まってきたら list に戻す
+            self.to_dense()
+
+
+    def __eq__(self, other):
+        if type(other) is not Array:
+            return NotImplemented
+
+        if self.length != other.length:
+            return False
+
+        if self.dense is not None and other.dense is not None:
+            return self.dense == other.dense
+
+        return self.to_list() == other.to_list() and \
+            self.other_items() == other.other_items()
+
+    __hash__ = None
+
+
+    def __repr__(self):
+        if self.sparse is not None:
+            return "Array(%r)" % (self.sparse,)
+        return "Array(%r)" % (self.to_list(),)
+
+
+    def __del__(self):
+        self.refs[0] -= 1
+
+
+    def __deepcopy__(self, memo):
+        return self.share()
+
+
+    def share(self):
+        """
+        要素を共有する新しい配列（どちらかを書き換えるまではコピーしない）
+        """
+        result = Array.__new__(Array)
+        result.dense = self.dense
+        result.sparse = self.sparse
+        result.vector = self.vector
+        result.length = self.length
+        result.refs = self.refs
+        self.refs[0] += 1
+        return result
+
+
+    def unshare(self):
+        """
+        共有している要素をコピーして、この配列だけのものにする
+        """
+        self.refs[0] -= 1
+        self.refs = [1]
+
+        if self.vector is not None:
+            self.vector = self.vector.fork()
+
+        elif self.dense is not None:
+            dense = share_elements(self.dense)
+            if len(dense) >= VECTOR_MIN:
+                # これからもコピーされるかもしれないので、道筋の節だけを
+                # コピーすればよい形にしておく
+                self.vector = PersistentVector(dense)
+                self.dense = None
+            else:
+                self.dense = dense
+
+        else:
+            self.sparse = dict([(index, value.share()
+                                 if type(value) is Array else value)
+                                for index, value in self.sparse.items()])
+
+
+    def writable(self, index):
+        """
+        index の要素を、書き換えてよい配列にして返す
+        （配列でないときは、空の配列にする）
+        """
+        if self.refs[0] > 1:
+            self.unshare()
+
+        if self.vector is not None and \
+           type(index) is int and 0 <= index < self.length:
+            # 葉をコピーしてから取り出す
+            (node, i) = self.vector.leaf_for(index)
+            value = node[i]
+            if type(value) is not Array:
+                value = node[i] = Array()
+            return value
+
+        value = self[index]
+        if type(value) is not Array:
+            value = Array()
+            self.store(index, value)
+
+        return value
+
+
+    def values(self):
+        """
+        持っている要素（dense のときは 0 で埋めた要素も含む）
+        """
+        if self.dense is not None:
+            return self.dense
+        if self.vector is not None:
+            return self.vector.to_list()
+        return self.sparse.values()
+
+
+    def items(self):
+        """
+        持っている (index, 要素) の組
+        """
+        if self.dense is not None:
+            return enumerate(self.dense)
+        if self.vector is not None:
+            return enumerate(self.vector.to_list())
+        return self.sparse.items()
+
+
+    def to_list(self):
+        """
+        index 0 から length - 1 までの要素のリスト（無い要素は 0）
+        """
+        if self.dense is not None:
+            return list(self.dense)
+        if self.vector is not None:
+            return self.vector.to_list()
+
+        result = [0] * self.length
+        for index, value in self.sparse.items():
+            if type(index) is int:
+                result[index] = value
+        return result
+
+
+    def other_items(self):
+        """
+        整数でない index の (index, 要素) の組
+        """
+        if self.sparse is None:
+            return {}
+        return dict([(index, value) for index, value in self.sparse.items()
+                     if type(index) is not int])
+
+
+    def concat(self, other):
+        """
+        self の後ろに other の要素を並べた新しい配列（+ 演算子）
+        """
+        if self.dense is not None and other.dense is not None:
+            return Array(self.dense + other.dense)
+
+        result = self.share()
+        offset = self.length
+        for index, value in other.items():
+            result[offset + index] = value
+        return result
+
+
+    def to_sparse(self):
+        self.sparse = dict(enumerate(self.to_list()))
+        self.dense = None
+        self.vector = None
+
+
+    def to_dense(self):
+        if any([type(index) is not int for index in self.sparse]):
+            return
+
+        self.dense = self.to_list()
+        self.sparse = None
@@ -0,0 +1,819 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# BytecodeVM.py
+#
+# A register-based virtual machine for while programs.  The syntax trees are
+# compiled into flat instruction arrays (array('i')) with a constant table,
+# and run by a single dispatch loop instead of the task and value stacks.
+# Each statement first reads its variables and looks up the procedures it
+# calls, then computes its expressions, in the same order as the task stack.
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+from array import array
+
+from src.Array import Array
+from src.Operators import (OperandMismatch, BINOPS, BUILTINS, op_not,
+                           copy_array, message_err_expression)
+from src.Optimizer import has_call
+
+
+# ----------------------------------------------------------------
+# 命令
+#
+#  命令は [opcode, a, b, c, d] の 5 語で、Code.code に並べて置く。
+#  a〜d の意味は命令ごとに下のコメントのとおり。
+# ----------------------------------------------------------------
+WIDTH = 5
+
+NOP = 0             # 行番号の目印だけ
+LOAD_CONST = 1      # regs[a] = consts[b]
+LOAD_NAME = 2       # regs[a] = env[names[b]]
+STORE_NAME = 3      # env[names[a]] = regs[b]
+BINOP = 4           # regs[a] = binops[d](regs[b], regs[c])
+NOT = 5             # regs[a] = not(regs[b])
+BUILTIN = 6         # regs[a] = builtins[d](regs[b], ..., regs[b+c-1])
+ARRAY = 7           # regs[a] = [regs[b], ..., regs[b+c-1]]
+ELEMENT = 8         # regs[a] = names[b][regs[c]]...[regs[c+d-1]]
+SUBST_ELEMENT = 9   # names[a][regs[b]]...[regs[b+c-1]] = regs[d]
+INC = 10            # names[a]++
+DEC = 11            # names[a]--
+PRINT = 12          # print(regs[a], ..., regs[a+b-1])
+JUMP = 13           # pc = a
+JUMP_IF_NOT_ONE = 14  # if regs[a] != 1: pc = b
+PROCEDURE = 15      # procedures[consts[a][0]] = consts[a][1]
+CALL = 16           # regs[a] = regs[consts[d][3]](regs[b], ..., regs[b+c-1])
+RETURN = 17         # 手続きから戻る
+HALT = 18           # プログラムの終了
+END_PROCEDURE = 19  # nop-end-procedure の目印
+UNKNOWN = 20        # 未知の Node（consts[a] が Node の種類）
+LOAD_ARRAY = 21     # regs[a] = consts[b] の配列のコピー
+MOVE = 22           # regs[a] = regs[b]
+RESOLVE = 23        # regs[a] = procedures[consts[d][0]]（引数は c 個。
+                    # エラーなら表示して regs[a] = None、pc = b）
+CHECK_CALL = 24     # regs[a] が None（RESOLVE でエラー）なら止まる
+
+BINOP_LIST = list(BINOPS.keys())
+BINOP_FUNCS = [BINOPS[op] for op in BINOP_LIST]
+
+BUILTIN_LIST = list(BUILTINS.keys())
+BUILTIN_FUNCS = [BUILTINS[name] for name in BUILTIN_LIST]
+
+
+
+class Code:
+    def __init__(self, label):
+        """
+        Code(label)
+
+         一つの関数（トップレベルまたは手続き本体）の命令列。
+         code には命令を、lines には命令ごとの行番号を入れる。
+         一度作ったら変更しないので、deepcopy でも複製しない。
+        """
+        self.label = label
+        self.code = array('i')
+        self.lines = array('i')
+        self.consts = []
+        self.names = []
+        self.nregs = 1
+
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+    def emit(self, opcode, a=0, b=0, c=0, d=0, lineno=0):
+        self.code.extend((opcode, a, b, c, d))
+        self.lines.append(lineno)
+        return len(self.code) - WIDTH
+
+
+    def patch(self, pos, field, value):
+        self.code[pos + field] = value
+
+
+    def here(self):
+        return len(self.code)
+
+
+    def const(self, value):
+        for i, x in enumerate(self.consts):
+            if x is value:
+                return i
+
+        self.consts += [value]
+        return len(self.consts) - 1
+
+
+    def name(self, name):
+        if name not in self.names:
+            self.names += [name]
+        return self.names.index(name)
+
+
+    def line_at(self, pc):
+        return self.lines[pc // WIDTH]
+
+
+
+class CodeCompiler:
+    def __init__(self):
+        """
+        CodeCompiler()
+
+         構文木を Code に変換する。式の値はレジスタに置き、
+         変数は従来どおり環境 env（dict）に置く。
+        """
+        # 手続き本体の Node -> Code
+        self.compiled_bodies = {}
+
+        # 'stored' の文を Node にする NodeStore（VM.load で設定する）
+        self.node_store = None
+
+        # コンパイルしている文の、変数の名前 -> 値を読んでおくレジスタと、
+        # 呼び出しの Node -> (手続きを置くレジスタ, 呼び出しの情報)（expand）
+        self.loaded = {}
+        self.sites = {}
+        self.next_reg = 0
+        self.reload = False
+
+
+    def compile_program(self, node_list):
+        code = Code("<program>")
+        for aNode in node_list:
+            self.statement(code, aNode)
+        code.emit(HALT)
+        return code
+
+
+    def compile_body(self, body):
+        """
+        手続き本体の Code を返す（はじめて呼ばれたときにコンパイルする）
+        """
+        try:
+            return self.compiled_bodies[id(body)][1]
+        except KeyError:
+            code = Code("<procedure>")
+            self.statement(code, body)
+            code.emit(RETURN)
+
+            # id が再利用されないように body も保持しておく
+            self.compiled_bodies[id(body)] = (body, code)
+            return code
+
+
+    # -------------------------------------------------
+    # registers
+    # -------------------------------------------------
+    def alloc(self, code, reg, count=1):
+        if reg + count > code.nregs:
+            code.nregs = reg + count
+
+
+    def exp_list(self, code, nodes, base, lineno, reverse=False, free=None):
+        """
+        式の列の値をレジスタ base, base+1, ... に置く命令を出力する。
+        reverse が真のときは後ろの式から評価する
+        （タスクスタック版の評価順に合わせるため）。
+        free 以降のレジスタ（省略時は列の後ろ）は作業用に使ってよい。
+        """
+        count = len(nodes)
+        self.alloc(code, base, count)
+        if free is None:
+            free = base + count
+
+        order = range(count)
+        if reverse:
+            order = reversed(order)
+
+        for i in order:
+            self.exp(code, nodes[i], base + i, lineno, free)
+
+
+    # -------------------------------------------------
+    # expansion
+    # -------------------------------------------------
+    def expand(self, code, nodes, base, lineno):
+        """
+        文の式 nodes を展開する命令を出力し、作業用に使ってよい最初の
+        レジスタを返す。タスクスタック版は文を実行するときに、まず式を
+        展開して変数の値を読み（値がなければ 0 を入れ）、呼び出す手続きを
+        調べておく（Evaluator.exp_table）。ここでも同じ順番で、変数の値を
+        base からのレジスタに読み、手続きを調べておく（RESOLVE）。
+        式を計算する命令は、変数の値をそのレジスタから読む。
+        """
+        self.loaded = {}
+        self.sites = {}
+        self.next_reg = base
+
+        # 手続きを呼び出さない文では、同じ変数を何度読んでも同じ値になる
+        self.reload = any([has_call(aNode) for aNode in nodes])
+
+        for aNode in nodes:
+            self.expand_exp(code, aNode, lineno)
+
+        self.alloc(code, base, self.next_reg - base)
+        return self.next_reg
+
+
+    def expand_exp(self, code, aNode, lineno):
+        node_type = aNode.type
+
+        if node_type == 'name':
+            if aNode.leaf not in self.loaded:
+                self.loaded[aNode.leaf] = self.next_reg
+                self.next_reg += 1
+            elif not self.reload:
+                return
+
+            code.emit(LOAD_NAME, self.loaded[aNode.leaf],
+                      code.name(aNode.leaf), lineno=lineno)
+
+        elif node_type == 'call':
+            # 手続きがない・引数の個数が違うときは引数を展開しない
+            call_params = aNode.children
+            refnames = tuple((i, call_aparam.leaf)
+                             for i, call_aparam in enumerate(call_params)
+                             if call_aparam.type == 'name')
+            site = self.next_reg
+            self.next_reg += 1
+            callinfo = code.const((aNode.leaf, refnames, aNode.lineno, site))
+            self.sites[aNode] = (site, callinfo)
+
+            resolve = code.emit(RESOLVE, site, 0, len(call_params), callinfo,
+                                lineno=lineno)
+            for call_aparam in call_params:
+                self.expand_exp(code, call_aparam, lineno)
+            code.patch(resolve, 2, code.here())
+
+        elif node_type == 'binop':
+            self.expand_exp(code, aNode.children[1], lineno)
+            self.expand_exp(code, aNode.children[0], lineno)
+
+        elif node_type == 'singleop':
+            self.expand_exp(code, aNode.children[0], lineno)
+
+        elif node_type == 'builtin':
+            if aNode.leaf in ['len', 'int', 'str']:
+                self.expand_exp(code, aNode.children, lineno)
+            else:
+                for anexp in aNode.children[::-1]:
+                    self.expand_exp(code, anexp, lineno)
+
+        elif node_type == 'array':
+            for anexp in aNode.children:
+                self.expand_exp(code, anexp, lineno)
+
+        elif node_type == 'array_element':
+            # 配列の変数は要素を読むとき（ELEMENT）に読む
+            for index in aNode.children[1]:
+                self.expand_exp(code, index, lineno)
+
+
+    # -------------------------------------------------
+    # statements
+    # -------------------------------------------------
+    def statement(self, code, aNode):
+        lineno = aNode.lineno
+        node_type = aNode.type
+
+        if node_type == 'binop':
+            # NAME := expression
+            free = self.expand(code, [aNode.children[1]], 1, lineno)
+            value = self.operand(code, aNode.children[1], 0, lineno, free)
+            code.emit(STORE_NAME, code.name(aNode.children[0].leaf), value,
+                      lineno=lineno)
+
+        elif node_type == 'array_subst':
+            # index を後ろから順に計算してから、値を計算する
+            indexes = aNode.children[1]
+            free = self.expand(code, [aNode.children[2]] + indexes,
+                               len(indexes) + 1, lineno)
+            self.exp_list(code, indexes, 1, lineno, reverse=True, free=free)
+            value = self.operand(code, aNode.children[2], 0, lineno, free)
+            code.emit(SUBST_ELEMENT, code.name(aNode.children[0].leaf),
+                      1, len(indexes), value, lineno=lineno)
+
+        elif node_type == 'unarrayop':
+            if aNode.leaf == '++':
+                opcode = INC
+            else:
+                opcode = DEC
+            code.emit(opcode, code.name(aNode.children[0].leaf),
+                      lineno=lineno)
+
+        elif node_type == 'print':
+            count = len(aNode.children)
+            free = self.expand(code, aNode.children, count, lineno)
+            self.exp_list(code, aNode.children, 0, lineno, reverse=True,
+                          free=free)
+            code.emit(PRINT, 0, count, lineno=lineno)
+
+        elif node_type == 'while':
+            start = code.here()
+            cond = self.condition(code, aNode.children[0], lineno)
+            jump_out = code.emit(JUMP_IF_NOT_ONE, cond, 0, lineno=lineno)
+            self.statement(code, aNode.children[1])
+            code.emit(JUMP, start)
+            code.patch(jump_out, 2, code.here())
+
+        elif node_type == 'if':
+            cond = self.condition(code, aNode.children[0], lineno)
+            jump_else = code.emit(JUMP_IF_NOT_ONE, cond, 0, lineno=lineno)
+            self.statement(code, aNode.children[1])
+
+            if aNode.leaf == "with-else":
+                jump_end = code.emit(JUMP, 0)
+                code.patch(jump_else, 2, code.here())
+                self.statement(code, aNode.children[2])
+                code.patch(jump_end, 1, code.here())
+            else:
+                code.patch(jump_else, 2, code.here())
+
+        elif node_type == 'multi':
+            code.emit(NOP, lineno=lineno)
+            for statement_node in aNode.children:
+                self.statement(code, statement_node)
+
+        elif node_type == 'stored':
+            # node_store に置いた文
+            if aNode.children:
+                self.statement(code, aNode.children[0])
+            else:
+                self.statement(code, self.node_store.node(aNode.leaf))
+
+        elif node_type == 'procedure':
+            code.emit(PROCEDURE, code.const((aNode.leaf, aNode.children)),
+                      lineno=lineno)
+
+        elif node_type == 'nop':
+            if lineno != 0:
+                code.emit(NOP, lineno=lineno)
+
+        elif node_type == 'nop-end-procedure':
+            code.emit(END_PROCEDURE, lineno=lineno)
+
+        else:
+            code.emit(UNKNOWN, code.const((node_type, aNode.leaf)),
+                      lineno=lineno)
+
+
+    def condition(self, code, aNode, lineno):
+        """
+        while と if の条件を計算し、値のあるレジスタを返す
+        """
+        free = self.expand(code, [aNode], 1, lineno)
+        return self.operand(code, aNode, 0, lineno, free)
+
+
+    # -------------------------------------------------
+    # expressions
+    # -------------------------------------------------
+    def operand(self, code, aNode, dst, lineno, free=None):
+        """
+        式の値を計算し、値のあるレジスタを返す。変数なら展開したときに
+        読んだレジスタ、そうでなければ dst に計算する。
+        """
+        if aNode.type == 'name':
+            return self.loaded[aNode.leaf]
+
+        self.exp(code, aNode, dst, lineno, free)
+        return dst
+
+
+    def exp(self, code, aNode, dst, lineno, free=None):
+        """
+        式の値をレジスタ dst に置く命令を出力する。
+        free 以降のレジスタ（省略時は dst より後ろ）は作業用に使ってよい。
+        lineno は値を積むだけの命令に付ける行番号（文の行番号）。
+        """
+        if free is None:
+            free = dst + 1
+        self.alloc(code, dst)
+        node_type = aNode.type
+
+        if node_type in ['number', 'string']:
+            code.emit(LOAD_CONST, dst, code.const(aNode.leaf), lineno=lineno)
+
+        elif node_type == 'constant_array':
+            code.emit(LOAD_ARRAY, dst, code.const(aNode.leaf), lineno=lineno)
+
+        elif node_type == 'name':
+            code.emit(MOVE, dst, self.loaded[aNode.leaf], lineno=lineno)
+
+        elif node_type == 'binop':
+            left = self.operand(code, aNode.children[0], dst, lineno, free)
+            right = self.operand(code, aNode.children[1], free, lineno)
+            code.emit(BINOP, dst, left, right, BINOP_LIST.index(aNode.leaf),
+                      lineno=aNode.lineno)
+
+        elif node_type == 'singleop':
+            value = self.operand(code, aNode.children[0], dst, lineno, free)
+            code.emit(NOT, dst, value, lineno=aNode.lineno)
+
+        elif node_type == 'builtin':
+            if aNode.leaf in ['len', 'int', 'str']:
+                args = [aNode.children]
+            else:
+                args = aNode.children
+
+            self.exp_list(code, args, free, lineno)
+            code.emit(BUILTIN, dst, free, len(args),
+                      BUILTIN_LIST.index(aNode.leaf), lineno=aNode.lineno)
+
+        elif node_type == 'array':
+            self.exp_list(code, aNode.children, free, lineno, reverse=True)
+            code.emit(ARRAY, dst, free, len(aNode.children),
+                      lineno=aNode.lineno)
+
+        elif node_type == 'array_element':
+            indexes = aNode.children[1]
+            self.exp_list(code, indexes, free, lineno, reverse=True)
+            code.emit(ELEMENT, dst, code.name(aNode.children[0].leaf),
+                      free, len(indexes), lineno=aNode.lineno)
+
+        elif node_type == 'call':
+            # 手続きと、名前呼びになる引数の位置と呼び出し側の変数名は
+            # 展開したときに調べてある（expand_exp）
+            call_params = aNode.children
+            (site, callinfo) = self.sites[aNode]
+            if not all([call_aparam.type in ['name', 'number', 'string']
+                        for call_aparam in call_params]):
+                # 手続きがないときは、引数を計算する前に止まる
+                code.emit(CHECK_CALL, site, lineno=lineno)
+
+            self.exp_list(code, call_params, free, lineno, reverse=True)
+            code.emit(CALL, dst, free, len(call_params), callinfo,
+                      lineno=lineno)
+
+        else:
+            code.emit(UNKNOWN, code.const((node_type, aNode.leaf)),
+                      lineno=lineno)
+
+
+
+class Frame:
+    def __init__(self, code, env, dst=0, callinfo=None, params=None,
+                 retname=None):
+        """
+        Frame(code, env, ...)
+
+         実行中の関数一つ分の状態。手続きの場合は、戻り値を入れる
+         呼び出し側のレジスタ dst と、呼び出しの情報も持つ。
+        """
+        self.code = code
+        self.pc = 0
+        self.regs = [0] * code.nregs
+        self.env = env
+
+        self.dst = dst
+        self.callinfo = callinfo
+        self.params = params
+        self.retname = retname
+
+
+
+class VMState:
+    def __init__(self, code, env, lineno):
+        """
+        VMState(code, env, lineno)
+
+         一つのプログラムの実行状態。1ステップ実行の履歴として
+         deepcopy されるので、Code 以外は全てここに置く。
+         dump には手続きを呼び出した側の環境が積まれる。
+        """
+        self.frames = [Frame(code, env)]
+        self.dump = []
+        self.lineno = lineno
+        self.finished = False
+
+
+
+class VM:
+    def __init__(self, evaluator):
+        """
+        VM(evaluator)
+
+         CodeCompiler で作った命令列を実行する。
+         evaluator.procedures を手続きの表として共有する。
+        """
+        self.evaluator = evaluator
+        self.compiler = CodeCompiler()
+        self.state = None
+
+
+    # -------------------------------------------------
+    # public
+    # -------------------------------------------------
+    def load(self, node_list, env, lineno):
+        self.compiler.node_store = self.evaluator.node_store
+        code = self.compiler.compile_program(node_list)
+        self.state = VMState(code, env, lineno)
+        return self.state
+
+
+    def run(self):
+        """
+        最後まで実行する
+        """
+        self.execute(self.state, False)
+        return self.state
+
+
+    def step(self):
+        """
+        次に実行する行が変わるところまで実行する。
+        最後に実行した命令が END_PROCEDURE なら True を返す。
+        """
+        return self.execute(self.state, True)
+
+
+    # -------------------------------------------------
+    # dispatch loop
+    # -------------------------------------------------
+    def error(self, state, mes):
+        self.evaluator.print_error(mes)
+        state.finished = True
+
+
+    def next_lineno(self, state, frame, pc):
+        """
+        次に実行する命令の行番号
+        （RETURN は、呼び出し側の後始末なので呼び出しの行番号とする）
+        """
+        opcode = frame.code.code[pc]
+        if opcode == RETURN:
+            return frame.callinfo[2]
+        return frame.code.line_at(pc)
+
+
+    def execute(self, state, stepping):
+        evaluator = self.evaluator
+        procedures = evaluator.procedures
+        print_values = evaluator.print_values
+        pretty_print_value = evaluator.pretty_print_value
+
+        frames = state.frames
+        frame = frames[-1]
+        code = frame.code.code
+        consts = frame.code.consts
+        names = frame.code.names
+        regs = frame.regs
+        env = frame.env
+        pc = frame.pc
+
+        old_lineno = state.lineno
+        opcode = NOP
+
+        while True:
+            opcode = code[pc]
+            a = code[pc + 1]
+            pc += WIDTH
+
+            if opcode == LOAD_NAME:
+                var_name = names[code[pc - 3]]
+                try:
+                    regs[a] = env[var_name]
+                except KeyError:
+                    env[var_name] = regs[a] = 0
+
+            elif opcode == LOAD_CONST:
+                regs[a] = consts[code[pc - 3]]
+
+            elif opcode == MOVE:
+                regs[a] = regs[code[pc - 3]]
+
+            elif opcode == BINOP:
+                val0 = regs[code[pc - 3]]
+                val1 = regs[code[pc - 2]]
+                try:
+                    regs[a] = BINOP_FUNCS[code[pc - 1]](val0, val1)
+                except OperandMismatch:
+                    lineno = frame.code.line_at(pc - WIDTH)
+                    operator = BINOP_LIST[code[pc - 1]]
+                    self.error(state, message_err_expression(lineno, val0, val1, operator))
+                    break
+
+            elif opcode == JUMP_IF_NOT_ONE:
+                if regs[a] != 1:
+                    pc = code[pc - 3]
+
+            elif opcode == JUMP:
+                pc = a
+
+            elif opcode == STORE_NAME:
+                target_value = regs[code[pc - 3]]
+                if type(target_value) is Array:
+                    # 配列の場合、別のオブジェクトとして代入
+                    target_value = target_value.share()
+                env[names[a]] = target_value
+
+            elif opcode == INC:
+                var_name = names[a]
+                try:
+                    env[var_name] += 1
+                except KeyError:
+                    env[var_name] = 1
+
+            elif opcode == DEC:
+                var_name = names[a]
+                if var_name in env and env[var_name] > 0:
+                    env[var_name] -= 1
+                else:
+                    env[var_name] = 0
+
+            elif opcode == ELEMENT:
+                first = code[pc - 2]
+                indexes = regs[first:first + code[pc - 1]]
+                (indexes, last_index) = (indexes[:-1], indexes[-1])
+
+                # 環境に存在しないときには 0 を返す
+                target = env.get(names[code[pc - 3]], None)
+                for i in indexes:
+                    if type(target) is Array and \
+                       type(target[i]) is Array:
+                        target = target[i]
+                    else:
+                        # 巡れないときには 0 を返して終了
+                        target = None
+                        break
+
+                try:
+                    regs[a] = target[last_index]
+                except:
+                    # last_index にアクセスできないときは 0 を返して終了
+                    regs[a] = 0
+
+            elif opcode == SUBST_ELEMENT:
+                first = code[pc - 3]
+                indexes = regs[first:first + code[pc - 2]]
+                (indexes, last_index) = (indexes[:-1], indexes[-1])
+
+                # 環境に存在しないときには 空の配列 を作成しておく
+                var_name = names[a]
+                if var_name not in env:
+                    env[var_name] = Array()
+
+                value = regs[code[pc - 1]]
+                if type(value) is Array:
+                    # a[i][j] := a のように自分自身を代入するときのために、先に共有しておく
+                    value = value.share()
+
+                target = env[var_name]
+                for i in indexes:
+                    if type(target) is Array:
+                        # 共有している配列は、ここでコピーしてから書き換える
+                        target = target.writable(i)
+                    else:
+                        target[i] = Array()
+                        target = target[i]
+
+                target[last_index] = value
+
+            elif opcode == NOT:
+                regs[a] = op_not(regs[code[pc - 3]])
+
+            elif opcode == BUILTIN:
+                first = code[pc - 3]
+                args = regs[first:first + code[pc - 2]]
+                regs[a] = BUILTIN_FUNCS[code[pc - 1]](*args)
+
+            elif opcode == LOAD_ARRAY:
+                regs[a] = copy_array(consts[code[pc - 3]])
+
+            elif opcode == ARRAY:
+                first = code[pc - 3]
+                regs[a] = Array(regs[first:first + code[pc - 2]])
+
+            elif opcode == RESOLVE:
+                (procedure_name, refnames, lineno, site) = consts[code[pc - 1]]
+                procedure = procedures.get(procedure_name)
+                nargs = code[pc - 2]
+                regs[a] = None
+
+                # エラーメッセージはここで表示し、呼び出すところで止まる
+                if procedure is None:
+                    evaluator.print_error("%d行目: 手続き '%s' が定義されていません。" % (lineno, procedure_name))
+                    pc = code[pc - 3]
+
+                # 引数の個数のチェック
+                elif len(procedure[1]) > nargs:
+                    evaluator.print_error("%d行目: 手続き '%s' に与えらた引数の個数が少なすぎです（%d個にしてください）。" % (lineno, procedure_name, len(procedure[1])))
+                    pc = code[pc - 3]
+
+                elif len(procedure[1]) < nargs:
+                    evaluator.print_error("%d行目: 手続き '%s' に与えらた引数の個数が多すぎです（%d個にしてください）。" % (lineno, procedure_name, len(procedure[1])))
+                    pc = code[pc - 3]
+
+                else:
+                    regs[a] = procedure
+
+            elif opcode == CHECK_CALL:
+                if regs[a] is None:
+                    state.finished = True
+                    break
+
+            elif opcode == CALL:
+                callinfo = consts[code[pc - 1]]
+                first = code[pc - 3]
+                args = regs[first:first + code[pc - 2]]
+
+                procedure = regs[callinfo[3]]
+                if procedure is None:
+                    # RESOLVE でエラーメッセージを表示している
+                    state.finished = True
+                    break
+
+                (procedure_retname, procedure_params,
+                 procedure_body) = procedure
+
+                # 手続き用の環境には引数だけを置く
+                # （配列は呼び出し側に影響が及ばないようにコピーする）
+                local_env = {}
+                for aparam, aval in zip(procedure_params, args):
+                    if type(aval) is Array:
+                        aval = aval.share()
+                    local_env[aparam] = aval
+
+                frame.pc = pc
+                state.dump += [env]
+
+                frame = Frame(self.compiler.compile_body(procedure_body),
+                              local_env, dst=a, callinfo=callinfo,
+                              params=procedure_params,
+                              retname=procedure_retname)
+                frames += [frame]
+
+                code = frame.code.code
+                consts = frame.code.consts
+                names = frame.code.names
+                regs = frame.regs
+                env = frame.env
+                pc = 0
+
+            elif opcode == RETURN:
+                callee = frames.pop()
+                local_env = env
+                frame = frames[-1]
+                env = state.dump.pop()
+
+                # 名前呼びの引数は呼び出し側の環境へ書き戻す
+                for i, call_name in callee.callinfo[1]:
+                    env[call_name] = local_env[callee.params[i]]
+
+                code = frame.code.code
+                consts = frame.code.consts
+                names = frame.code.names
+                regs = frame.regs
+                pc = frame.pc
+
+                # procedure 内で retval が使われていないときは 0 を返すとする
+                regs[callee.dst] = local_env.get(callee.retname, 0)
+
+            elif opcode == PRINT:
+                result_vals = [pretty_print_value(aval)
+                               for aval in regs[a:a + code[pc - 3]]]
+                print_values(result_vals)
+
+            elif opcode == PROCEDURE:
+                (procedure_name, children) = consts[a]
+                procedures[procedure_name] = children
+
+            elif opcode == NOP or opcode == END_PROCEDURE:
+                pass
+
+            elif opcode == HALT:
+                state.finished = True
+                break
+
+            else:
+                (node_type, node_leaf) = consts[a]
+                print("There is no operation")
+                print(node_type, node_leaf)
+                state.finished = True
+                break
+
+            if stepping:
+                if code[pc] == HALT:
+                    state.finished = True
+                    break
+
+                # 次に実行する命令の行番号を取得し、行が変わったら止める
+                if state.lineno != 0:
+                    old_lineno = state.lineno
+
+                state.lineno = self.next_lineno(state, frame, pc)
+
+                if state.lineno != 0 and state.lineno != old_lineno:
+                    break
+
+        frame.pc = pc
+        frame.env = env
+
+        if state.finished:
+            state.lineno = 0
+
+        return opcode == END_PROCEDURE
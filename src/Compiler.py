@@ -0,0 +1,1402 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# Compiler.py
+#
+# A compiler from the syntax trees of while programs into nested Python
+# closures.  It is used by Evaluator.eval_all for fast execution; the
+# task-stack interpreter in Evaluator.py is kept for one-step execution.
+# Variables of the top level and of each procedure body are resolved to
+# integer slots at compile time, and each frame is a list of values.
+# Statements that call procedures are compiled into generators, and the
+# frames of the calls are kept on an explicit stack (run_frames), so the
+# depth of the calls does not depend on the Python stack.
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import copy
+import inspect
+
+from src.Array import Array
+from src.Operators import (OperandMismatch, BINOPS, BUILTINS, op_not,
+                           copy_array)
+from src.Optimizer import has_call
+
+
+class RuntimeStop(Exception):
+    """
+    実行時エラーで評価を打ち切るための例外。
+    env にはエラーが起きたときの環境が入っている。
+    """
+    def __init__(self, env):
+        super().__init__()
+        self.env = env
+
+
+
+class TailCall(Exception):
+    """
+    手続きの最後の自分自身の呼び出しで投げる例外。
+    run_frames がその手続きを呼び出したジェネレータ（call_step）に
+    投げ直し、呼び出しを深くせずに、手続きの本体をもう一度実行する。
+    """
+    def __init__(self, values, passed):
+        super().__init__()
+        self.values = values
+        self.passed = passed
+
+
+
+# 値が入っていない（まだ定義されていない）変数のスロット
+UNSET = object()
+
+# 引数を一つだけとる組み込み関数（children が Node 一つ）
+UNARY_BUILTINS = ['len', 'int', 'str']
+
+
+
+def is_generator(run):
+    """
+    コンパイルした文 run が、手続きを呼び出すジェネレータ関数なら True
+    """
+    return inspect.isgeneratorfunction(run)
+
+
+def run_frames(body):
+    """
+    ジェネレータ body（手続きを呼び出す文）を最後まで実行する。
+    ジェネレータは手続きを呼び出すときに、呼ばれる手続きの本体の
+    ジェネレータを yield する。それを呼び出し側の上に積んで実行し、
+    終わったら呼び出し側に戻るので、呼び出しの深さは Python の再帰の
+    深さにならない。手続きの本体が TailCall を投げたときは、
+    呼び出し側に投げ直す。
+    """
+    frames = []
+    tail = None
+
+    while True:
+        try:
+            if tail is None:
+                callee = next(body)
+            else:
+                (thrown, tail) = (tail, None)
+                callee = body.throw(thrown)
+
+        except StopIteration:
+            if not frames:
+                return
+            body = frames.pop()
+            continue
+
+        except TailCall as e:
+            tail = e
+            body = frames.pop()
+            continue
+
+        frames.append(body)
+        body = callee
+
+
+
+class Scope:
+    def __init__(self, names=()):
+        """
+        Scope(names)
+
+         トップレベルか手続きの本体で使う変数の名前 -> スロットの番号。
+         コンパイルしながら slot で名前を加えていき、実行時の環境は
+         スロットの個数の長さの list（new_env）になる。
+         names の変数は先頭のスロットになる。
+        """
+        self.names = []
+        self.slots = {}
+
+        # 手続きの本体のときは、引数と戻り値の変数のスロット
+        # （Compiler.procedure_body で入れる）
+        self.param_slots = ()
+        self.ret_slot = None
+
+        for name in names:
+            self.slot(name)
+
+
+    def slot(self, name):
+        try:
+            return self.slots[name]
+        except KeyError:
+            slot = self.slots[name] = len(self.names)
+            self.names += [name]
+            return slot
+
+
+    def temp(self):
+        """
+        変数ではない値（先に読んでおく変数の値や、呼び出す手続き）を置く
+        スロット。名前は None にして、env_dict には含めない
+        """
+        self.names += [None]
+        return len(self.names) - 1
+
+
+    def new_env(self, env=None):
+        """
+        どの変数にも値が入っていない環境。env（変数の名前 -> 値）があれば
+        その値を入れておく
+        """
+        slots = [UNSET] * len(self.names)
+        if env is not None:
+            for name, value in env.items():
+                slots[self.slots[name]] = value
+
+        return slots
+
+
+    def env_dict(self, slots):
+        """
+        環境 slots を、値の入っている変数の名前 -> 値 の dict にする
+        （環境の表示やエラーのときに使う）
+        """
+        return dict([(name, value)
+                     for name, value in zip(self.names, slots)
+                     if name is not None and value is not UNSET])
+
+
+
+class SlotView:
+    def __init__(self, scope, slots):
+        """
+        SlotView(scope, slots)
+
+         環境 slots を、TraceJIT から変数の名前で読み書きするための dict の
+         ようなもの（get, [], []= だけ）
+        """
+        self.scope = scope
+        self.slots = slots
+
+
+    def get(self, name, default=None):
+        slot = self.scope.slots.get(name)
+        if slot is None or self.slots[slot] is UNSET:
+            return default
+
+        return self.slots[slot]
+
+
+    def __getitem__(self, name):
+        value = self.get(name, UNSET)
+        if value is UNSET:
+            raise KeyError(name)
+
+        return value
+
+
+    def __setitem__(self, name, value):
+        self.slots[self.scope.slot(name)] = value
+
+
+
+class Compiler:
+    def __init__(self, evaluator):
+        """
+        Compiler(evaluator)
+
+         構文木（Node）を一度だけ走査し、環境 env を引数にとる
+         Python のクロージャに変換する。
+         文のクロージャは run(env) -> None、式のクロージャは
+         run(env) -> 値 の形をしている。env はスロットの list で、
+         変数の名前は、コンパイルしている本体の Scope（self.scope）で
+         スロットの番号にしておく。
+         手続きを呼び出す文は、ジェネレータ関数にして run_frames で
+         実行する（compile_call_exps）。
+
+         式はタスクスタック版と同じ順番で計算する（変数に 0 が入る順番、
+         エラーになる位置、名前呼びの引数を書き戻す順番も同じになる）。
+
+         evaluator.procedures を手続きの表として共有するので、
+         procedure 文の実行結果はタスクスタック版と同じように見える。
+        """
+        self.evaluator = evaluator
+
+        # 手続き本体の Node -> (コンパイル済みクロージャ, Scope, ジェネレータか)
+        self.compiled_bodies = {}
+
+        # コンパイルしている本体（トップレベルか手続きの本体）の Scope
+        self.scope = None
+
+        # コンパイルしている文の式が読む変数のスロット（compile_exps）
+        self.reads = []
+
+        # 手続きを呼び出す文の、変数と呼び出しの Node -> 展開するときに
+        # 値を入れておくスロット（compile_call_exps）
+        self.captured = {}
+
+        self.statement_compilers = {
+            'binop': self.compile_subst,
+            'array_subst': self.compile_array_subst,
+            'unarrayop': self.compile_unarrayop,
+            'print': self.compile_print,
+            'while': self.compile_while,
+            'if': self.compile_if,
+            'multi': self.compile_multi,
+            'procedure': self.compile_procedure,
+            'nop': self.compile_nop,
+            'nop-end-procedure': self.compile_nop,
+            'stored': self.compile_stored,
+        }
+
+        # 手続きの呼び出しを含まない式
+        self.exp_compilers = {
+            'binop': self.compile_binop,
+            'singleop': self.compile_singleop,
+            'builtin': self.compile_builtin,
+            'number': self.compile_constant,
+            'string': self.compile_constant,
+            'name': self.compile_name,
+            'array': self.compile_array,
+            'constant_array': self.compile_constant_array,
+            'array_element': self.compile_array_element,
+        }
+
+
+    # -------------------------------------------------
+    # public
+    # -------------------------------------------------
+    def compile_program(self, node_list, env):
+        """
+        トップレベルの文のリストをコンパイルし、一つのクロージャにする。
+        クロージャは、環境 env（変数の名前 -> 値 の dict）の値から
+        始めて、実行し終わったら（止まったときも）env を書き換える。
+        """
+        scope = self.scope = Scope(env)
+        program = self.sequence([self.compile_statement(aNode)
+                                 for aNode in node_list])
+        generator = is_generator(program)
+
+        def run(env):
+            slots = scope.new_env(env)
+            try:
+                if generator:
+                    run_frames(program(slots))
+                else:
+                    program(slots)
+            finally:
+                env.clear()
+                env.update(scope.env_dict(slots))
+
+        return run
+
+
+    def compile_statement(self, aNode):
+        try:
+            compiler = self.statement_compilers[aNode.type]
+        except KeyError:
+            return self.compile_unknown(aNode)
+
+        return compiler(aNode)
+
+
+    def compile_exp(self, aNode):
+        try:
+            compiler = self.exp_compilers[aNode.type]
+        except KeyError:
+            return self.compile_unknown(aNode)
+
+        return compiler(aNode)
+
+
+    def compile_exps(self, nodes):
+        """
+        一つの文の、手続きの呼び出しを含まない式のリストをコンパイルする。
+        式が読む変数のスロットは self.reads に集めておく（type_error）
+        """
+        outer_reads = self.reads
+        self.reads = []
+        try:
+            return [self.compile_exp(aNode) for aNode in nodes]
+        finally:
+            self.reads = outer_reads
+
+
+    # -------------------------------------------------
+    # errors
+    # -------------------------------------------------
+    def error(self, mes, env, scope):
+        self.evaluator.print_error(mes)
+        raise RuntimeStop(scope.env_dict(env))
+
+
+    def type_error(self, lineno, val0, val1, operator, env, scope, reads):
+        # タスクスタック版は演算の前に文の式の変数をすべて読むので、
+        # まだ読んでいない変数にも 0 を入れておく
+        for slot in reads:
+            if env[slot] is UNSET:
+                env[slot] = 0
+
+        errmes = self.evaluator.message_err_expression(lineno,
+                                                       val0, val1,
+                                                       operator)
+        self.error(errmes, env, scope)
+
+
+    def compile_unknown(self, aNode):
+        node_type = aNode.type
+        node_leaf = aNode.leaf
+        scope = self.scope
+
+        def run(env):
+            print("There is no operation")
+            print(node_type, node_leaf)
+            raise RuntimeStop(scope.env_dict(env))
+
+        return run
+
+
+    # -------------------------------------------------
+    # statements
+    # -------------------------------------------------
+    def sequence(self, statements):
+        if len(statements) == 1:
+            return statements[0]
+
+        if not any([is_generator(statement) for statement in statements]):
+            statements = tuple(statements)
+            def run(env):
+                for statement in statements:
+                    statement(env)
+
+            return run
+
+        statements = tuple((statement, is_generator(statement))
+                           for statement in statements)
+        def run(env):
+            for statement, generator in statements:
+                if generator:
+                    yield from statement(env)
+                else:
+                    statement(env)
+
+        return run
+
+
+    def compile_nop(self, aNode):
+        def run(env):
+            pass
+
+        return run
+
+
+    def compile_stored(self, aNode):
+        """
+        node_store に置いた文（NodeStore.node）。その文だけを Node にして
+        コンパイルする（Node はクロージャが使うものしか残らない）
+        """
+        if aNode.children:
+            # タスクスタックで実行したときに Node にしたもの
+            return self.compile_statement(aNode.children[0])
+
+        return self.compile_statement(
+            self.evaluator.node_store.node(aNode.leaf))
+
+
+    def compile_subst(self, aNode):
+        if aNode.tail_call is not None:
+            return self.compile_tail_call(aNode)
+
+        if aNode.inline is not None:
+            return self.compile_inline(aNode)
+
+        slot = self.scope.slot(aNode.children[0].leaf)
+
+        if has_call(aNode.children[1]):
+            exps = self.compile_call_exps([aNode.children[1]])
+
+            def run(env):
+                (target_value,) = yield from exps(env)
+                if type(target_value) is Array:
+                    target_value = target_value.share()
+
+                env[slot] = target_value
+
+            return run
+
+        (exp,) = self.compile_exps([aNode.children[1]])
+
+        def run(env):
+            target_value = exp(env)
+            if type(target_value) is Array:
+                # 配列の場合、別のオブジェクトとして代入
+                target_value = target_value.share()
+
+            env[slot] = target_value
+
+        return run
+
+
+    def compile_tail_call(self, aNode):
+        """
+        手続きの最後の z := f(...)（Optimizer.mark_tail_calls）。
+        f が定義し直されていなければ、引数の値を TailCall で返す。
+        引数に呼び出しを含むときは、通常の呼び出しにする
+        （Evaluator.eval_tail_call と同じ）。
+        """
+        call_node = aNode.children[1]
+        procedure_name = call_node.leaf
+        tail_call = aNode.tail_call
+        procedure_params = tail_call[1]
+
+        aNode.tail_call = None
+        subst = self.compile_subst(aNode)
+        aNode.tail_call = tail_call
+
+        if any([has_call(call_aparam) for call_aparam in call_node.children]):
+            return subst
+
+        # 引数は後ろから順に計算する
+        args = tuple(self.compile_exps(call_node.children)[::-1])
+
+        # 名前呼びで渡す変数 -> 呼ばれる側の引数（どちらもスロットの番号。
+        # 呼ばれる側は今の手続きなので、同じ Scope になる）
+        scope = self.scope
+        passed = {}
+        for procedure_aparam, call_aparam in zip(procedure_params,
+                                                 call_node.children):
+            if call_aparam.type == 'name':
+                passed[scope.slot(call_aparam.leaf)] = \
+                    scope.slot(procedure_aparam)
+
+        procedures = self.evaluator.procedures
+
+        def run(env):
+            if procedures.get(procedure_name) is not tail_call or \
+               len(procedure_params) != len(args):
+                yield from subst(env)
+                return
+
+            values = []
+            for arg in args:
+                aval = arg(env)
+                if type(aval) is Array:
+                    aval = aval.share()
+                values += [aval]
+            values.reverse()
+
+            raise TailCall(values, passed)
+
+        return run
+
+
+    def compile_inline(self, aNode):
+        """
+        手続きを展開できる z := f(...)（Optimizer.inline_calls）。
+        f が定義し直されていなければ、展開した文を実行する。
+        """
+        inline = aNode.inline
+        procedure_name = aNode.children[1].leaf
+        target = aNode.children[0].leaf
+
+        aNode.inline = None
+        subst = self.compile_subst(aNode)
+        aNode.inline = inline
+
+        if self.evaluator.memo is not None and \
+           self.evaluator.pure_procedures.get(procedure_name) is \
+           inline.procedure:
+            # 結果がキャッシュされる手続きは展開しない
+            return subst
+
+        # 展開する本体は手続きを呼び出さない（Optimizer.inline_calls）
+        statement = self.compile_statement(inline.statement)
+        procedures = self.evaluator.procedures
+        procedure = inline.procedure
+        finish = self.compile_inline_finish(inline, target)
+
+        def run(env):
+            if procedures.get(procedure_name) is not procedure:
+                yield from subst(env)
+                return
+
+            try:
+                statement(env)
+            except RuntimeStop as e:
+                # 手続きを呼び出したときと同じように、手続きの中の環境を表示する
+                raise RuntimeStop(inline.local_env(e.env))
+
+            finish(env)
+
+        return run
+
+
+    def compile_inline_finish(self, inline, target):
+        """
+        展開した文の後で、呼び出しから戻るときと同じことをするクロージャ
+        （InlinedCall.finish をスロットの番号で行う）
+        """
+        scope = self.scope
+        writebacks = tuple((scope.slot(call_name), scope.slot(aparam))
+                           for call_name, aparam in inline.writebacks)
+        ret_slot = scope.slot(inline.retname)
+        local_slots = tuple(scope.slot(name) for name in inline.local_names)
+        target_slot = scope.slot(target)
+
+        def finish(env):
+            for call_slot, param_slot in writebacks:
+                env[call_slot] = env[param_slot]
+
+            # procedure 内で retval が使われていないときは 0 を返すとする
+            retval = env[ret_slot]
+            if retval is UNSET:
+                retval = 0
+            elif type(retval) is Array:
+                retval = retval.share()
+
+            for slot in local_slots:
+                env[slot] = UNSET
+
+            env[target_slot] = retval
+
+        return finish
+
+
+    def compile_array_subst(self, aNode):
+        slot = self.scope.slot(aNode.children[0].leaf)
+
+        def assign(env, value, index_values):
+            # 環境に存在しないときには 空の配列 を作成しておく
+            target = env[slot]
+            if target is UNSET:
+                target = env[slot] = Array()
+
+            if type(value) is Array:
+                # a[i][j] := a のように自分自身を代入するときのために、先に共有しておく
+                value = value.share()
+
+            for i in index_values[:-1]:
+                if type(target) is Array:
+                    # 共有している配列は、ここでコピーしてから書き換える
+                    target = target.writable(i)
+                else:
+                    target[i] = Array()
+                    target = target[i]
+
+            target[index_values[-1]] = value
+
+        # 値の式と index（タスクスタック版では index を後ろから順に、
+        # 最後に値を計算する）
+        nodes = [aNode.children[2]] + aNode.children[1]
+
+        if any([has_call(anexp) for anexp in nodes]):
+            exps = self.compile_call_exps(nodes)
+
+            def run(env):
+                values = yield from exps(env)
+                assign(env, values[0], values[1:])
+
+            return run
+
+        exps = self.compile_exps(nodes)
+        (exp, indexes) = (exps[0], tuple(exps[:0:-1]))
+
+        def run(env):
+            index_values = [index(env) for index in indexes]
+            index_values.reverse()
+            assign(env, exp(env), index_values)
+
+        return run
+
+
+    def compile_unarrayop(self, aNode):
+        slot = self.scope.slot(aNode.children[0].leaf)
+
+        if aNode.leaf == '++':
+            def run(env):
+                value = env[slot]
+                if value is UNSET:
+                    env[slot] = 1
+                else:
+                    env[slot] = value + 1
+
+        else:
+            def run(env):
+                value = env[slot]
+                if value is not UNSET and value > 0:
+                    env[slot] = value - 1
+                else:
+                    env[slot] = 0
+
+        return run
+
+
+    def compile_print(self, aNode):
+        pretty_print_value = self.evaluator.pretty_print_value
+        print_values = self.evaluator.print_values
+
+        if any([has_call(anexp) for anexp in aNode.children]):
+            exps = self.compile_call_exps(aNode.children)
+
+            def run(env):
+                values = yield from exps(env)
+                print_values([pretty_print_value(value) for value in values])
+
+            return run
+
+        # 後ろの式から順に計算する
+        exps = tuple(self.compile_exps(aNode.children)[::-1])
+
+        def run(env):
+            values = [exp(env) for exp in exps]
+            values.reverse()
+            print_values([pretty_print_value(value) for value in values])
+
+        return run
+
+
+    def compile_cond(self, aNode):
+        """
+        while と if の条件。手続きの呼び出しを含むときは、値を返す
+        ジェネレータ関数になる
+        """
+        if has_call(aNode):
+            exps = self.compile_call_exps([aNode])
+
+            def run(env):
+                (value,) = yield from exps(env)
+                return value
+
+            return run
+
+        (exp,) = self.compile_exps([aNode])
+        return exp
+
+
+    def compile_while(self, aNode):
+        if aNode.counter is not None:
+            return self.compile_counting_while(aNode)
+
+        cond = self.compile_cond(aNode.children[0])
+        body = self.compile_statement(aNode.children[1])
+
+        if is_generator(cond) or is_generator(body):
+            # 手続きを呼び出すループ（トレースにはしない）
+            cond_generator = is_generator(cond)
+            body_generator = is_generator(body)
+
+            def run(env):
+                while True:
+                    if cond_generator:
+                        value = yield from cond(env)
+                    else:
+                        value = cond(env)
+                    if value != 1:
+                        return
+
+                    if body_generator:
+                        yield from body(env)
+                    else:
+                        body(env)
+
+            return run
+
+        jit = self.evaluator.jit
+        if jit is not None and jit.is_traceable(aNode):
+            scope = self.scope
+
+            def run(env):
+                # 繰り返しが多くなったらトレースで実行する
+                view = SlotView(scope, env)
+                while not jit.run(aNode, view) and cond(env) == 1:
+                    body(env)
+
+            return run
+
+        def run(env):
+            while cond(env) == 1:
+                body(env)
+
+        return run
+
+
+    def compile_counting_while(self, aNode):
+        """
+        while i < n do begin ...; i++ end の形のループ（Optimizer.count_loop）。
+        i と n が整数値なら、i を Python の整数で数えながら本体を繰り返す。
+        そうでないときは通常の while と同じように実行する。
+        """
+        (var_name, bound, statements) = aNode.counter
+        (cond,) = self.compile_exps([aNode.children[0]])
+
+        # 本体の文は一度だけコンパイルして、両方の実行方法で共有する
+        compiled = [self.compile_statement(statement_node)
+                    for statement_node in statements]
+        body_node = aNode.children[1]
+        if body_node.type == 'multi':
+            # statements の次が i++
+            increment = self.compile_statement(
+                body_node.children[len(statements)])
+        else:
+            increment = self.compile_statement(body_node)
+
+        fused_body = self.sequence(compiled)
+        body = self.sequence(compiled + [increment])
+
+        scope = self.scope
+        slot = scope.slot(var_name)
+        if bound.type == 'number':
+            limit_value = bound.leaf
+            def get_limit(env):
+                return limit_value
+        else:
+            limit_slot = scope.slot(bound.leaf)
+            def get_limit(env):
+                return env[limit_slot]
+
+        if is_generator(body):
+            # 本体で手続きを呼び出すループ（トレースにはしない）
+            def run(env):
+                count = env[slot]
+                limit = get_limit(env)
+
+                if type(count) is int and type(limit) is int:
+                    while count < limit:
+                        yield from fused_body(env)
+                        count += 1
+                        env[slot] = count
+                    return
+
+                while cond(env) == 1:
+                    yield from body(env)
+
+            return run
+
+        jit = self.evaluator.jit
+        if jit is None or not jit.is_traceable(aNode):
+            jit = None
+
+        def run(env):
+            # 未定義の変数は UNSET なので、整数値にはならない
+            count = env[slot]
+            limit = get_limit(env)
+            view = SlotView(scope, env)
+
+            if type(count) is int and type(limit) is int:
+                while count < limit:
+                    if jit is not None and jit.run(aNode, view):
+                        # 残りの繰り返しはトレースで実行した
+                        return
+                    fused_body(env)
+                    count += 1
+                    env[slot] = count
+                return
+
+            while (jit is None or not jit.run(aNode, view)) and \
+                  cond(env) == 1:
+                body(env)
+
+        return run
+
+
+    def compile_if(self, aNode):
+        cond = self.compile_cond(aNode.children[0])
+        then_part = self.compile_statement(aNode.children[1])
+
+        if aNode.leaf == "with-else":
+            else_part = self.compile_statement(aNode.children[2])
+        else:
+            else_part = self.compile_nop(aNode)
+
+        if any([is_generator(part) for part in [cond, then_part, else_part]]):
+            # 手続きを呼び出すとき
+            (cond_generator, then_generator, else_generator) = \
+                [is_generator(part) for part in [cond, then_part, else_part]]
+
+            def run(env):
+                if cond_generator:
+                    value = yield from cond(env)
+                else:
+                    value = cond(env)
+
+                if value == 1:
+                    if then_generator:
+                        yield from then_part(env)
+                    else:
+                        then_part(env)
+                elif else_generator:
+                    yield from else_part(env)
+                else:
+                    else_part(env)
+
+            return run
+
+        if aNode.leaf == "with-else":
+            def run(env):
+                if cond(env) == 1:
+                    then_part(env)
+                else:
+                    else_part(env)
+        else:
+            def run(env):
+                if cond(env) == 1:
+                    then_part(env)
+
+        return run
+
+
+    def compile_multi(self, aNode):
+        return self.sequence([self.compile_statement(statement_node)
+                              for statement_node in aNode.children])
+
+
+    def compile_procedure(self, aNode):
+        define_procedure = self.evaluator.define_procedure
+        name = aNode.leaf
+        children = aNode.children
+
+        def run(env):
+            define_procedure(name, children)
+
+        return run
+
+
+    # -------------------------------------------------
+    # expressions
+    # -------------------------------------------------
+    def compile_constant(self, aNode):
+        value = aNode.leaf
+
+        def run(env):
+            return value
+
+        return run
+
+
+    def compile_name(self, aNode):
+        if aNode in self.captured:
+            # 文を展開したときに読んでおいた値（expand_name）
+            temp = self.captured[aNode]
+
+            def run(env):
+                return env[temp]
+
+            return run
+
+        slot = self.scope.slot(aNode.leaf)
+        self.reads.append(slot)
+
+        def run(env):
+            value = env[slot]
+            if value is UNSET:
+                value = env[slot] = 0
+            return value
+
+        return run
+
+
+    def compile_binop(self, aNode):
+        left = self.compile_exp(aNode.children[0])
+        right = self.compile_exp(aNode.children[1])
+        operator = aNode.leaf
+        lineno = aNode.lineno
+        op = BINOPS[operator]
+        type_error = self.type_error
+        scope = self.scope
+        reads = self.reads
+
+        def run(env):
+            val0 = left(env)
+            val1 = right(env)
+            try:
+                return op(val0, val1)
+            except OperandMismatch:
+                type_error(lineno, val0, val1, operator, env, scope, reads)
+
+        return run
+
+
+    def compile_singleop(self, aNode):
+        exp = self.compile_exp(aNode.children[0])
+
+        def run(env):
+            return op_not(exp(env))
+
+        return run
+
+
+    def compile_builtin(self, aNode):
+        func = BUILTINS[aNode.leaf]
+
+        if aNode.leaf in UNARY_BUILTINS:
+            exp = self.compile_exp(aNode.children)
+
+            def run(env):
+                return func(exp(env))
+
+        elif aNode.leaf in ['left', 'right']:
+            exp0 = self.compile_exp(aNode.children[0])
+            exp1 = self.compile_exp(aNode.children[1])
+
+            def run(env):
+                return func(exp0(env), exp1(env))
+
+        else:
+            exp0 = self.compile_exp(aNode.children[0])
+            exp1 = self.compile_exp(aNode.children[1])
+            exp2 = self.compile_exp(aNode.children[2])
+
+            def run(env):
+                return func(exp0(env), exp1(env), exp2(env))
+
+        return run
+
+
+    def compile_array(self, aNode):
+        # 要素は後ろから順に計算する
+        exps = tuple(self.compile_exp(anexp) for anexp in aNode.children[::-1])
+
+        def run(env):
+            elements = [exp(env) for exp in exps]
+            elements.reverse()
+            return Array(elements)
+
+        return run
+
+
+    def compile_constant_array(self, aNode):
+        value = aNode.leaf
+
+        def run(env):
+            # 毎回新しい配列にする
+            return copy_array(value)
+
+        return run
+
+
+    def compile_array_element(self, aNode):
+        # index は後ろから順に計算する
+        indexes = tuple(self.compile_exp(index)
+                        for index in aNode.children[1][::-1])
+        element = self.element_reader(aNode)
+
+        def run(env):
+            index_values = [index(env) for index in indexes]
+            index_values.reverse()
+            return element(env, index_values)
+
+        return run
+
+
+    def element_reader(self, aNode):
+        """
+        配列の要素 aNode を、index の値のリストから読む関数
+        """
+        slot = self.scope.slot(aNode.children[0].leaf)
+
+        def element(env, index_values):
+            # 環境に存在しないときには 0 を返す
+            target = env[slot]
+            if target is UNSET:
+                return 0
+
+            for i in index_values[:-1]:
+                if type(target) is Array and \
+                   type(target[i]) is Array:
+                    target = target[i]
+                else:
+                    # 巡れないときには 0 を返して終了
+                    return 0
+
+            try:
+                return target[index_values[-1]]
+            except:
+                # last_index にアクセスできないときは 0 を返して終了
+                return 0
+
+        return element
+
+
+    # -------------------------------------------------
+    # expressions with procedure calls
+    # -------------------------------------------------
+    def compile_call_exps(self, nodes):
+        """
+        手続きの呼び出しを含む文の式のリスト nodes を、値のリストを返す
+        ジェネレータ関数にする。
+
+        タスクスタック版は、文の式をまず展開して（変数の値を読み、
+        呼び出す手続きを調べておく）、それから展開したタスクを順に
+        実行する。ここでも、展開するときのことを expand で、実行する
+        ときのことを flatten で、それぞれタスクスタック版と同じ順番に
+        並べる。展開したときに読んだ値は、一時的なスロットに置いておく。
+        """
+        outer_captured = self.captured
+        outer_reads = self.reads
+        self.captured = {}
+        self.reads = []
+        try:
+            expansions = []
+            for aNode in nodes:
+                self.expand(aNode, expansions)
+
+            # 最後の式から実行する
+            steps = []
+            for aNode in nodes[::-1]:
+                self.flatten(aNode, steps)
+        finally:
+            self.captured = outer_captured
+            self.reads = outer_reads
+
+        expansions = tuple(expansions)
+        steps = tuple(steps)
+
+        def run(env):
+            for expand in expansions:
+                expand(env)
+
+            stack = []
+            for step, call in steps:
+                if call:
+                    yield from step(env, stack)
+                else:
+                    step(env, stack)
+
+            stack.reverse()
+            return stack
+
+        return run
+
+
+    def expand(self, aNode, expansions):
+        """
+        式 aNode を展開するときにすること（Evaluator.exp_table）を、
+        同じ順番で expansions に加える
+        """
+        node_type = aNode.type
+
+        if node_type == 'name':
+            expansions += [self.expand_name(aNode)]
+
+        elif node_type == 'call':
+            expansions += [self.expand_call(aNode)]
+
+        elif node_type == 'binop':
+            self.expand(aNode.children[1], expansions)
+            self.expand(aNode.children[0], expansions)
+
+        elif node_type == 'singleop':
+            self.expand(aNode.children[0], expansions)
+
+        elif node_type == 'builtin':
+            if aNode.leaf in UNARY_BUILTINS:
+                self.expand(aNode.children, expansions)
+            else:
+                for anexp in aNode.children[::-1]:
+                    self.expand(anexp, expansions)
+
+        elif node_type == 'array':
+            for anexp in aNode.children:
+                self.expand(anexp, expansions)
+
+        elif node_type == 'array_element':
+            # 配列の変数は要素を読むときに読む
+            for index in aNode.children[1]:
+                self.expand(index, expansions)
+
+
+    def expand_name(self, aNode):
+        """
+        変数の値を読んで（値が入っていないときは 0 を入れて）、
+        一時的なスロットに置いておく
+        """
+        slot = self.scope.slot(aNode.leaf)
+        temp = self.captured[aNode] = self.scope.temp()
+
+        def expand(env):
+            value = env[slot]
+            if value is UNSET:
+                value = env[slot] = 0
+            env[temp] = value
+
+        return expand
+
+
+    def expand_call(self, aNode):
+        """
+        呼び出す手続きを調べて、一時的なスロットに置いておく。
+        手続きが定義されていないときと引数の個数が違うときは、
+        エラーメッセージを表示して None を置く（引数は展開しない）
+        """
+        procedure_name = aNode.leaf
+        lineno = aNode.lineno
+        call_site = self.evaluator.call_site
+        print_error = self.evaluator.print_error
+
+        args = []
+        for call_aparam in aNode.children:
+            self.expand(call_aparam, args)
+        args = tuple(args)
+
+        temp = self.captured[aNode] = self.scope.temp()
+
+        def expand(env):
+            site = call_site(aNode)
+            if site is None:
+                print_error("%d行目: 手続き '%s' が定義されていません。" % (lineno, procedure_name))
+                env[temp] = None
+                return
+
+            # 引数の個数のチェック
+            if site[3] is not None:
+                print_error(site[3])
+                env[temp] = None
+                return
+
+            env[temp] = site
+            for arg in args:
+                arg(env)
+
+        return expand
+
+
+    def flatten(self, aNode, steps):
+        """
+        式 aNode を実行するときの演算と手続きの呼び出しを、
+        タスクスタック版と同じ順番で steps に加える。
+        steps の要素は (step(env, stack), 手続きを呼び出すか) で、
+        値は stack に積む
+        """
+        if not has_call(aNode):
+            exp = self.compile_exp(aNode)
+
+            def step(env, stack):
+                stack.append(exp(env))
+
+            steps += [(step, False)]
+            return
+
+        node_type = aNode.type
+
+        if node_type == 'call':
+            self.flatten_call(aNode, steps)
+            return
+
+        if node_type == 'binop':
+            self.flatten(aNode.children[0], steps)
+            self.flatten(aNode.children[1], steps)
+            step = self.binop_step(aNode)
+
+        elif node_type == 'singleop':
+            self.flatten(aNode.children[0], steps)
+
+            def step(env, stack):
+                stack[-1] = op_not(stack[-1])
+
+        elif node_type == 'builtin' and aNode.leaf in UNARY_BUILTINS:
+            func = BUILTINS[aNode.leaf]
+            self.flatten(aNode.children, steps)
+
+            def step(env, stack):
+                stack[-1] = func(stack[-1])
+
+        elif node_type == 'builtin':
+            func = BUILTINS[aNode.leaf]
+            count = len(aNode.children)
+            for anexp in aNode.children:
+                self.flatten(anexp, steps)
+
+            def step(env, stack):
+                args = stack[-count:]
+                del stack[-count:]
+                stack.append(func(*args))
+
+        elif node_type == 'array':
+            # 要素は後ろから順に計算する
+            count = len(aNode.children)
+            for anexp in aNode.children[::-1]:
+                self.flatten(anexp, steps)
+
+            def step(env, stack):
+                elements = stack[-count:]
+                del stack[-count:]
+                elements.reverse()
+                stack.append(Array(elements))
+
+        else:
+            # array_element の index は後ろから順に計算する
+            count = len(aNode.children[1])
+            for index in aNode.children[1][::-1]:
+                self.flatten(index, steps)
+            element = self.element_reader(aNode)
+
+            def step(env, stack):
+                index_values = stack[-count:]
+                del stack[-count:]
+                index_values.reverse()
+                stack.append(element(env, index_values))
+
+        steps += [(step, False)]
+
+
+    def binop_step(self, aNode):
+        operator = aNode.leaf
+        lineno = aNode.lineno
+        op = BINOPS[operator]
+        type_error = self.type_error
+        scope = self.scope
+
+        def step(env, stack):
+            val1 = stack.pop()
+            val0 = stack.pop()
+            try:
+                stack.append(op(val0, val1))
+            except OperandMismatch:
+                # 文の変数は展開したときに読んである
+                type_error(lineno, val0, val1, operator, env, scope, ())
+
+        return step
+
+
+    def flatten_call(self, aNode, steps):
+        """
+        手続きの呼び出し。展開したときにエラーになっていればここで止まり、
+        そうでなければ引数を後ろから順に計算してから呼び出す
+        """
+        temp = self.captured[aNode]
+        scope = self.scope
+
+        def check(env, stack):
+            if env[temp] is None:
+                # エラーメッセージは展開したときに表示している
+                raise RuntimeStop(scope.env_dict(env))
+
+        steps += [(check, False)]
+        for call_aparam in aNode.children[::-1]:
+            self.flatten(call_aparam, steps)
+        steps += [(self.call_step(aNode, temp), True)]
+
+
+    def call_step(self, aNode, temp):
+        procedure_name = aNode.leaf
+
+        # 名前呼びになる引数の位置と、呼び出し側の変数のスロット
+        scope = self.scope
+        refnames = tuple((i, scope.slot(call_aparam.leaf))
+                         for i, call_aparam in enumerate(aNode.children)
+                         if call_aparam.type == 'name')
+
+        pure_procedures = self.evaluator.pure_procedures
+        memo = self.evaluator.memo
+        procedure_body = self.procedure_body
+        tail_source = self.tail_source
+
+        def step(env, stack):
+            procedure = env[temp][0]
+            (compiled_body, body_scope, generator) = procedure_body(procedure)
+            param_slots = body_scope.param_slots
+            ret_slot = body_scope.ret_slot
+
+            # 手続き用の環境には引数だけを置く（最初の引数が stack の一番上）
+            # （配列は呼び出し側に影響が及ばないようにコピーする）
+            local_env = body_scope.new_env()
+            for slot in param_slots:
+                aval = stack.pop()
+                if type(aval) is Array:
+                    aval = aval.share()
+                local_env[slot] = aval
+
+            # 名前呼びの引数ごとに、書き戻す値を持つ引数のスロット
+            # （None のときは fixed の値を書き戻す）
+            sources = [(call_slot, param_slots[i], None)
+                       for i, call_slot in refnames]
+
+            # 純粋な手続きは、同じ引数の結果がキャッシュにあればそれを使う
+            # （引数は書き換えられないので、渡した値をそのまま書き戻す）
+            key = None
+            if memo is not None and \
+               pure_procedures.get(procedure_name) is procedure:
+                key = memo.key(procedure_name,
+                               [local_env[slot] for slot in param_slots])
+                (found, retval) = memo.lookup(key)
+                if found:
+                    for call_slot, param_slot, fixed in sources:
+                        env[call_slot] = local_env[param_slot]
+                    stack.append(retval)
+                    return
+
+            if generator:
+                while True:
+                    try:
+                        # 本体は run_frames が呼び出し側の上に積んで実行する
+                        yield compiled_body(local_env)
+                        break
+
+                    except TailCall as tail:
+                        # 手続きの最後の自分自身の呼び出し
+                        sources = [tail_source(source, tail, local_env,
+                                               ret_slot)
+                                   for source in sources]
+                        local_env = body_scope.new_env()
+                        for slot, aval in zip(param_slots, tail.values):
+                            local_env[slot] = aval
+            else:
+                compiled_body(local_env)
+
+            # 名前呼びの引数は呼び出し側の環境へ書き戻す
+            for call_slot, param_slot, fixed in sources:
+                if param_slot is None:
+                    env[call_slot] = fixed
+                else:
+                    env[call_slot] = local_env[param_slot]
+
+            # procedure 内で retval が使われていないときは 0 を返すとする
+            retval = local_env[ret_slot]
+            if retval is UNSET:
+                retval = 0
+            if key is not None:
+                memo.store(key, retval)
+            stack.append(retval)
+
+        return step
+
+
+    def tail_source(self, source, tail, local_env, ret_slot):
+        """
+        末尾呼び出しの後で、名前呼びの引数に書き戻す値がどこにあるか
+        """
+        (call_slot, param_slot, fixed) = source
+        if param_slot is None or param_slot == ret_slot:
+            # z := f(...) の z は、呼ばれる側の戻り値になる
+            return source
+
+        if param_slot in tail.passed:
+            return (call_slot, tail.passed[param_slot], None)
+
+        return (call_slot, None, copy.deepcopy(local_env[param_slot]))
+
+
+    def procedure_body(self, procedure):
+        """
+        手続き本体のクロージャ、本体の Scope、クロージャがジェネレータ
+        関数かどうかを返す（はじめて呼ばれたときにコンパイルする）。
+        Scope の先頭のスロットは引数で、param_slots と ret_slot に
+        引数と戻り値の変数のスロットが入っている。
+        """
+        (procedure_retname, procedure_params, body) = procedure
+        try:
+            return self.compiled_bodies[id(body)][1:]
+        except KeyError:
+            scope = Scope(procedure_params)
+            scope.param_slots = tuple(scope.slot(aparam)
+                                      for aparam in procedure_params)
+            scope.ret_slot = scope.slot(procedure_retname)
+
+            outer = (self.scope, self.captured, self.reads)
+            (self.scope, self.captured, self.reads) = (scope, {}, [])
+            try:
+                compiled = self.compile_statement(body)
+            finally:
+                (self.scope, self.captured, self.reads) = outer
+
+            # id が再利用されないように body も保持しておく
+            self.compiled_bodies[id(body)] = (body, compiled, scope,
+                                              is_generator(compiled))
+            return self.compiled_bodies[id(body)][1:]
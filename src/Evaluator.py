@@ -20,9 +20,118 @@
 
 import copy
 import re
+import sys
+
+from src.Compiler import Compiler, RuntimeStop
+from src.BytecodeVM import VM
+from src.Optimizer import Optimizer, is_hidden_name, INLINE_MAX_NODES
+from src.TraceJIT import TraceJIT
+from src.Memo import ProcedureCache, pure_procedures
+from src.NodeStore import NodeStore
+from src.ParserTables import load_parser
+from src.Array import Array
+from src.Operators import (OperandMismatch, BINOPS, BUILTINS, op_not,
+                           copy_array, pretty_print_value, pretty_type,
+                           message_err_expression)
+
+
+# ----------------------------------------------------------------
+# opcodes
+#
+# 構文解析の時点で、ノードの種類（二項演算子、組み込み関数、++/-- は
+# それぞれ別々）を小さな整数にしておき、Node.op に入れる。
+# eval_sentence と eval_exp は、この整数で処理を表から引く。
+# ----------------------------------------------------------------
+(OP_SUBST, OP_REMOVE_CALLPARAMS, OP_CALL, OP_ARRAY_SUBST, OP_ARRAY_ELEMENT,
+ OP_INC, OP_DEC, OP_PRINT, OP_WHILE, OP_IF, OP_MULTI, OP_PROCEDURE,
+ OP_SINGLEOP, OP_BUILTIN, OP_ARRAY, OP_PUSH, OP_CRITICAL_ERROR, OP_NOP,
+ OP_NOP_END_PROCEDURE, OP_NUMBER, OP_STRING, OP_NAME, OP_CONSTANT_ARRAY,
+ OP_STORED, OP_UNKNOWN) = range(25)
+
+# ノードの種類 -> opcode
+NODE_OPCODES = {
+    'remove_callparams': OP_REMOVE_CALLPARAMS,
+    'call': OP_CALL,
+    'array_subst': OP_ARRAY_SUBST,
+    'array_element': OP_ARRAY_ELEMENT,
+    'print': OP_PRINT,
+    'while': OP_WHILE,
+    'if': OP_IF,
+    'multi': OP_MULTI,
+    'procedure': OP_PROCEDURE,
+    'singleop': OP_SINGLEOP,
+    'array': OP_ARRAY,
+    'push': OP_PUSH,
+    'critical_error': OP_CRITICAL_ERROR,
+    'nop': OP_NOP,
+    'nop-end-procedure': OP_NOP_END_PROCEDURE,
+    'number': OP_NUMBER,
+    'string': OP_STRING,
+    'name': OP_NAME,
+    'constant_array': OP_CONSTANT_ARRAY,
+    'stored': OP_STORED,
+}
+
+# 二項演算子と組み込み関数には、一つずつ opcode を割り当てる
+BINOP_OPCODES = {}
+for operator in BINOPS:
+    BINOP_OPCODES[operator] = OP_UNKNOWN + 1 + len(BINOP_OPCODES)
+
+BUILTIN_OPCODES = {}
+for builtin_name in BUILTINS:
+    BUILTIN_OPCODES[builtin_name] = OP_UNKNOWN + 1 + len(BINOP_OPCODES) \
+                                    + len(BUILTIN_OPCODES)
+
+NUM_OPCODES = OP_UNKNOWN + 1 + len(BINOP_OPCODES) + len(BUILTIN_OPCODES)
+
+# children が Node 一つだけの組み込み関数
+UNARY_BUILTIN_OPCODES = frozenset(BUILTIN_OPCODES[name]
+                                  for name in ['len', 'int', 'str'])
+
+# opcode -> 演算を行う関数（二項演算子と組み込み関数のみ）
+OPCODE_FUNCS = [None] * NUM_OPCODES
+for operator, op in BINOP_OPCODES.items():
+    OPCODE_FUNCS[op] = BINOPS[operator]
+for builtin_name, op in BUILTIN_OPCODES.items():
+    OPCODE_FUNCS[op] = BUILTINS[builtin_name]
+
+
+def node_opcode(type, leaf):
+    if type == 'binop':
+        if leaf == ':=':
+            return OP_SUBST
+        return BINOP_OPCODES.get(leaf, OP_UNKNOWN)
+
+    elif type == 'unarrayop':
+        if leaf == '++':
+            return OP_INC
+        return OP_DEC
+
+    elif type == 'builtin':
+        return BUILTIN_OPCODES.get(leaf, OP_BUILTIN)
+
+    return NODE_OPCODES.get(type, OP_UNKNOWN)
+
+
+
+# 手続きの呼び出しを含まなければ、その場で値を計算できる式
+PURE_LEAF_OPCODES = frozenset([OP_NUMBER, OP_STRING, OP_NAME,
+                               OP_CONSTANT_ARRAY])
+PURE_OPCODES = frozenset([OP_SINGLEOP, OP_ARRAY, OP_ARRAY_ELEMENT]
+                         + list(BINOP_OPCODES.values())
+                         + list(BUILTIN_OPCODES.values()))
+
+
+
+# 子を持たない Node の children（すべての葉で共有する）
+NO_CHILDREN = ()
+
 
 
 class Node:
+    __slots__ = ('type', 'children', 'leaf', 'lineno', 'op', 'pure_lineno',
+                 'counter', 'tail_call', 'call_site', 'inline')
+
     def __init__(self, type, leaf=None, children=None, lineno=0):
         """
         Node(type, leaf, children)
@@ -30,16 +139,58 @@ class Node:
          type には "name"、"while" などの識別子
          leaf には int や string などの値
          children には複数 node のための  NodeList （while や if などで使う）
+         children がないときは、書き換えられない NO_CHILDREN になる
         """
         self.type = type
         
         if children:
             self.children = children
         else:
-            self.children = []
+            self.children = NO_CHILDREN
             
         self.leaf = leaf
         self.lineno = lineno
+        self.op = node_opcode(type, leaf)
+
+        # 直接計算できる式の行番号（mark_pure を参照）
+        self.pure_lineno = None
+
+        # 数え上げのループの while のときは (変数名, 上限の Node, 本体の文)
+        # （Optimizer.count_loop を参照）
+        self.counter = None
+
+        # 手続きの最後の自分自身の呼び出しのときは、その手続きの情報
+        # （Optimizer.mark_tail_calls を参照）
+        self.tail_call = None
+
+        # 手続きの呼び出しのときは、呼び出す手続きの情報（Evaluator.call_site を参照）
+        self.call_site = None
+
+        # 手続きを展開できる z := f(...) のときは、その InlinedCall
+        # （Optimizer.inline_calls を参照）
+        self.inline = None
+
+
+    def __deepcopy__(self, memo):
+        """
+        call_site は覚えておいた手続きの Node を指すので、コピーには
+        含めない（GUI で1行ごとに状態をコピーしても、古いコピーが
+        連なっていかないようにする）
+        """
+        result = Node.__new__(Node)
+        memo[id(self)] = result
+        for name in Node.__slots__:
+            setattr(result, name, copy.deepcopy(getattr(self, name), memo))
+        result.call_site = None
+        return result
+
+
+    def retype(self, type):
+        """
+        ノードの種類を変更する（opcode も合わせて変更する）
+        """
+        self.type = type
+        self.op = node_opcode(type, self.leaf)
 
     def print(self):            
         print("lineno=%d type=%s leaf=%s" % (self.lineno,self.type, self.leaf))
@@ -79,6 +230,84 @@ class Node:
 
             
 
+def mark_pure(aNode):
+    """
+    構文木を走査して、手続きの呼び出しを含まない式の部分木に
+    pure_lineno を付ける。pure_lineno は、部分木の演算がすべて
+    同じ行にあるときのその行番号（値を積むだけの式のときは 0）。
+    複数の行にまたがる式や、それ以外の Node は None のままにする。
+    """
+    if type(aNode.children) is Node:
+        # len、int、str の引数
+        children = [aNode.children]
+    else:
+        children = []
+        for child in aNode.children:
+            if type(child) is Node:
+                children += [child]
+            elif type(child) is list:
+                children += [x for x in child if type(x) is Node]
+
+    for child in children:
+        mark_pure(child)
+
+    if aNode.op in PURE_LEAF_OPCODES:
+        aNode.pure_lineno = 0
+        return
+
+    if aNode.op not in PURE_OPCODES:
+        return
+
+    lines = set([aNode.lineno])
+    for child in children:
+        if child.pure_lineno is None:
+            return
+        if child.pure_lineno != 0:
+            lines.add(child.pure_lineno)
+
+    if len(lines) == 1:
+        aNode.pure_lineno = aNode.lineno
+
+
+
+# 構文解析で Node の代わりに使う NodeStore（Evaluator.setup で設定する）
+Node_store = None
+
+def new_node(type, leaf=None, children=None, lineno=0):
+    """
+    構文解析で作る Node。Node_store があるときは、Node は作らずに
+    Node_store に加えて、その番号を返す（children の Node も番号になる）
+    """
+    if Node_store is None:
+        return Node(type, leaf, children, lineno)
+
+    return Node_store.add(type, leaf, children, lineno)
+
+
+def end_procedure(body, lineno):
+    """
+    手続きの本体 body の最後に nop-end-procedure の文を置く
+    （手続きから戻る前に、手続きの中の環境を表示するため）
+    """
+    if Node_store is not None:
+        if Node_store.type(body) == 'multi':
+            last_elem = Node_store.children(body)[-1]
+            Node_store.retype(last_elem, 'nop-end-procedure')
+            return body
+
+    elif body.type == 'multi':
+        stms = body.children
+        last_elem = stms.pop()
+        last_elem.retype('nop-end-procedure')
+        body.children = stms + [last_elem]
+        return body
+
+    # multi 以外の statement
+    dummy_line = new_node("nop-end-procedure", lineno=lineno)
+    return new_node("multi", "", [body, dummy_line], lineno=lineno)
+
+
+
 GUI_mode = False
 Callback = None
 
@@ -238,105 +467,93 @@ def p_statement(t):
     if len(t) >= 3:
         if t[2] == ':=':
             # NAME SUBST expression
-            t[0] = Node("binop", ":=", [Node("name",t[1]),t[3]],
-                        lineno=t.lineno(2))
+            t[0] = new_node("binop", ":=", [new_node("name",t[1]),t[3]],
+                            lineno=t.lineno(2))
                 
         elif t[1] == 'begin':
             if t[2] == 'end':
                 # BEGIN END                
-                t[0] = Node("nop", lineno=t.lineno(1))
+                t[0] = new_node("nop", lineno=t.lineno(1))
             else:
                 # BEGIN statements END
-                dummy_line = Node("nop", lineno=t.lineno(3))
-                t[0] = Node("multi", "", t[2] + [dummy_line], lineno=t.lineno(1))
+                dummy_line = new_node("nop", lineno=t.lineno(3))
+                t[0] = new_node("multi", "", t[2] + [dummy_line], lineno=t.lineno(1))
             
         elif len(t) >= 4 and t[3] == ':=' and (t[1] != 'procedure'):
             # NAME array_nest SUBST expression
-            t[0] = Node("array_subst", "",
-                        [Node("name",t[1]), t[2], t[4]],
-                        lineno=t.lineno(3))
+            t[0] = new_node("array_subst", "",
+                            [new_node("name",t[1]), t[2], t[4]],
+                            lineno=t.lineno(3))
 
                 
         elif t[2] == '++':
             # NAME INC
-            t[0] = Node('unarrayop', '++', [Node("name",t[1])],
-                        lineno=t.lineno(2))
+            t[0] = new_node('unarrayop', '++', [new_node("name",t[1])],
+                            lineno=t.lineno(2))
             
         elif t[2] == '--':
-            t[0] = Node('unarrayop', '--', [Node("name",t[1])],
-                        lineno=t.lineno(2))
+            t[0] = new_node('unarrayop', '--', [new_node("name",t[1])],
+                            lineno=t.lineno(2))
             
         elif t[1] == 'print':
             # PRINT print_param
-            t[0] = Node("print", "", t[2],
-                        lineno=t.lineno(1))
+            t[0] = new_node("print", "", t[2],
+                            lineno=t.lineno(1))
             
         elif t[1] == 'while':
             if len(t) == 5:
                 # WHILE expression DO statement
-                t[0] = Node("while", "", [t[2], t[4]],
-                            lineno=t.lineno(1))
+                t[0] = new_node("while", "", [t[2], t[4]],
+                                lineno=t.lineno(1))
             else:
                 # WHILE expression DO
-                t[0] = Node("while", "", [t[2], Node("nop")],
-                            lineno=t.lineno(1))
+                t[0] = new_node("while", "", [t[2], new_node("nop")],
+                                lineno=t.lineno(1))
                 
         elif t[1] == 'if':
             if len(t) == 7:
                 # IF expression THEN statement ELSE statement
-                t[0] = Node("if", "with-else", [t[2], t[4], t[6]],
-                            lineno=t.lineno(1))
+                t[0] = new_node("if", "with-else", [t[2], t[4], t[6]],
+                                lineno=t.lineno(1))
                 
             elif len(t) == 6:
                 if t[4] == 'else':
                     # IF expression THEN ELSE statement
-                    t[0] = Node("if", "with-else", [t[2], Node("nop"), t[5]],
-                                lineno=t.lineno(1))
+                    t[0] = new_node("if", "with-else", [t[2], new_node("nop"), t[5]],
+                                    lineno=t.lineno(1))
                 else:
                     # IF expression THEN statement ELSE                    
-                    t[0] = Node("if", "with-else", [t[2], t[4], Node("nop")],
-                                lineno=t.lineno(1))
+                    t[0] = new_node("if", "with-else", [t[2], t[4], new_node("nop")],
+                                    lineno=t.lineno(1))
                     
             elif len(t) == 5:
                 if t[4] == 'else':
                     # IF expression THEN ELSE
-                    t[0] = Node("if", "with-else",
-                                [t[2], Node("nop"), Node("nop")],
-                                lineno=t.lineno(1))
+                    t[0] = new_node("if", "with-else",
+                                    [t[2], new_node("nop"), new_node("nop")],
+                                    lineno=t.lineno(1))
                 else:
                     # IF expression THEN statement                    
-                    t[0] = Node("if", "without-else", [t[2], t[4]],
-                                lineno=t.lineno(1))           
+                    t[0] = new_node("if", "without-else", [t[2], t[4]],
+                                    lineno=t.lineno(1))           
             else:
                 # IF expression THEN
-                t[0] = Node("if", "without-else", [t[2], Node("nop")],
-                            lineno=t.lineno(1))
+                t[0] = new_node("if", "without-else", [t[2], new_node("nop")],
+                                lineno=t.lineno(1))
                 
         elif t[1] == 'procedure':
             if len(t) == 8:
                 # PROCEDURE NAME SUBST NAME procedure_argument COLON statement
 
                 # 環境表示用の工夫
-                if t[7].type == 'multi':
-                    stms = t[7].children
-                    last_elem = stms.pop()
-                    last_elem.type = 'nop-end-procedure'
-                    t[7].children = stms + [last_elem]
-                    
-                else:
-                    # multi 以外の statement
-                    lineno = t.lineno(1)
-                    dummy_line = Node("nop-end-procedure", lineno=lineno)
-
-                    t[7] = Node("multi", "", [t[7], dummy_line],
-                                lineno=lineno)
+                t[7] = end_procedure(t[7], t.lineno(1))
                     
-                t[0] = Node("procedure", t[4], [t[2], t[5], t[7]],
-                            lineno=t.lineno(1))
+                t[0] = new_node("procedure", t[4], [t[2], t[5], t[7]],
+                                lineno=t.lineno(1))
             else:
                 # PROCEDURE NAME SUBST NAME procedure_argument COLON
-                t[0] = Node("procedure", t[4], [t[2], t[5], Node("nop")],
-                            lineno=t.lineno(1))
+                t[0] = new_node("procedure", t[4], [t[2], t[5], new_node("nop")],
+                                lineno=t.lineno(1))
 
     #elif len(t) == 2:
     #    t[0] = Node("evalexp", "", [t[1]], lineno=t.lineno(1))
@@ -351,13 +568,15 @@ def p_statements(t):
 
     '''
     if t[1] == ';':
-        t[0] = [Node("nop")]
+        t[0] = [new_node("nop")]
     elif len(t) == 2:
         t[0] = [t[1]]
     elif len(t) == 3:
         t[0] = t[1]
     else:
-        t[0] = t[1] + [t[3]]
+        # 長い begin ... end でも線形時間になるように、リストに足していく
+        t[1].append(t[3])
+        t[0] = t[1]
 
         
         
@@ -426,7 +645,7 @@ def p_expression_binop(t):
                   | expression AND expression
                   | expression OR expression
     '''
-    t[0] = Node("binop", t[2], [t[1],t[3]], lineno=t.lineno(2))
+    t[0] = new_node("binop", t[2], [t[1],t[3]], lineno=t.lineno(2))
 
 
 def p_expression_builtin(t):
@@ -439,27 +658,27 @@ def p_expression_builtin(t):
 
     '''
     if t[1] == 'len':
-        t[0] = Node("builtin", 'len', t[3], lineno=t.lineno(1))
+        t[0] = new_node("builtin", 'len', t[3], lineno=t.lineno(1))
     elif t[1] == 'left':
-        t[0] = Node("builtin", 'left', [t[3],t[5]], lineno=t.lineno(1))
+        t[0] = new_node("builtin", 'left', [t[3],t[5]], lineno=t.lineno(1))
     elif t[1] == 'right':
-        t[0] = Node("builtin", 'right', [t[3],t[5]], lineno=t.lineno(1))
+        t[0] = new_node("builtin", 'right', [t[3],t[5]], lineno=t.lineno(1))
     elif t[1] == 'mid':
-        t[0] = Node("builtin", 'mid', [t[3],t[5],t[7]], lineno=t.lineno(1))
+        t[0] = new_node("builtin", 'mid', [t[3],t[5],t[7]], lineno=t.lineno(1))
     elif t[1] == 'int':
-        t[0] = Node("builtin", 'int', t[3], lineno=t.lineno(1))
+        t[0] = new_node("builtin", 'int', t[3], lineno=t.lineno(1))
     else:
-        t[0] = Node("builtin", 'str', t[3], lineno=t.lineno(1))
+        t[0] = new_node("builtin", 'str', t[3], lineno=t.lineno(1))
     
 
 def p_expression_call(t):
     'expression : NAME print_param'
-    t[0] = Node("call", t[1], t[2], lineno=t.lineno(1))
+    t[0] = new_node("call", t[1], t[2], lineno=t.lineno(1))
 
     
 def p_expression_not(t):
     'expression : NOT LPAREN expression RPAREN'
-    t[0] = Node("singleop", "not", [t[3]], lineno=t.lineno(1))
+    t[0] = new_node("singleop", "not", [t[3]], lineno=t.lineno(1))
     
     
 def p_expression_group(t):
@@ -468,7 +687,7 @@ def p_expression_group(t):
 
 def p_expression_number(t):
     'expression : NUMBER'
-    t[0] = Node("number", t[1], lineno=t.lineno(1))
+    t[0] = new_node("number", t[1], lineno=t.lineno(1))
 
 
 def p_expression_array(t):
@@ -476,28 +695,29 @@ def p_expression_array(t):
                   | ARRAY_L print_params ARRAY_R
     '''
     if t[2] == ']':
-        t[0] = Node("array", '', [], lineno=t.lineno(1))
+        t[0] = new_node("array", '', [], lineno=t.lineno(1))
     else:
-        t[0] = Node("array", '', t[2], lineno=t.lineno(1))
+        t[0] = new_node("array", '', t[2], lineno=t.lineno(1))
 
 
 def p_expression_array_element(t):
     '''expression : NAME array_nest
     '''
 
-    t[0] = Node("array_element", "",
-                [Node("name",t[1]), t[2]], lineno=t.lineno(1))
+    t[0] = new_node("array_element", "",
+                    [new_node("name",t[1]), t[2]], lineno=t.lineno(1))
 
     
 def p_expression_ccode_string(t):
     '''expression : CSTR
     '''
-    t[0] = Node("string", t[1], [], lineno=t.lineno(1))
+    # 両側の " は除いて持つ（表示するときに pretty_print_value で付ける）
+    t[0] = new_node("string", t[1][1:-1], [], lineno=t.lineno(1))
     
     
 def p_expression_name(t):
     'expression : NAME'
-    t[0] = Node("name", t[1], [], lineno=t.lineno(1))
+    t[0] = new_node("name", t[1], [], lineno=t.lineno(1))
     
 
 
@@ -526,20 +746,39 @@ def p_error(t):
         myprint("%d行目: 文が途中で終了しています。\n" % (My_lineno-1), error=True)
 
 
-import ply.yacc as yacc
-parser = yacc.yacc(start='statement', write_tables=False, debug=False)
+# parser は最初に構文解析するときに作る（表は src/ParserTables.py）
+#import ply.yacc as yacc
 #parser = yacc.yacc(debug=True)
+parser = None
+
+def get_parser():
+    global parser
+    if parser is None:
+        parser = load_parser(sys.modules[__name__], start='statement')
+    return parser
 
 # ----------------------------------------------------------------
 My_lineno = 1
 
+class ExpressionError(Exception):
+    """
+    式を直接計算できないときに投げる例外（値の入っていない変数を
+    読むときと、演算がエラーになるとき）。エラーメッセージは表示しない
+    """
+    pass
+
+
 class Task:
+    __slots__ = ('node', 'cnt')
+
     def __init__(self, node, cnt=1):
         self.node = node
         self.cnt = cnt
         
 
 class Stack:
+    __slots__ = ('stack', 'name')
+
     def __init__(self, name=""):
         self.stack = []
         self.name = name
@@ -600,7 +839,29 @@ class Stack:
         
 
 class Evaluator:
-    def __init__(self, GUI, callback=None):
+    def __init__(self, GUI, callback=None, engine="task", optimize=True,
+                 jit=True, memoize=False, inline_threshold=INLINE_MAX_NODES,
+                 node_store=False):
+        """
+        Evaluator(GUI, callback, engine, optimize, jit, memoize,
+                  inline_threshold, node_store)
+
+         engine が "task" のときは、1行ずつの実行をタスクスタックで行い、
+         通常実行（eval_all）はクロージャにコンパイルして行う。
+         engine が "vm" のときは、どちらもバイトコードの VM で行う。
+         optimize が True のときは、setup で構文木を最適化する（Optimizer.py）。
+         jit が True のときは、eval_all で何度も繰り返す while を
+         トレースにして実行する（TraceJIT.py）。
+         memoize が True のときは、eval_all で純粋な手続きの結果を
+         引数の値ごとにキャッシュする（Memo.py）。memo.hits と memo.misses で
+         キャッシュが使われた回数と使われなかった回数がわかる。
+         eval_all では、本体の Node の個数が inline_threshold 以下の手続きの
+         呼び出しを、呼び出しの位置に展開して実行する（0 のときは展開しない）。
+         node_store が True のときは、setup で構文木を Node ではなく
+         NodeStore（NodeStore.py）に置き、文は実行するときに Node にする。
+         とても大きなプログラム向けで、構文木の最適化と、手続きの展開・
+         結果のキャッシュ・while のトレースは行わない。
+        """
 
         # environment
         self.env = {}
@@ -608,6 +869,33 @@ class Evaluator:
         # dictionary of global names and procedures
         self.procedures = {}
         
+        # execution engine ("task" or "vm")
+        self.engine = engine
+        self.vm = VM(self)
+
+        # 構文木の最適化を行うか
+        self.optimize = optimize
+
+        # 構文木を NodeStore に置くか（置いたものは setup で self.node_store）
+        self.use_node_store = node_store
+        self.node_store = None
+        self.inline_threshold = inline_threshold
+
+        # 繰り返しの多い while をトレースにするか（setup ごとに作り直す）
+        if jit:
+            self.jit = TraceJIT(self)
+        else:
+            self.jit = None
+
+        # 純粋な手続きの結果のキャッシュ（setup ごとに作り直す）
+        if memoize:
+            self.memo = ProcedureCache()
+        else:
+            self.memo = None
+
+        # 純粋な手続きの名前 -> procedure の Node の children（setup で更新）
+        self.pure_procedures = {}
+        
         # stacks for tasks
         self.task = Stack("task")
         self.values = Stack("value")
@@ -619,6 +907,11 @@ class Evaluator:
         Callback = callback
         GUI_mode = GUI
 
+        # opcode -> 処理（eval_sentence 用と eval_exp 用）
+        self.sentence_table = self.make_sentence_table()
+        self.exp_table = self.make_exp_table()
+        self.direct_table = self.make_direct_table()
+
         # regexp
         self.reg_procedure = re.compile('\\b%s\\b' % 'procedure', re.I)
         self.reg_begin = re.compile('\\b%s\\b' % 'begin', re.I)
@@ -630,9 +923,24 @@ class Evaluator:
         # -------------------------------------------------
         # line number in one-step evaluation (0 means not running)
         self.onestep_lineno = 0
+
+        # setup 直後で、まだ1ステップも実行していないか
+        # （eval_all はこのときだけコンパイル版で実行する）
+        self.is_fresh = False
+
+        # eval_all でタスクスタックを最後まで実行している途中か
+        # （このときだけ数え上げのループをまとめて実行する）
+        self.running_all = False
+
+        # setup で得られたトップレベルの文
+        self.node_list = []
+
+        # 最適化のパスの名前 -> 取り除いた Node の個数（setup で更新）
+        self.optimizer_report = {}
    
 
     def set_env(self, param):
+        self.is_fresh = False
         self.env = param['env']
         try:
             self.task = param['task']
@@ -642,6 +950,9 @@ class Evaluator:
         except:
             pass
 
+        if 'vm' in param:
+            self.vm.state = param['vm']
+
         
     def clear_stack(self):        
         self.task.clear()
@@ -650,829 +961,953 @@ class Evaluator:
         self.name_ref.clear()
         self.env = {}
         self.procedures = {}
+        self.node_list = []
+        self.vm.state = None
+        self.is_fresh = False
         
         
     def pretty_print_value(self, value):
-        result = ""
-        if type(value) is int:
-            result = "{}".format(value)
-            return result
-
-        elif type(value) is str:
-            result = "{}".format(value)
-            return result
-
-        elif type(value) is dict:
-            array_value_list = []
-            value_key = value.keys()
-            if len(value_key) == 0:
-                return "[]"
-            
-            for i in range(0, max(value_key) + 1):
-                if i in value_key:
-                    retstr = self.pretty_print_value(value[i])
-                else:
-                    retstr = "0"
-                    
-                array_value_list += [retstr]
-
-            result = "[{}]".format(", ".join(array_value_list))
-            return result
+        return pretty_print_value(value)
         
 
     def pretty_env(self, env):
         pretty_env = {}
         
         for key, value in env.items():
+            if is_hidden_name(key):
+                # 最適化で作った変数は表示しない
+                continue
             pretty_env[key] = self.pretty_print_value(value)
 
         return pretty_env
         
 
     def pretty_type(self, val):
-        if type(val) is int:
-            return "整数値"
-        elif type(val) is str:
-            return "文字列"
-        else:
-            return "配列"
+        return pretty_type(val)
 
 
     def message_err_expression(self, lineno, val0, val1, operator):
-        errmes = "%d行目：「%s %s %s」はできません。"
-        errmes = errmes % (lineno,
-                           self.pretty_type(val0),
-                           operator,
-                           self.pretty_type(val1))
-        return errmes
-    
-    
-    def eval_sentence(self, task):
-        global GUI_mode, My_lineno
-
-        aNode = task.node
-        cnt = task.cnt
-        
-        if aNode.type == 'binop':
-            if aNode.leaf == ":=":
-                if cnt==1:
-                    self.task.push(Task(aNode, cnt=2))
-                    self.eval_exp(aNode.children[1])
-                    
-                elif cnt==2:
-                    target_value = self.values.pop()
-                    var_name = aNode.children[0].leaf
-                    
-                    if type(target_value) is dict:
-                        # dict（array） の場合、別のオブジェクトとして代入
-                        # （もとのオブジェクトに影響が及んでしまう）
-                        target_value = copy.deepcopy(target_value)
-                        
-                    self.env[var_name] = target_value
+        return message_err_expression(lineno, val0, val1, operator)
 
-                    
-                    return
-                
-            else:
-                if cnt==2:
-                    #print(aNode.toStr())
-                    
-                    val1 = self.values.pop()            
-                    val0 = self.values.pop()
-
-                    if aNode.leaf not in ['+', '*', '=', '!=',
-                                          '<', '>', '<=', '>=']:
-                        if not(type(val0) is int) and not(type(val1) is int):
-                        
-                            errmes = self.message_err_expression(aNode.lineno,
-                                                                 val0, val1,
-                                                                 aNode.leaf)
-                            myprint(errmes, error=True)
-                            self.task.push(Task(Node('critical_error')))
-                            return
-                        
-
-                    if aNode.leaf == "+":
-                        if type(val0) is int and type(val1) is int:
-                            result = val0+val1
-
-                        elif type(val0) is str and type(val1) is str:
-                            # 文字列との連結処理
-                            val0 = val0[1:-1]
-                            val1 = val1[1:-1]
-                            result = '"' + val0 + val1 + '"'
-                            
-
-                        elif type(val0) is dict and type(val1) is dict:
-                            result = copy.deepcopy(val0)
-                            if len(val0) > 0:
-                                max_index = max(val0.keys()) + 1
-                            else:
-                                max_index = 0
-                                
-                            for key, value in val1.items():
-                                result[max_index + key] = value
-
-                            
-
-                        else:
-                            errmes = self.message_err_expression(aNode.lineno,
-                                                                 val0, val1,
-                                                                 aNode.leaf)
-                            myprint(errmes, error=True)
-                            self.task.push(Task(Node('critical_error')))
-                            return
-
-                        
-                    elif aNode.leaf == "-":
-                        
-                        result = val0-val1
-                        if result < 0: result=0
-                        
-                        
-                    elif aNode.leaf == "*":
-                        if type(val0) is int and type(val1) is int:
-                            result = val0*val1
-
-                        elif type(val0) is str and type(val1) is int:
-                            val0 = val0[1:-1]
-                            result = '"' + val0 * val1 + '"'
-                            
-                        else:
-                            errmes = self.message_err_expression(aNode.lineno,
-                                                                 val0, val1,
-                                                                 aNode.leaf)
-                            myprint(errmes, error=True)
-                            self.task.push(Task(Node('critical_error')))
-                            return
-                            
-
-                    elif aNode.leaf == "div":
-                        result = int(val0/val1)
-
-                    elif aNode.leaf == "mod":
-                        result = val0%val1
-
-                    elif aNode.leaf == "!=":
-                        if val0 != val1:
-                            result = 1
-
-                        else:
-                            result = 0
-
-                    elif aNode.leaf == "=":
-                        if val0 == val1:
-                            self.values.push(1)
-                            return 
-                        else:
-                            self.values.push(0)
-                            return
-
-                    elif aNode.leaf == ">=":
-                        if (type(val0) is int and type(val1) is int) or \
-                           (type(val0) is str and type(val1) is str):
-                            if val0 >= val1:
-                                result = 1
-                            else:
-                                result = 0
-                        else:
-                            errmes = self.message_err_expression(aNode.lineno,
-                                                                 val0, val1,
-                                                                 aNode.leaf)
-                            myprint(errmes, error=True)
-                            self.task.push(Task(Node('critical_error')))
-                            return
-
-
-                    elif aNode.leaf == ">":
-                        if (type(val0) is int and type(val1) is int) or \
-                           (type(val0) is str and type(val1) is str):
-                            if val0 > val1:
-                                result = 1
-                            else:
-                                result = 0
-                        else:
-                            errmes = self.message_err_expression(aNode.lineno,
-                                                                 val0, val1,
-                                                                 aNode.leaf)
-                            myprint(errmes, error=True)
-                            self.task.push(Task(Node('critical_error')))
-                            return
-                                
-
-                    elif aNode.leaf == "<=":
-                        if (type(val0) is int and type(val1) is int) or \
-                           (type(val0) is str and type(val1) is str):
-                            if val0 <= val1:
-                                result = 1
-                            else:
-                                result = 0
-                        else:
-                            errmes = self.message_err_expression(aNode.lineno,
-                                                                 val0, val1,
-                                                                 aNode.leaf)
-                            myprint(errmes, error=True)
-                            self.task.push(Task(Node('critical_error')))
-                            return
-                            
-
-                    elif aNode.leaf == "<":
-                        if (type(val0) is int and type(val1) is int) or \
-                           (type(val0) is str and type(val1) is str):
-                            if val0 < val1:
-                                result = 1
-                            else:
-                                result = 0
-                        else:
-                            errmes = self.message_err_expression(aNode.lineno,
-                                                                 val0, val1,
-                                                                 aNode.leaf)
-                            myprint(errmes, error=True)
-                            self.task.push(Task(Node('critical_error')))
-                            return
-                                
-
-                    elif aNode.leaf == "and":
-                        if (val0 ==1) and (val1 == 1):
-                            result = 1
-                        else:
-                            result = 0
-
-
-                    elif aNode.leaf == "or":
-                        if (val0 ==1) or (val1 == 1):
-                            result = 1
-                        else:
-                            result = 0
-
-                    # 結果を value stack へ push
-                    try:
-                        self.task.push(Task(Node('push', result)))
-                    except:
-                        print("error: binop " + aNode.leaf)
-                        
-                    return
 
-            return
+    def print_values(self, result_vals):
+        global GUI_mode, My_lineno
         
-        elif aNode.type == 'remove_callparams':
-            params = aNode.children[0]
-            
-            for aparam in params:
-                aval = self.values.pop()
-                self.env[aparam] = aval
+        if GUI_mode == False:
+            lineno_indent = " " * (len(str(My_lineno-1)) + 5)
+            print(lineno_indent + " ".join(result_vals) + "\n")
+        else:
+            myprint(" ".join(result_vals))
 
-            remove_target = [x for x in self.env.keys() if x not in params]
 
-            # 今の環境から、引数以外の変数情報を消去
-            for param in remove_target:
-                self.env.pop(param, None)
+    def print_error(self, mes):
+        myprint(mes, error=True)
+    
+    
+    def make_sentence_table(self):
+        table = [self.eval_unknown] * NUM_OPCODES
+
+        table[OP_SUBST] = self.eval_subst
+        table[OP_REMOVE_CALLPARAMS] = self.eval_remove_callparams
+        table[OP_CALL] = self.eval_call
+        table[OP_ARRAY_SUBST] = self.eval_array_subst
+        table[OP_ARRAY_ELEMENT] = self.eval_array_element
+        table[OP_INC] = self.eval_inc
+        table[OP_DEC] = self.eval_dec
+        table[OP_PRINT] = self.eval_print
+        table[OP_WHILE] = self.eval_while
+        table[OP_IF] = self.eval_if
+        table[OP_MULTI] = self.eval_multi
+        table[OP_PROCEDURE] = self.eval_procedure
+        table[OP_SINGLEOP] = self.eval_singleop
+        table[OP_ARRAY] = self.eval_array
+        table[OP_PUSH] = self.eval_push
+        table[OP_CRITICAL_ERROR] = self.eval_critical_error
+        table[OP_NOP] = self.eval_nop
+        table[OP_NOP_END_PROCEDURE] = self.eval_nop
+        table[OP_STORED] = self.eval_stored
+
+        for op in BINOP_OPCODES.values():
+            table[op] = self.eval_binop
+        for op in BUILTIN_OPCODES.values():
+            table[op] = self.eval_builtin
+
+        return table
+
+
+    def make_exp_table(self):
+        table = [self.exp_unknown] * NUM_OPCODES
+
+        table[OP_SINGLEOP] = self.exp_singleop
+        table[OP_NUMBER] = self.exp_constant
+        table[OP_STRING] = self.exp_constant
+        table[OP_NAME] = self.exp_name
+        table[OP_CONSTANT_ARRAY] = self.exp_constant_array
+        table[OP_ARRAY] = self.exp_array
+        table[OP_ARRAY_ELEMENT] = self.exp_array_element
+        table[OP_CALL] = self.exp_call
+
+        for op in BINOP_OPCODES.values():
+            table[op] = self.exp_binop
+        for op in BUILTIN_OPCODES.values():
+            if op in UNARY_BUILTIN_OPCODES:
+                table[op] = self.exp_unary_builtin
+            else:
+                table[op] = self.exp_builtin
 
-                
-            return
-            
-        elif aNode.type == 'call':
-            if cnt == 2:
-                # procedure call の後始末（環境を整える）
-                procedure_retname = aNode.children[0]
-                refnames = aNode.children[1]
-                
-                orig_env = self.dump.pop()
-
-                for proc_arg, call_name in refnames.items():
-                    try:
-                        orig_env[call_name] = self.env[proc_arg]
-                    except:
-                        print("Error!")
-                        print("orig_env")
-                        print(orig_env)
-                        print("call_name", call_name)
-                        print("self.env")
-                        print(self.env)
-                        print("proc_arg", proc_arg)
-                        print("orig_env[call_name]")
-                        print("self.env[proc_arg]")
-                
-                
-                try:
-                    retval = self.env[procedure_retname]
-                except:
-                    # procedure 内で retval が使われていないときは 0 を返すとする
-                    retval = 0
-
-                self.env = orig_env
-                self.task.push(Task(Node('push', retval)))
-                
+        return table
 
-        elif aNode.type == 'array_subst':
-            if cnt == 1:
-                self.task.push(Task(aNode, cnt=2))
-                
-                exp = aNode.children[2]
-                self.eval_exp(exp) # expression
-                
-                indexes = aNode.children[1]
-                for index in indexes:
-                    self.eval_exp(index) # index
 
-                    
-                return
+    def make_direct_table(self):
+        # 手続きの呼び出しを含まない式だけを扱う
+        table = [None] * NUM_OPCODES
 
-            elif cnt == 2:
+        table[OP_SINGLEOP] = self.direct_singleop
+        table[OP_NUMBER] = self.direct_constant
+        table[OP_STRING] = self.direct_constant
+        table[OP_NAME] = self.direct_name
+        table[OP_CONSTANT_ARRAY] = self.direct_constant_array
+        table[OP_ARRAY] = self.direct_array
+        table[OP_ARRAY_ELEMENT] = self.direct_array_element
 
-                value = self.values.pop()
-                
-                indexes = []
-                indexes_len = len(aNode.children[1])
-               
-                for i in range(indexes_len):
-                    val = self.values.pop()
-                    indexes += [val]
+        for op in BINOP_OPCODES.values():
+            table[op] = self.direct_binop
+        for op in BUILTIN_OPCODES.values():
+            if op in UNARY_BUILTIN_OPCODES:
+                table[op] = self.direct_unary_builtin
+            else:
+                table[op] = self.direct_builtin
 
-                    
-                # 最後までと、最後に分離
-                (indexes, last_index) = (indexes[:-1], indexes[-1])
+        return table
 
-                                
-                var_name = aNode.children[0].leaf
 
-                # 環境に存在しないときには 空dict を作成しておく
-                if var_name not in self.env.keys():
-                    self.env[var_name] = {}
+    def eval_sentence(self, task):
+        self.sentence_table[task.node.op](task)
 
-                target = self.env[var_name]
-                    
-                
-                for i in indexes:
-                    if type(target) is dict and \
-                       i in target.keys() and \
-                       type(target[i]) is dict:
-                            pass
-                    else:
-                        target[i] = {}
 
-                    target = target[i]
+    def eval_subst(self, task):
+        aNode = task.node
 
-                    
-                        
-                target[last_index] = value
-                
+        if task.cnt == 3:
+            # 展開した手続きから戻る（eval_inline）
+            aNode.inline.finish(self.env, aNode.children[0].leaf)
+            return
 
+        if task.cnt == 1:
+            if aNode.tail_call is not None and self.running_all and \
+               self.eval_tail_call(aNode):
                 return
-            
-        elif aNode.type == 'array_element':
-            if cnt == 2:
-                indexes = []
-                indexes_len = len(aNode.children[1])
-               
-                for i in range(indexes_len):
-                    val = self.values.pop()
-                    indexes += [val]
-
-                # 最後までと、最後に分離
-                (indexes, last_index) = (indexes[:-1], indexes[-1])
-                                
-                var_name = aNode.children[0].leaf
-
-                # 環境に存在しないときには 0 を返す
-                if var_name not in self.env.keys():
-                    self.task.push(Task(Node('push', 0)))
-                    return
-
-                target = self.env[var_name]
-                                    
-                for i in indexes:
-                    if type(target) is dict and \
-                       i in target.keys() and \
-                       type(target[i]) is dict:
-                            pass
-                    else:
-                        # 巡れないときには 0 を返して終了
-                        self.task.push(Task(Node('push', 0)))
-                        return
-
-                    target = target[i]
-
-                try:    
-                    self.task.push(Task(Node('push', target[last_index])))
-                except:
-                    # last_index にアクセスできないときは 0 を返して終了
-                    self.task.push(Task(Node('push', 0)))
 
-                    
+            if aNode.inline is not None and self.running_all and \
+               self.eval_inline(aNode):
                 return
-            
 
-        elif aNode.type == 'unarrayop':
-            if aNode.leaf == '++':
-                var_name = aNode.children[0].leaf
-                try:
-                    self.env[var_name] += 1
-                    
-                except KeyError as e:
-                    self.env[var_name] = 1
+            self.task.push(Task(aNode, cnt=2))
+            self.eval_exp(aNode.children[1], aNode.lineno)
 
-                return
+        else:
+            target_value = self.values.pop()
+            var_name = aNode.children[0].leaf
 
-            elif aNode.leaf == '--':
-                var_name = aNode.children[0].leaf
-                if var_name in self.env.keys():
-                    
-                    if self.env[var_name] > 0:
-                        self.env[var_name] -= 1
-                        return
+            if type(target_value) is Array:
+                # 配列の場合、別のオブジェクトとして代入
+                # （もとのオブジェクトに影響が及んでしまう）
+                target_value = target_value.share()
 
-                
-                self.env[var_name] = 0
+            self.env[var_name] = target_value
 
-                return
 
-            
-        elif aNode.type == 'print':
+    def eval_binop(self, task):
+        aNode = task.node
 
-            if cnt == 1:
-                self.task.push(Task(aNode, cnt=2))
-                for anexp in aNode.children:
-                    self.eval_exp(anexp)
+        val1 = self.values.pop()
+        val0 = self.values.pop()
 
-                return
+        try:
+            result = OPCODE_FUNCS[aNode.op](val0, val1)
+        except OperandMismatch:
+            errmes = self.message_err_expression(aNode.lineno,
+                                                 val0, val1,
+                                                 aNode.leaf)
+            myprint(errmes, error=True)
+            self.task.push(Task(Node('critical_error')))
+            return
 
-            elif cnt == 2:
-                result_vals = []
-                for i in range(len(aNode.children)):
-                    aval = self.values.pop()
-                    result_vals += [self.pretty_print_value(aval)]
-                
-                    
-                if GUI_mode == False:
-                    lineno_indent = " " * (len(str(My_lineno-1)) + 5)
-                    print(lineno_indent + " ".join(result_vals) + "\n")
-                else:
-                    myprint(" ".join(result_vals))
+        # 結果を value stack へ push
+        self.values.push(result)
 
-                return
 
+    def eval_remove_callparams(self, task):
+        params = task.node.children[0]
+        values = [self.values.pop() for aparam in params]
 
-        #elif aNode.type == 'evalexp':
-        #    # print ではなく、単なる一つの式を評価するだけ
-        #    anexp = aNode.children[0]
-        #    aval = self.eval_exp(anexp, env)
-        #    return
+        # 呼び出し側の環境（フレーム）を dump に積み、手続きの環境は
+        # 引数だけを持つ新しいものにする（bind_params）。dump の長さは
+        # 実行中の手続きの深さになる
+        self.dump.push(self.env)
 
+        procedure_name = task.node.leaf
+        if self.memo is not None and self.running_all and \
+           self.is_memoizable(procedure_name):
+            # 次のタスクが手続きの本体、その次が手続きから戻るタスク
+            return_node = self.task.item_at(-2).node
+            key = self.memo.key(procedure_name, values)
+            (found, retval) = self.memo.lookup(key)
 
-        elif aNode.type == 'while':
-            if cnt==1:
-                self.task.push(Task(aNode, cnt=2))
-                self.eval_exp(aNode.children[0])
+            if found:
+                # 本体は実行せずに、戻り値だけを置いておく
+                self.bind_params(params, values)
+                self.task.pop()
+                self.env[return_node.children[0]] = retval
                 return
-            
-            elif cnt==2:
-                aval = self.values.pop()
-            
-                if aval == 1:
-                    # while の繰り返し
-                    self.task.push(Task(aNode, cnt=1))
-                    self.task.push(Task(aNode.children[1], cnt=1))
 
-                return
+            # 戻るときに結果をキャッシュする
+            return_node.children[2] = key
 
-        
-        elif aNode.type == 'if':
-            if cnt==1:
-                self.task.push(Task(aNode, cnt=2))
-                self.eval_exp(aNode.children[0])
-                return
-            
-            elif cnt==2:
-                aval = self.values.pop()
-            
-                if aval == 1:            
-                    self.task.push(Task(aNode.children[1], cnt=1))
-                else:
-                    if aNode.leaf == "with-else":
-                        self.task.push(Task(aNode.children[2], cnt=1))
-                return
+        self.bind_params(params, values)
 
-        
-        elif aNode.type == 'multi':
-            statements = aNode.children
-            for statement_node in statements[::-1]:
-                self.task.push(Task(statement_node, cnt=1))
-                
-            return
 
-        elif aNode.type == 'procedure':
-            self.procedures[aNode.leaf] = aNode.children
-            return
+    def is_memoizable(self, procedure_name):
+        procedure = self.procedures.get(procedure_name)
+        return procedure is not None and \
+            self.pure_procedures.get(procedure_name) is procedure
 
-        elif aNode.type == 'singleop':
-            if cnt == 2:
-                val0 = self.values.pop()
 
-                if aNode.leaf == "not":
-                    if val0 ==0:
-                        retval = 1
-                    else:
-                        retval = 0
+    def bind_params(self, params, values):
+        """
+        引数だけを持つ手続きの環境を作って、今の環境にする
+        """
+        env = {}
+        for aparam, aval in zip(params, values):
+            if type(aval) is Array:
+                # 呼び出し側の配列とは、書き換えるときに別のものになる
+                aval = aval.share()
+            env[aparam] = aval
 
-                    self.task.push(Task(Node('push', retval)))
-                    
-            return
+        self.env = env
 
-        elif aNode.type == 'builtin':
-            if aNode.leaf == 'len':
-                val0 = self.values.pop()
-
-                if type(val0) is str:
-                    self.task.push(Task(Node('push', len(val0)-2)))
-                    return
-                                        
-                if type(val0) is not dict:
-                    self.task.push(Task(Node('push', 0)))
-                    return
-                                    
-                if val0 == {}:
-                    self.task.push(Task(Node('push', 0)))
-                    return
-                    
-                
-                value_keys = val0.keys()
 
-                self.task.push(Task(Node('push', max(value_keys)+1)))
+    def eval_tail_call(self, aNode):
+        """
+        手続きの最後の z := f(...)（f はその手続き自身）を、dump に環境を
+        積まずに、dump の呼び出し側のフレームと、手続きから戻るタスクを
+        使い回して実行する。再帰が深くなっても dump は伸びない。
+        使い回せないときは False を返す（通常の呼び出しとして実行する）。
+        """
+        call_node = aNode.children[1]
+        procedure = self.procedures.get(call_node.leaf)
+        if procedure is not aNode.tail_call:
+            # 手続きが定義し直されている
+            return False
 
-                
-            elif aNode.leaf == 'left':
-                val1 = self.values.pop()            
-                string = self.values.pop()
-                raw_string = string[1:-1]  # 両側の " を削除
-
-                if not (type(string) is str):
-                    self.task.push(Task(Node('push', '""')))
-                    return
-
-                try:
-                    self.task.push(Task(Node('push',
-                                         '"' + raw_string[:val1] + '"')))
-                except:
-                    self.task.push(Task(Node('push', string)))
-
-            elif aNode.leaf == 'right':
-                val1 = self.values.pop()            
-                string = self.values.pop()
-                raw_string = string[1:-1]  # 両側の " を削除
-
-                if not (type(string) is str):
-                    self.task.push(Task(Node('push', '""')))
-                    return
-
-                try:
-                    self.task.push(Task(Node('push',
-                                         '"' + raw_string[-val1:] + '"')))
-                except:
-                    self.task.push(Task(Node('push', string)))
-
-            elif aNode.leaf == 'mid':
-                num = self.values.pop()
-                i = self.values.pop()
-                string = self.values.pop()
-                raw_string = string[1:-1]  # 両側の " を削除
-
-                if not (type(string) is str):
-                    self.task.push(Task(Node('push', '""')))
-                    return
-
-                try:
-                    self.task.push(Task(Node('push',
-                                         '"' + raw_string[i-1:i+num-1] + '"')))
-                except:
-                    self.task.push(Task(Node('push', string)))
+        (procedure_retname, procedure_params, procedure_body) = procedure
+        call_params = call_node.children
+        if len(procedure_params) != len(call_params):
+            return False
 
-                    
-            if aNode.leaf == 'int':
-                val0 = self.values.pop()
-                
-                if type(val0) is int:
-                    self.task.push(Task(Node('push', int(val0))))
-                    return
+        for call_aparam in call_params:
+            if call_aparam.pure_lineno is None:
+                return False
 
-                if type(val0) is str:
-                    myval = int(val0[1:-1])
-                    if myval < 0:
-                        myval = 0
-                    self.task.push(Task(Node('push', myval)))
-                    return
+        try:
+            values = [self.direct_table[call_aparam.op](call_aparam)
+                      for call_aparam in call_params[::-1]]
+        except ExpressionError:
+            # 変数に 0 を入れる順番やエラーを、通常の呼び出しと同じにする
+            return False
+        values.reverse()
 
-                self.task.push(Task(Node('push', 0)))
+        # 今の手続きから戻るタスク（それまでに残っているのは nop だけ）
+        skipped = []
+        while not self.task.is_empty() and \
+              self.task.top().node.op in (OP_NOP, OP_NOP_END_PROCEDURE):
+            skipped += [self.task.pop()]
 
+        if self.task.is_empty() or self.task.top().node.op != OP_CALL:
+            for task in skipped[::-1]:
+                self.task.push(task)
+            return False
 
-            if aNode.leaf == 'str':
-                val0 = self.values.pop()
-                
-                if type(val0) is str:
-                    self.task.push(Task(Node('push', str(val0))))
-                    return
+        return_node = self.task.top().node
+        refnames = return_node.children[1]
+
+        # 名前呼びで渡す変数 -> 呼ばれる側の引数
+        passed = {}
+        for procedure_aparam, call_aparam in zip(procedure_params,
+                                                 call_params):
+            if call_aparam.type == 'name':
+                passed[call_aparam.leaf] = procedure_aparam
+
+        # 戻るときに書き戻す値が、呼ばれる側のどの引数になるか
+        # （名前呼びで渡さない引数は、今の値に決まる）
+        new_refnames = {}
+        fixed = []
+        for proc_arg, call_name in refnames.items():
+            if proc_arg == procedure_retname:
+                source = procedure_retname
+            elif proc_arg in passed:
+                source = passed[proc_arg]
+            else:
+                fixed += [(call_name, self.env[proc_arg])]
+                continue
 
-                if type(val0) is int:
-                    self.task.push(Task(Node('push', '"' + str(val0) + '"')))
-                    
-                self.task.push(Task(Node('push', 0)))
+            new_refnames[source] = call_name
 
-                
+        if len(new_refnames) + len(fixed) != len(refnames) or \
+           len(set(refnames.values())) != len(refnames):
+            # 同じ変数に書き戻すものがあると、順番が変わってしまう
+            for task in skipped[::-1]:
+                self.task.push(task)
+            return False
 
-        
-        elif aNode.type == 'array':
-            if cnt == 2:
-                an_array = {}
-                for i in range(len(aNode.children)):
-                    aval = self.values.pop()
-                    an_array[i] = aval
-
-                self.task.push(Task(Node('push', an_array)))
-            
-            return
+        orig_env = self.dump.top()
+        for call_name, aval in fixed:
+            orig_env[call_name] = copy.deepcopy(aval)
 
-                               
-        elif aNode.type == 'push':
-            self.values.push(aNode.leaf)
-            return
-        
-        elif aNode.type == 'critical_error':
-            self.task.clear()
-            return
+        return_node.children[1] = new_refnames
+        self.bind_params(procedure_params, values)
+        self.task.push(Task(procedure_body, cnt=1))
+        return True
 
-        elif aNode.type == "nop":
-            return
 
-        elif aNode.type == "nop-end-procedure":
-            return
-            
-        else:
-            print("There is no operation")
-            print(aNode.type, aNode.leaf)
-            self.task.push(Task(Node('critical_error')))
-            return
+    def eval_inline(self, aNode):
+        """
+        z := f(...) を、dump に環境を積まずに、展開した文
+        （Optimizer.inline_calls）として実行する。
+        f が定義されていないか定義し直されているとき、結果がキャッシュ
+        される手続きのときは False を返す（通常の呼び出しとして実行する）。
+        """
+        inline = aNode.inline
+        procedure_name = aNode.children[1].leaf
+        if self.procedures.get(procedure_name) is not inline.procedure:
+            return False
 
-            
-        
-    def eval_exp(self, aNode):
+        if self.memo is not None and self.is_memoizable(procedure_name):
+            return False
 
-        if aNode.type == 'binop':
-            self.task.push(Task(aNode, cnt=2))
-            self.eval_exp(aNode.children[1])
-            self.eval_exp(aNode.children[0])
-            return
+        # cnt=3 のタスクで呼び出しから戻る。展開した文を実行している間の
+        # 目印にもなる（eval_critical_error を参照）
+        self.task.push(Task(aNode, cnt=3))
+        self.task.push(Task(inline.statement, cnt=1))
+        return True
 
-        elif aNode.type == 'singleop':
-            self.task.push(Task(aNode, cnt=2))
-            self.eval_exp(aNode.children[0])
-            return
 
-        elif aNode.type == 'builtin':
-            if aNode.leaf in ['len', 'int', 'str']:
-                self.task.push(Task(aNode, cnt=2))
-                self.eval_exp(aNode.children)
-                
-            elif aNode.leaf in ['left', 'right']:
-                self.task.push(Task(aNode, cnt=2))
-                self.eval_exp(aNode.children[1])
-                self.eval_exp(aNode.children[0])
-                
-            elif aNode.leaf == 'mid':
-                self.task.push(Task(aNode, cnt=2))
-                self.eval_exp(aNode.children[2])
-                self.eval_exp(aNode.children[1])
-                self.eval_exp(aNode.children[0])
-                
-            else:
-                print("ERROR: eval_exp " + aNode.leaf)
-                
-            
-        elif aNode.type == 'number':
-            self.task.push(Task(Node('push', aNode.leaf)))
+    def eval_call(self, task):
+        if task.cnt != 2:
             return
 
-        elif aNode.type == 'string':
-            '''
-            pattern = [('\\n', '\n'),
-                       ('\\"', '"'),
-                       ('\\t', '\t'),
-                       ('\\', '\\'),
-                       ]
-
-            string = aNode.leaf
-            for key, subst in pattern:
-                if key in string:
-                    print(key)
-                    print("!!")
-                    string = string.replace(key, subst)
-            '''
-            
-            self.task.push(Task(Node('push', aNode.leaf)))
-            return
+        # procedure call の後始末（環境を整える）
+        aNode = task.node
+        procedure_retname = aNode.children[0]
+        refnames = aNode.children[1]
 
-        elif aNode.type == 'name':
-            if aNode.leaf in self.env:
-                target_value = self.env[aNode.leaf]
-            else:
-                target_value = 0
-                self.env[aNode.leaf] = 0
-                
-            self.task.push(Task(Node('push', target_value)))
-            return
+        orig_env = self.dump.pop()
 
-        elif aNode.type == 'array':
-            self.task.push(Task(aNode, cnt=2))
-            for anexp in aNode.children:
-                self.eval_exp(anexp)
+        for proc_arg, call_name in refnames.items():
+            try:
+                orig_env[call_name] = self.env[proc_arg]
+            except:
+                print("Error!")
+                print("orig_env")
+                print(orig_env)
+                print("call_name", call_name)
+                print("self.env")
+                print(self.env)
+                print("proc_arg", proc_arg)
+                print("orig_env[call_name]")
+                print("self.env[proc_arg]")
 
-            return
+        try:
+            retval = self.env[procedure_retname]
+        except:
+            # procedure 内で retval が使われていないときは 0 を返すとする
+            retval = 0
 
-        elif aNode.type == 'array_element':
-            self.task.push(Task(aNode, cnt=2))
+        if aNode.children[2] is not None:
+            self.memo.store(aNode.children[2], retval)
 
-            indexes = aNode.children[1]
-            for index in indexes:
-                self.eval_exp(index) # index
-            
-            return
-        
-        
-        elif aNode.type == 'call':
-            
-            procedure_name = aNode.leaf
-            
-            try:
-                # procedure の情報を取得
-                procedure_body = self.procedures[procedure_name][2]
-                procedure_retname = self.procedures[procedure_name][0]
-                procedure_params = self.procedures[procedure_name][1]
-            except:
-                myprint("%d行目: 手続き '%s' が定義されていません。" % (aNode.lineno, procedure_name), error=True)
+        self.env = orig_env
+        self.values.push(retval)
 
-                self.task.push(Task(Node('critical_error')))
-                return
 
+    def eval_array_subst(self, task):
+        aNode = task.node
 
-            # 呼び出し側の情報を取得
-            call_params = aNode.children
+        if task.cnt == 1:
+            self.task.push(Task(aNode, cnt=2))
 
+            # expression と index
+            self.eval_exps([aNode.children[2]] + aNode.children[1],
+                           aNode.lineno)
 
-            # 引数の個数のチェック
-            if len(procedure_params) > len(call_params):
-                myprint("%d行目: 手続き '%s' に与えらた引数の個数が少なすぎです（%d個にしてください）。" % (aNode.lineno, procedure_name, len(procedure_params)),
-                        error=True)
+            return
 
-                self.task.push(Task(Node('critical_error')))
-                return
+        value = self.values.pop()
 
-            elif len(procedure_params) < len(call_params):
-                myprint("%d行目: 手続き '%s' に与えらた引数の個数が多すぎです（%d個にしてください）。" % (aNode.lineno, procedure_name, len(procedure_params)),
-                        error=True)
+        indexes = []
+        indexes_len = len(aNode.children[1])
 
-                self.task.push(Task(Node('critical_error')))
+        for i in range(indexes_len):
+            val = self.values.pop()
+            indexes += [val]
+
+        # 最後までと、最後に分離
+        (indexes, last_index) = (indexes[:-1], indexes[-1])
+
+        var_name = aNode.children[0].leaf
+
+        # 環境に存在しないときには 空の配列 を作成しておく
+        if var_name not in self.env.keys():
+            self.env[var_name] = Array()
+
+        target = self.env[var_name]
+
+        if type(value) is Array:
+            # a[i][j] := a のように自分自身を代入するときのために、先に共有しておく
+            value = value.share()
+
+        for i in indexes:
+            if type(target) is Array:
+                # 共有している配列は、ここでコピーしてから書き換える
+                target = target.writable(i)
+            else:
+                target[i] = Array()
+                target = target[i]
+
+        target[last_index] = value
+
+
+    def eval_array_element(self, task):
+        if task.cnt != 2:
+            return
+
+        aNode = task.node
+        indexes = []
+        indexes_len = len(aNode.children[1])
+
+        for i in range(indexes_len):
+            val = self.values.pop()
+            indexes += [val]
+
+        var_name = aNode.children[0].leaf
+        self.values.push(self.array_element_value(var_name, indexes))
+
+
+    def array_element_value(self, var_name, indexes):
+        """
+        var_name[indexes[0]][indexes[1]]... の値を返す（無いときは 0）
+        """
+        # 最後までと、最後に分離
+        (indexes, last_index) = (indexes[:-1], indexes[-1])
+
+        # 環境に存在しないときには 0 を返す
+        if var_name not in self.env.keys():
+            return 0
+
+        target = self.env[var_name]
+
+        for i in indexes:
+            if type(target) is Array and \
+               type(target[i]) is Array:
+                    pass
+            else:
+                # 巡れないときには 0 を返して終了
+                return 0
+
+            target = target[i]
+
+        try:
+            return target[last_index]
+        except:
+            # last_index にアクセスできないときは 0 を返して終了
+            return 0
+
+
+    def eval_inc(self, task):
+        var_name = task.node.children[0].leaf
+        try:
+            self.env[var_name] += 1
+
+        except KeyError as e:
+            self.env[var_name] = 1
+
+
+    def eval_dec(self, task):
+        var_name = task.node.children[0].leaf
+        if var_name in self.env.keys():
+
+            if self.env[var_name] > 0:
+                self.env[var_name] -= 1
                 return
-                
-            
-            # 手続き用に環境を完全コピー
-            self.dump.push(copy.deepcopy(self.env))
 
-            
-            tasks = []
-            refname = {}
+        self.env[var_name] = 0
 
-            
-            # 名前呼びのチェック
-            for procedure_aparam, call_aparam in zip(procedure_params, call_params):                
-                # 名前呼びのとき
-                if call_aparam.type == 'name':
-                    refname[procedure_aparam] = call_aparam.leaf
 
-                
-            # 本体の実行            
-            tasks += [Task(Node("remove_callparams", "",
-                                [procedure_params]), cnt=1)]
-            tasks += [Task(procedure_body, cnt=1)]
+    def eval_print(self, task):
+        aNode = task.node
 
+        if task.cnt == 1:
+            self.task.push(Task(aNode, cnt=2))
+            self.eval_exps(aNode.children, aNode.lineno)
 
-            # 後処理（環境を整える）
-            tasks += [Task(Node("call", "",
-                            [procedure_retname,
-                             refname],
-                            lineno=aNode.lineno), cnt=2)]
+            return
 
-            # 処理をタスクに積む
-            for atask in tasks[::-1]:
-                self.task.push(atask)
+        result_vals = []
+        for i in range(len(aNode.children)):
+            aval = self.values.pop()
+            result_vals += [self.pretty_print_value(aval)]
 
+        self.print_values(result_vals)
 
-            # call_params を解釈して、値用のスタックへ積む
-            for call_aparam in call_params:
-                
-                self.eval_exp(call_aparam)
 
-                
+    def eval_while(self, task):
+        aNode = task.node
+
+        if task.cnt == 3:
+            # 数え上げのループの i++
+            self.env[aNode.counter[0]] += 1
+
+        if task.cnt != 2 and self.running_all:
+            if self.jit is not None and self.jit.run(aNode, self.env):
+                # 残りの繰り返しはトレースで実行した
+                return
+
+            if aNode.counter is not None and \
+               self.eval_counting_while(aNode):
+                return
+
+        if task.cnt != 2:
+
+            self.task.push(Task(aNode, cnt=2))
+            self.eval_exp(aNode.children[0], aNode.lineno)
             return
-        
+
+        aval = self.values.pop()
+
+        if aval == 1:
+            # while の繰り返し
+            self.task.push(Task(aNode, cnt=1))
+            self.task.push(Task(aNode.children[1], cnt=1))
+
+
+    def eval_counting_while(self, aNode):
+        """
+        while i < n do begin ...; i++ end の形のループを、条件の式と
+        i++ をタスクに分解せずに実行する。i と n が整数値でないときは
+        False を返す（通常の while として実行する）。
+        1行ずつの実行では止まる位置が変わってしまうので、eval_all でだけ使う。
+        """
+        (var_name, bound, statements) = aNode.counter
+        env = self.env
+
+        count = env.get(var_name)
+        if bound.type == 'number':
+            limit = bound.leaf
+        else:
+            limit = env.get(bound.leaf)
+
+        if type(count) is not int or type(limit) is not int:
+            return False
+
+        if count < limit:
+            # 本体の後に i++ と次の繰り返しを行う
+            self.task.push(Task(aNode, cnt=3))
+            for statement_node in statements[::-1]:
+                self.task.push(Task(statement_node, cnt=1))
+
+        return True
+
+
+    def eval_if(self, task):
+        aNode = task.node
+
+        if task.cnt == 1:
+            self.task.push(Task(aNode, cnt=2))
+            self.eval_exp(aNode.children[0], aNode.lineno)
+            return
+
+        aval = self.values.pop()
+
+        if aval == 1:
+            self.task.push(Task(aNode.children[1], cnt=1))
+        else:
+            if aNode.leaf == "with-else":
+                self.task.push(Task(aNode.children[2], cnt=1))
+
+
+    def eval_multi(self, task):
+        statements = task.node.children
+        for statement_node in statements[::-1]:
+            self.task.push(Task(statement_node, cnt=1))
+
+
+    def eval_procedure(self, task):
+        aNode = task.node
+        self.define_procedure(aNode.leaf, aNode.children)
+
+
+    def define_procedure(self, procedure_name, children):
+        """
+        手続きを定義する。呼び出しに覚えておいた情報は、定義し直された
+        手続きのものでなくなるので使われなくなる（call_site を参照）。
+        """
+        self.procedures[procedure_name] = children
+
+
+    def call_site(self, aNode):
+        """
+        手続きの呼び出し aNode について、(procedure の Node の children,
+        remove_callparams の Node, 名前呼びの引数の対応, 引数の個数の
+        エラーメッセージ) を返す。手続きが定義されていないときは None。
+        一度求めたものは aNode.call_site に覚えておき、その手続きが今の
+        定義のままのあいだ使う。
+        """
+        procedure_name = aNode.leaf
+        procedure = self.procedures.get(procedure_name)
+        if procedure is None:
+            return None
+
+        site = aNode.call_site
+        if site is not None and site[0] is procedure:
+            return site
+
+        (procedure_retname, procedure_params, procedure_body) = procedure
+        call_params = aNode.children
+
+        # 引数の個数のチェック
+        error_message = None
+        if len(procedure_params) > len(call_params):
+            error_message = "%d行目: 手続き '%s' に与えらた引数の個数が少なすぎです（%d個にしてください）。" % (aNode.lineno, procedure_name, len(procedure_params))
+
+        elif len(procedure_params) < len(call_params):
+            error_message = "%d行目: 手続き '%s' に与えらた引数の個数が多すぎです（%d個にしてください）。" % (aNode.lineno, procedure_name, len(procedure_params))
+
+        # 名前呼びのチェック
+        refname = {}
+        for procedure_aparam, call_aparam in zip(procedure_params, call_params):
+            # 名前呼びのとき
+            if call_aparam.type == 'name':
+                refname[procedure_aparam] = call_aparam.leaf
+
+        site = (procedure,
+                Node("remove_callparams", procedure_name, [procedure_params]),
+                refname,
+                error_message)
+
+        aNode.call_site = site
+        return site
+
+
+    def eval_singleop(self, task):
+        if task.cnt != 2:
+            return
+
+        val0 = self.values.pop()
+        self.values.push(op_not(val0))
+
+
+    def eval_builtin(self, task):
+        # 引数は後ろから順に value stack に積まれている
+        aNode = task.node
+
+        if aNode.op in UNARY_BUILTIN_OPCODES:
+            args = [self.values.pop()]
+        else:
+            args = [self.values.pop() for i in range(len(aNode.children))]
+            args.reverse()
+
+        result = OPCODE_FUNCS[aNode.op](*args)
+        self.values.push(result)
+
+
+    def eval_array(self, task):
+        if task.cnt != 2:
+            return
+
+        aNode = task.node
+        elements = [self.values.pop() for i in range(len(aNode.children))]
+
+        self.values.push(Array(elements))
+
+
+    def eval_push(self, task):
+        self.values.push(task.node.leaf)
+
+
+    def eval_critical_error(self, task):
+        # 展開した手続きの中でエラーになったときは、手続きを呼び出したときと
+        # 同じように、手続きの中の環境を表示する
+        for i in range(len(self.task) - 1, -1, -1):
+            marker = self.task.item_at(i)
+            if marker.cnt == 3 and marker.node.op == OP_SUBST and \
+               marker.node.inline is not None:
+                self.env = marker.node.inline.local_env(self.env)
+                break
+
+        self.task.clear()
+
+
+    def eval_nop(self, task):
+        pass
+
+
+    def eval_stored(self, task):
+        self.task.push(Task(self.stored_statement(task.node), cnt=1))
+
+
+    def stored_statement(self, aNode):
+        """
+        'stored' の Node aNode が表す、node_store に置いた文の Node
+        （はじめて実行するときに作り、aNode.children に覚えておく）
+        """
+        if not aNode.children:
+            statement_node = self.node_store.node(aNode.leaf)
+            mark_pure(statement_node)
+            aNode.children = [statement_node]
+
+        return aNode.children[0]
+
+
+    def eval_unknown(self, task):
+        aNode = task.node
+        print("There is no operation")
+        print(aNode.type, aNode.leaf)
+        self.task.push(Task(Node('critical_error')))
+
+
+
+    def eval_exp(self, aNode, lineno):
+        self.eval_exps([aNode], lineno)
+
+
+    def eval_exps(self, nodes, lineno):
+        """
+        lineno 行目の文の式を展開して、タスクスタックに積む
+        （nodes の最後の式が最初に実行される）。
+
+        手続きの呼び出しを含まず、文と同じ行に収まっている式は
+        （mark_pure を参照）、その場で値を計算して value stack に積む。
+        値の入っていない変数を読むときと、演算がエラーになるときは、
+        変数に 0 を入れる順番とエラーの位置が変わらないように、
+        その場では計算せずに展開する。
+
+        それ以外の式の展開の結果は、タスクか値のどちらかを並べた
+        items になる。items の末尾が最初に実行されるので、末尾に
+        並んでいる値はその場で value stack に積んでしまう。それより
+        前の値は、手続きの呼び出しなどを待つ必要があるので push の
+        タスクにする。
+        """
+        for aNode in nodes:
+            if aNode.pure_lineno not in (0, lineno):
+                break
+        else:
+            if self.eval_direct_exps(nodes):
+                return
+
+        items = []
+        exp_table = self.exp_table
+        for aNode in nodes:
+            exp_table[aNode.op](aNode, items)
+
+        values = self.values
+        while items and type(items[-1]) is not Task:
+            values.push(items.pop())
+
+        for item in items:
+            if type(item) is Task:
+                self.task.push(item)
+            else:
+                self.task.push(Task(Node('push', item)))
+
+
+    def eval_direct_exps(self, nodes):
+        """
+        nodes の式をその場で計算して value stack に積む。
+        計算できないときは何もせずに False を返す
+        """
+        direct_table = self.direct_table
+
+        try:
+            results = [direct_table[aNode.op](aNode) for aNode in nodes[::-1]]
+        except ExpressionError:
+            return False
+
+        values = self.values
+        for result in results:
+            values.push(result)
+
+        return True
+
+
+    def direct_binop(self, aNode):
+        val0 = self.direct_table[aNode.children[0].op](aNode.children[0])
+        val1 = self.direct_table[aNode.children[1].op](aNode.children[1])
+
+        try:
+            return OPCODE_FUNCS[aNode.op](val0, val1)
+        except OperandMismatch:
+            # メッセージは展開してから計算するときに表示する
+            raise ExpressionError()
+
+
+    def direct_singleop(self, aNode):
+        return op_not(self.direct_table[aNode.children[0].op](aNode.children[0]))
+
+
+    def direct_unary_builtin(self, aNode):
+        val0 = self.direct_table[aNode.children.op](aNode.children)
+        return OPCODE_FUNCS[aNode.op](val0)
+
+
+    def direct_builtin(self, aNode):
+        args = [self.direct_table[anexp.op](anexp)
+                for anexp in aNode.children]
+        return OPCODE_FUNCS[aNode.op](*args)
+
+
+    def direct_constant(self, aNode):
+        return aNode.leaf
+
+
+    def direct_constant_array(self, aNode):
+        return copy_array(aNode.leaf)
+
+
+    def direct_name(self, aNode):
+        try:
+            return self.env[aNode.leaf]
+        except KeyError:
+            # 展開するときに、タスクスタック版と同じ順番で 0 を入れる
+            raise ExpressionError()
+
+
+    def direct_array(self, aNode):
+        # 要素は後ろから順に計算される
+        vals = [self.direct_table[anexp.op](anexp)
+                for anexp in aNode.children[::-1]]
+        vals.reverse()
+
+        return Array(vals)
+
+
+    def direct_array_element(self, aNode):
+        # index は後ろから順に計算される
+        indexes = aNode.children[1]
+        index_values = [self.direct_table[index.op](index)
+                        for index in indexes[::-1]]
+        index_values.reverse()
+
+        return self.array_element_value(aNode.children[0].leaf, index_values)
+
+
+
+    def exp_binop(self, aNode, items):
+        items.append(Task(aNode, cnt=2))
+        self.exp_table[aNode.children[1].op](aNode.children[1], items)
+        self.exp_table[aNode.children[0].op](aNode.children[0], items)
+
+
+    def exp_singleop(self, aNode, items):
+        items.append(Task(aNode, cnt=2))
+        self.exp_table[aNode.children[0].op](aNode.children[0], items)
+
+
+    def exp_unary_builtin(self, aNode, items):
+        # len, int, str の children は Node 一つ
+        items.append(Task(aNode, cnt=2))
+        self.exp_table[aNode.children.op](aNode.children, items)
+
+
+    def exp_builtin(self, aNode, items):
+        items.append(Task(aNode, cnt=2))
+        for anexp in aNode.children[::-1]:
+            self.exp_table[anexp.op](anexp, items)
+
+
+    def exp_constant(self, aNode, items):
+        items.append(aNode.leaf)
+
+
+    def exp_constant_array(self, aNode, items):
+        # 最適化で作られた定数の配列（毎回新しい配列にする）
+        items.append(copy_array(aNode.leaf))
+
+
+    def exp_name(self, aNode, items):
+        if aNode.leaf in self.env:
+            target_value = self.env[aNode.leaf]
+        else:
+            target_value = 0
+            self.env[aNode.leaf] = 0
+
+        items.append(target_value)
+
+
+    def exp_array(self, aNode, items):
+        items.append(Task(aNode, cnt=2))
+        for anexp in aNode.children:
+            self.exp_table[anexp.op](anexp, items)
+
+
+    def exp_array_element(self, aNode, items):
+        items.append(Task(aNode, cnt=2))
+
+        indexes = aNode.children[1]
+        for index in indexes:
+            self.exp_table[index.op](index, items) # index
+
+
+    def exp_call(self, aNode, items):
+        # procedure の情報を取得
+        site = self.call_site(aNode)
+        if site is None:
+            myprint("%d行目: 手続き '%s' が定義されていません。" % (aNode.lineno, aNode.leaf), error=True)
+
+            items.append(Task(Node('critical_error')))
+            return
+
+        (procedure, remove_node, refname, error_message) = site
+        (procedure_retname, procedure_params, procedure_body) = procedure
+
+        # 引数の個数のチェック
+        if error_message is not None:
+            myprint(error_message, error=True)
+
+            items.append(Task(Node('critical_error')))
+            return
+
+
+        # 呼び出し側の情報を取得
+        call_params = aNode.children
+
+
+        tasks = []
+
+
+        # 本体の実行
+        tasks += [Task(remove_node, cnt=1)]
+        tasks += [Task(procedure_body, cnt=1)]
+
+
+        # 後処理（環境を整える）
+        tasks += [Task(Node("call", "",
+                        [procedure_retname,
+                         refname,
+                         None],
+                        lineno=aNode.lineno), cnt=2)]
+
+        # 処理をタスクに積む
+        items += tasks[::-1]
+
+
+        # call_params を解釈して、値用のスタックへ積む
+        for call_aparam in call_params:
+            self.exp_table[call_aparam.op](call_aparam, items)
+
+
+    def exp_unknown(self, aNode, items):
+        if aNode.op == OP_BUILTIN:
+            print("ERROR: eval_exp " + aNode.leaf)
 
 
 
@@ -1495,8 +1930,9 @@ class Evaluator:
         """
 
         global Error_alised
-        global lexer, parser
+        global lexer
         global My_lineno
+        global Node_store
         
         lexer.lineno = 1
         My_lineno = 1
@@ -1508,7 +1944,8 @@ class Evaluator:
             node_list = []
             for aline in env[::-1]:
                 sentence = aline[0] + ":=" + aline[1]
-                aNode = parser.parse(sentence)
+                aNode = get_parser().parse(sentence, lexer=lexer)
+                mark_pure(aNode)
                 self.task.push(Task(aNode, cnt=1))
                 #print(sentence)
 
@@ -1614,10 +2051,20 @@ class Evaluator:
 
 
         #print(sentence_list)
+
+        # 行のリストはもう使わない（大きなプログラムでメモリを空ける）
+        del ss
         
 
         error_num = 0
         node_list = []
+        optimizer = Optimizer(Node, self.inline_threshold)
+
+        if self.use_node_store:
+            self.node_store = NodeStore(Node)
+        else:
+            self.node_store = None
+
         for sentence in sentence_list:
 
             #sentence += "\n"
@@ -1631,17 +2078,35 @@ class Evaluator:
 
             
             Error_alised = False
-            aNode = parser.parse(sentence)
+            Node_store = self.node_store
+            try:
+                aNode = get_parser().parse(sentence, lexer=lexer)
+            finally:
+                Node_store = None
 
             if Error_alised:
                 error_num += 1
 
+            if Error_alised == False and self.node_store is not None and \
+               not(aNode is None):
+                # aNode は node_store での番号。文は実行するときに Node にする
+                node_list += [self.node_store.stored(aNode)]
+                continue
+
             if Error_alised == False and not(aNode is None):
                 if aNode.type == "evalexp":
-                    aNode.type = "print"
+                    aNode.retype("print")
+
+                if self.optimize:
+                    aNode = optimizer.optimize(aNode)
 
+                mark_pure(aNode)
                 node_list += [aNode]
 
+        if self.optimize and error_num == 0 and self.node_store is None:
+            # 小さな手続きの呼び出しを展開しておく（プログラム全体を見る）
+            for aNode in optimizer.inline_calls(node_list):
+                mark_pure(aNode)
                 
         # エラーがある場合にはセットアップ終了
         if error_num >0:
@@ -1661,6 +2126,31 @@ class Evaluator:
         # 逆順にスタックへ積む
         for node in node_list[::-1]:
             self.task.push(Task(node, cnt=1))
+
+        self.node_list = node_list
+        self.is_fresh = True
+
+        if self.jit is not None:
+            self.jit = TraceJIT(self)
+
+        self.pure_procedures = pure_procedures(node_list)
+        if self.memo is not None:
+            self.memo = ProcedureCache(self.memo.max_entries,
+                                       self.memo.max_bytes)
+        self.optimizer_report = optimizer.removed
+
+        if self.engine == "vm":
+            self.task.clear()
+            state = self.vm.load(node_list, self.env, self.onestep_lineno)
+            
+            return {'noerror': True,
+                    'lineno': self.onestep_lineno,
+                    'env':self.env, 
+                    'pretty_env': self.pretty_env(self.env),
+                    'task': self.task,
+                    'values': self.values,
+                    'dump': state.dump,
+                    'vm': state}
             
         return {'noerror': True,
                 'lineno': self.onestep_lineno,
@@ -1672,7 +2162,11 @@ class Evaluator:
             
 
     def eval_onestep(self):
+        self.is_fresh = False
         finished_procedure_status = False
+
+        if self.engine == "vm":
+            return self.eval_onestep_vm()
         
         if self.task.is_empty():
             return {'lineno':0, 'env':{}, 'empty':True,
@@ -1772,12 +2266,71 @@ class Evaluator:
 
         
         
+    def eval_onestep_vm(self):
+        state = self.vm.state
+
+        # setup でエラーがあったとき（state が None）も、終わったときと同じ
+        if state is None or state.finished:
+            return {'lineno':0, 'env':{}, 'empty':True,
+                    'pretty_env': {},
+                    'task': self.task,
+                    'values': self.values,
+                    'dump': self.dump if state is None else state.dump,
+                    'procedure_finished': False,
+                    'lower_level_pretty': {},
+                    'vm': state
+                    }
+
+        finished_procedure_status = self.vm.step()
+        if state.finished:
+            finished_procedure_status = False
+        
+        self.env = state.frames[-1].env
+        self.onestep_lineno = state.lineno
+
+        if len(state.dump) > 0:
+            # 積んである latest 環境の pretty_env
+            lower_pretty = self.pretty_env(state.dump[-1])
+        else:
+            lower_pretty = {}
+
+        return {'lineno':self.onestep_lineno,
+                'env': self.env,
+                'pretty_env': self.pretty_env(self.env),
+                'empty': state.finished,
+                'task': self.task,
+                'values': self.values,
+                'dump': state.dump,
+                'procedure_finished': finished_procedure_status,
+                'lower_level_pretty': lower_pretty,
+                'vm': state
+                }
+        
+        
     def eval_all(self):
+
+        if self.engine == "vm":
+            if self.vm.state is not None:
+                self.vm.run()
+                self.env = self.vm.state.frames[-1].env
+            
+            return {
+                'lineno': self.onestep_lineno,
+                'env':self.env, 
+                'pretty_env': self.pretty_env(self.env),
+            }
+
+        if self.is_fresh:
+            return self.eval_compiled()
         
-        while not self.task.is_empty():
-            task  = self.task.pop()
-            # task.node.print()
-            self.eval_sentence(task)
+        self.running_all = True
+        try:
+            while not self.task.is_empty():
+                task  = self.task.pop()
+                # task.node.print()
+                self.eval_sentence(task)
+        finally:
+            self.running_all = False
 
     
         return {
@@ -1787,5 +2340,32 @@ class Evaluator:
         }
 
 
+    def eval_compiled(self):
+        """
+        setup された文をクロージャにコンパイルしてから実行する
+        （タスクスタックは使わない）
+        """
+        self.is_fresh = False
+        
+        program = Compiler(self).compile_program(self.node_list,
+                                                 self.env)
+        self.task.clear()
+
+        try:
+            program(self.env)
+
+        except RuntimeStop as e:
+            self.env = e.env
+
+        except RecursionError:
+            myprint("手続きの呼び出しが深すぎます。", error=True)
+            
+        return {
+            'lineno': self.onestep_lineno,
+            'env':self.env, 
+            'pretty_env': self.pretty_env(self.env),
+        }
+
+
 
 
@@ -0,0 +1,187 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# Memo.py
+#
+# Memoisation of pure procedures.  pure_procedures finds the procedures
+# whose result depends only on their arguments, and ProcedureCache keeps
+# their results keyed by the argument values, with LRU eviction and a
+# cap on the memory it uses.
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import collections
+import sys
+
+from src.Array import Array
+from src.Rope import Rope
+from src.Optimizer import child_nodes, procedure_nodes
+
+
+# キャッシュに置く結果の個数と、おおよそのメモリ量（バイト）の上限
+MEMO_MAX_ENTRIES = 100000
+MEMO_MAX_BYTES = 16 * 1024 * 1024
+
+
+
+def is_pure_body(aNode, params, pure):
+    """
+    手続きの本体 aNode が、print も手続きの定義も含まず、引数を
+    書き換えず（名前呼びの書き戻しが起きない）、pure に含まれる
+    手続きしか呼び出さないなら True
+    """
+    if aNode.type in ['print', 'procedure', 'stored']:
+        # 'stored' は NodeStore に置いたままで、中身がわからない文
+        return False
+
+    if aNode.type in ['unarrayop', 'array_subst'] or \
+       (aNode.type == 'binop' and aNode.leaf == ':='):
+        if aNode.children[0].leaf in params:
+            return False
+
+    if aNode.type == 'call':
+        if aNode.leaf not in pure:
+            return False
+
+    return all([is_pure_body(child, params, pure)
+                for child in child_nodes(aNode)])
+
+
+def pure_procedures(node_list):
+    """
+    結果が引数の値だけで決まる手続きの、名前 -> procedure の Node の
+    children（Evaluator.procedures に入るもの）を返す。
+    プログラムの中で一度しか定義されていない手続きだけを対象にする。
+    """
+    nodes = []
+    for aNode in node_list:
+        procedure_nodes(aNode, nodes)
+
+    names = [aNode.leaf for aNode in nodes]
+    pure = dict([(aNode.leaf, aNode.children) for aNode in nodes
+                 if names.count(aNode.leaf) == 1])
+
+    # 純粋でない手続きを呼び出す手続きも純粋でないので、変わらなくなるまで
+    # 取り除いていく
+    changed = True
+    while changed:
+        changed = False
+        for name, (procedure_retname, procedure_params, body) in \
+                list(pure.items()):
+            if not is_pure_body(body, procedure_params, pure):
+                del pure[name]
+                changed = True
+
+    return pure
+
+
+
+def freeze(value):
+    """
+    引数の値を、キャッシュのキーに使える形にする
+    """
+    if type(value) is Array:
+        return (Array, tuple([(key, freeze(element))
+                             for key, element in value.items()]))
+
+    if type(value) is Rope:
+        return str(value)
+
+    return value
+
+
+def approximate_size(value):
+    """
+    値のおおよそのメモリ量（バイト）
+    """
+    size = sys.getsizeof(value)
+
+    if type(value) is Array:
+        for key, element in value.items():
+            size += approximate_size(key) + approximate_size(element)
+
+    elif type(value) is Rope:
+        size += len(value)
+
+    elif type(value) is tuple:
+        for element in value:
+            size += approximate_size(element)
+
+    return size
+
+
+
+class ProcedureCache:
+    def __init__(self, max_entries=MEMO_MAX_ENTRIES, max_bytes=MEMO_MAX_BYTES):
+        """
+        ProcedureCache(max_entries, max_bytes)
+
+         純粋な手続きの結果を、(手続き名, 引数の値) をキーにして持つ。
+         結果の個数が max_entries を、おおよそのメモリ量が max_bytes を
+         超えたら、最も長く使われていないものから捨てる。
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        # キー -> (結果, おおよそのメモリ量)（最後に使ったものが末尾）
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def key(self, procedure_name, values):
+        return (procedure_name, tuple([freeze(value) for value in values]))
+
+
+    def lookup(self, key):
+        """
+        (見つかったか, 結果) を返す
+        """
+        try:
+            (value, size) = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return (False, None)
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+
+        if type(value) is Array:
+            # 呼び出し側で書き換えられてもよいようにコピーして返す
+            value = value.share()
+        return (True, value)
+
+
+    def store(self, key, value):
+        if type(value) is Array:
+            value = value.share()
+
+        size = approximate_size(key) + approximate_size(value)
+        if size > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[1]
+
+        self.entries[key] = (value, size)
+        self.size += size
+
+        while len(self.entries) > self.max_entries or \
+              self.size > self.max_bytes:
+            (_, old_size) = self.entries.popitem(last=False)[1]
+            self.size -= old_size
+            self.evictions += 1
+
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
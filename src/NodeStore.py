@@ -0,0 +1,224 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# NodeStore.py
+#
+# A compact store for the syntax trees of very large (machine-generated)
+# while programs.  Instead of one Node object per node, the kind, leaf,
+# first child, next sibling and line number of every node live in
+# parallel array columns, and the leaf values are interned in a constant
+# pool.  The parser adds nodes to the store directly, so setup never
+# holds the whole program as Node objects.  The engines turn one
+# statement at a time back into Nodes (node), with the statements inside
+# it left as 'stored' placeholders until they are reached.
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+from array import array
+
+
+# children の要素が Node でないときの種類
+# （list は要素を子に持ち、str は leaf に値を持つ）
+LIST_KIND = '[list]'
+STR_KIND = '[str]'
+
+# 子がない
+NO_INDEX = -1
+
+# children が Node 一つだけの組み込み関数
+SINGLE_CHILD_BUILTINS = ('len', 'int', 'str')
+
+# 文の種類 -> 子のうち文であるものの位置（None のときはすべて）
+STATEMENT_CHILDREN = {
+    'multi': None,
+    'while': (1,),
+    'if': (1, 2),
+    'procedure': (2,),
+}
+
+
+
+class NodeStore:
+    def __init__(self, node_class):
+        """
+        NodeStore(node_class)
+
+         構文木を、Node の代わりに、番号で引く列（array）に置いておく。
+         kinds には種類、leaves には leaf の値の定数表（pool）での番号、
+         firsts には最初の子、siblings には次の兄弟、linenos には行番号の
+         それぞれの番号が入る（子や兄弟がないときは NO_INDEX）。
+         node_class は node で作る Node のクラス。
+        """
+        self.node_class = node_class
+
+        self.kinds = array('B')
+        self.leaves = array('i')
+        self.firsts = array('i')
+        self.siblings = array('i')
+        self.linenos = array('i')
+
+        # 種類の名前の表
+        self.kind_names = []
+        self.kind_index = {}
+
+        # leaf の値の定数表（同じ値は一つにまとめる）
+        self.pool = []
+        self.pool_index = {}
+
+
+    def __len__(self):
+        return len(self.kinds)
+
+
+    def nbytes(self):
+        """
+        列が使っているバイト数（定数表の値は含まない）
+        """
+        return sum([column.itemsize * len(column)
+                    for column in [self.kinds, self.leaves, self.firsts,
+                                   self.siblings, self.linenos]])
+
+
+    # -------------------------------------------------
+    # building
+    # -------------------------------------------------
+    def kind(self, name):
+        try:
+            return self.kind_index[name]
+        except KeyError:
+            kind = self.kind_index[name] = len(self.kind_names)
+            self.kind_names += [name]
+            return kind
+
+
+    def intern(self, value):
+        key = (type(value), value)
+        try:
+            return self.pool_index[key]
+        except KeyError:
+            index = self.pool_index[key] = len(self.pool)
+            self.pool += [value]
+            return index
+
+
+    def add(self, type, leaf=None, children=None, lineno=0):
+        """
+        Node(type, leaf, children, lineno) にあたるものを加えて、その番号を
+        返す。children の Node は、すでに加えたものの番号で与える。
+        """
+        if type == 'builtin' and leaf in SINGLE_CHILD_BUILTINS:
+            # len、int、str の引数
+            children = [children]
+
+        first = NO_INDEX
+        if children:
+            first = self.link([self.child(x) for x in children])
+
+        return self.append(type, leaf, first, lineno)
+
+
+    def child(self, value):
+        if type(value) is int:
+            return value
+
+        if type(value) is str:
+            return self.append(STR_KIND, value, NO_INDEX, 0)
+
+        # list
+        return self.append(LIST_KIND, None,
+                           self.link([self.child(x) for x in value]), 0)
+
+
+    def link(self, indexes):
+        """
+        indexes を兄弟としてつなぎ、最初のものを返す
+        """
+        if not indexes:
+            return NO_INDEX
+
+        for index, next_index in zip(indexes, indexes[1:]):
+            self.siblings[index] = next_index
+
+        return indexes[0]
+
+
+    def append(self, type, leaf, first, lineno):
+        self.kinds.append(self.kind(type))
+        self.leaves.append(self.intern(leaf))
+        self.firsts.append(first)
+        self.siblings.append(NO_INDEX)
+        self.linenos.append(lineno)
+        return len(self.kinds) - 1
+
+
+    def retype(self, index, type):
+        self.kinds[index] = self.kind(type)
+
+
+    # -------------------------------------------------
+    # reading
+    # -------------------------------------------------
+    def type(self, index):
+        return self.kind_names[self.kinds[index]]
+
+
+    def leaf(self, index):
+        return self.pool[self.leaves[index]]
+
+
+    def lineno(self, index):
+        return self.linenos[index]
+
+
+    def children(self, index):
+        """
+        index の子の番号のリスト
+        """
+        indexes = []
+        child = self.firsts[index]
+        while child != NO_INDEX:
+            indexes += [child]
+            child = self.siblings[child]
+
+        return indexes
+
+
+    def node(self, index):
+        """
+        index の文や式を Node にする。中に含まれる文は、その文の番号を
+        leaf に持つ 'stored' の Node のままにしておく（実行するときに
+        もう一度 node で Node にする）。
+        """
+        node_type = self.type(index)
+        leaf = self.leaf(index)
+        statements = STATEMENT_CHILDREN.get(node_type, ())
+
+        children = []
+        for i, child in enumerate(self.children(index)):
+            if statements is None or i in statements:
+                children += [self.stored(child)]
+            else:
+                children += [self.value(child)]
+
+        if node_type == 'builtin' and leaf in SINGLE_CHILD_BUILTINS:
+            children = children[0]
+
+        return self.node_class(node_type, leaf, children,
+                               lineno=self.lineno(index))
+
+
+    def value(self, index):
+        node_type = self.type(index)
+        if node_type == STR_KIND:
+            return self.leaf(index)
+
+        if node_type == LIST_KIND:
+            return [self.value(child) for child in self.children(index)]
+
+        return self.node(index)
+
+
+    def stored(self, index):
+        return self.node_class('stored', index, lineno=self.lineno(index))
@@ -0,0 +1,336 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# Operators.py
+#
+# Semantics of the operators and built-in functions of while programs.
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+
+from src.Array import Array
+from src.Rope import Rope, concat
+
+
+class OperandMismatch(Exception):
+    """
+    演算子に与えられた値の型の組み合わせが不正なときに投げる例外。
+    args には演算子に与えられた2つの値が入っている。
+    エラーメッセージ（message_err_expression）は呼び出し側で作る。
+    """
+    pass
+
+
+
+# ----------------------------------------------------------------
+# 値の表示
+# ----------------------------------------------------------------
+def pretty_print_value(value):
+    result = ""
+    if type(value) is int:
+        result = "{}".format(value)
+        return result
+
+    elif type(value) is str:
+        # 文字列は " を付けずに持っているので、表示するときに付ける
+        result = '"{}"'.format(value)
+        return result
+
+    elif type(value) is Rope:
+        result = '"{}"'.format(str(value))
+        return result
+
+    elif type(value) is Array:
+        array_value_list = [pretty_print_value(element)
+                            for element in value.to_list()]
+
+        result = "[{}]".format(", ".join(array_value_list))
+        return result
+
+
+def copy_array(value):
+    """
+    定数として持っている配列を、書き換えてもよい新しい配列にして返す
+    """
+    # 書き換えるときに、はじめてコピーされる
+    return value.share()
+
+
+def pretty_type(val):
+    if type(val) is int:
+        return "整数値"
+    elif type(val) is str or type(val) is Rope:
+        return "文字列"
+    else:
+        return "配列"
+
+
+def is_string(value):
+    return type(value) is str or type(value) is Rope
+
+
+def message_err_expression(lineno, val0, val1, operator):
+    errmes = "%d行目：「%s %s %s」はできません。"
+    errmes = errmes % (lineno,
+                       pretty_type(val0),
+                       operator,
+                       pretty_type(val1))
+    return errmes
+
+
+
+# ----------------------------------------------------------------
+# 二項演算子
+# ----------------------------------------------------------------
+def op_plus(val0, val1):
+    if type(val0) is int and type(val1) is int:
+        return val0 + val1
+
+    elif (type(val0) is str or type(val0) is Rope) and \
+         (type(val1) is str or type(val1) is Rope):
+        # 文字列との連結処理（長くなったら Rope にする）
+        return concat(val0, val1)
+
+    elif type(val0) is Array and type(val1) is Array:
+        return val0.concat(val1)
+
+    raise OperandMismatch(val0, val1)
+
+
+def op_minus(val0, val1):
+    if not(type(val0) is int) and not(type(val1) is int):
+        raise OperandMismatch(val0, val1)
+
+    result = val0 - val1
+    if result < 0: result = 0
+    return result
+
+
+def op_times(val0, val1):
+    if type(val0) is int and type(val1) is int:
+        return val0 * val1
+
+    elif type(val0) is str and type(val1) is int:
+        return val0 * val1
+
+    elif type(val0) is Rope and type(val1) is int:
+        return str(val0) * val1
+
+    raise OperandMismatch(val0, val1)
+
+
+def op_div(val0, val1):
+    if not(type(val0) is int) and not(type(val1) is int):
+        raise OperandMismatch(val0, val1)
+
+    return int(val0/val1)
+
+
+def op_mod(val0, val1):
+    if not(type(val0) is int) and not(type(val1) is int):
+        raise OperandMismatch(val0, val1)
+
+    return val0 % val1
+
+
+def op_ne(val0, val1):
+    if val0 != val1:
+        return 1
+    return 0
+
+
+def op_eq(val0, val1):
+    if val0 == val1:
+        return 1
+    return 0
+
+
+def op_ge(val0, val1):
+    t = type(val0)
+    if t is type(val1) and (t is int or t is str):
+        if val0 >= val1:
+            return 1
+        return 0
+
+    if is_string(val0) and is_string(val1):
+        if str(val0) >= str(val1):
+            return 1
+        return 0
+
+    raise OperandMismatch(val0, val1)
+
+
+def op_gt(val0, val1):
+    t = type(val0)
+    if t is type(val1) and (t is int or t is str):
+        if val0 > val1:
+            return 1
+        return 0
+
+    if is_string(val0) and is_string(val1):
+        if str(val0) > str(val1):
+            return 1
+        return 0
+
+    raise OperandMismatch(val0, val1)
+
+
+def op_le(val0, val1):
+    t = type(val0)
+    if t is type(val1) and (t is int or t is str):
+        if val0 <= val1:
+            return 1
+        return 0
+
+    if is_string(val0) and is_string(val1):
+        if str(val0) <= str(val1):
+            return 1
+        return 0
+
+    raise OperandMismatch(val0, val1)
+
+
+def op_lt(val0, val1):
+    t = type(val0)
+    if t is type(val1) and (t is int or t is str):
+        if val0 < val1:
+            return 1
+        return 0
+
+    if is_string(val0) and is_string(val1):
+        if str(val0) < str(val1):
+            return 1
+        return 0
+
+    raise OperandMismatch(val0, val1)
+
+
+def op_and(val0, val1):
+    if not(type(val0) is int) and not(type(val1) is int):
+        raise OperandMismatch(val0, val1)
+
+    if (val0 == 1) and (val1 == 1):
+        return 1
+    return 0
+
+
+def op_or(val0, val1):
+    if not(type(val0) is int) and not(type(val1) is int):
+        raise OperandMismatch(val0, val1)
+
+    if (val0 == 1) or (val1 == 1):
+        return 1
+    return 0
+
+
+# 演算子の文字列 -> 演算を行う関数
+BINOPS = {
+    '+': op_plus,
+    '-': op_minus,
+    '*': op_times,
+    'div': op_div,
+    'mod': op_mod,
+    '!=': op_ne,
+    '=': op_eq,
+    '>=': op_ge,
+    '>': op_gt,
+    '<=': op_le,
+    '<': op_lt,
+    'and': op_and,
+    'or': op_or,
+}
+
+
+
+# ----------------------------------------------------------------
+# 単項演算子と組み込み関数
+# ----------------------------------------------------------------
+def op_not(val0):
+    if val0 == 0:
+        return 1
+    return 0
+
+
+def builtin_len(val0):
+    if type(val0) is str or type(val0) is Rope:
+        return len(val0)
+
+    if type(val0) is not Array:
+        return 0
+
+    return len(val0)
+
+
+def builtin_left(string, val1):
+    if type(string) is Rope:
+        string = str(string)
+
+    if not (type(string) is str):
+        return ''
+
+    try:
+        return string[:val1]
+    except:
+        return string
+
+
+def builtin_right(string, val1):
+    if type(string) is Rope:
+        string = str(string)
+
+    if not (type(string) is str):
+        return ''
+
+    try:
+        return string[-val1:]
+    except:
+        return string
+
+
+def builtin_mid(string, i, num):
+    if type(string) is Rope:
+        string = str(string)
+
+    if not (type(string) is str):
+        return ''
+
+    try:
+        return string[i-1:i+num-1]
+    except:
+        return string
+
+
+def builtin_int(val0):
+    if type(val0) is int:
+        return val0
+
+    if type(val0) is str or type(val0) is Rope:
+        myval = int(str(val0))
+        if myval < 0:
+            myval = 0
+        return myval
+
+    return 0
+
+
+def builtin_str(val0):
+    if type(val0) is str or type(val0) is Rope:
+        return val0
+
+    if type(val0) is int:
+        return str(val0)
+
+    return 0
+
+
+# 組み込み関数名 -> 関数
+BUILTINS = {
+    'len': builtin_len,
+    'left': builtin_left,
+    'right': builtin_right,
+    'mid': builtin_mid,
+    'int': builtin_int,
+    'str': builtin_str,
+}
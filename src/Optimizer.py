@@ -0,0 +1,914 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# Optimizer.py
+#
+# Optimisation passes over the syntax trees of while programs.  They are
+# run by Evaluator.setup right after parser.parse, so every execution
+# engine sees the optimised trees.
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import copy
+
+from src.Array import Array
+from src.Rope import Rope
+from src.Operators import BINOPS, BUILTINS, op_not
+
+
+# 値が 0 か 1 になる二項演算子
+BOOLEAN_BINOPS = ['!=', '=', '>=', '>', '<=', '<', 'and', 'or']
+
+# 値が（エラーでなければ）整数値になる二項演算子
+INT_BINOPS = BOOLEAN_BINOPS + ['-', 'div', 'mod']
+
+# 定数の Node の種類
+CONSTANT_TYPES = ['number', 'string', 'constant_array']
+
+# これより長い文字列や配列になる式は計算しておかない
+MAX_FOLDED_LENGTH = 1000
+
+# 最適化で作る変数の名前の接頭辞（while プログラムの変数名とは重ならない）
+HIDDEN_PREFIX = "_不変"
+
+# 手続きを展開するときに、手続きの中の変数の名前に付ける接頭辞
+INLINE_PREFIX = "_展開"
+
+# 本体の Node の個数がこれ以下の手続きを、呼び出しの位置に展開する
+INLINE_MAX_NODES = 60
+
+# オペランドが整数値ならエラーにならない二項演算子
+SAFE_INT_BINOPS = ['+', '-', '*', '>=', '>', '<=', '<', 'and', 'or']
+
+
+
+def is_hidden_name(name):
+    """
+    最適化で作った変数なら True（環境の表示には出さない）
+    """
+    return name.startswith((HIDDEN_PREFIX, INLINE_PREFIX))
+
+
+
+def count_nodes(aNode):
+    """
+    aNode 以下の Node の個数
+    """
+    return 1 + sum([count_nodes(child) for child in child_nodes(aNode)])
+
+
+def child_nodes(aNode):
+    """
+    文や式の直接の子 Node のリストを返す（手続きの本体も含む）
+    """
+    if type(aNode.children) in (list, tuple):
+        # 葉の children は空の tuple
+        nodes = []
+        for child in aNode.children:
+            if isinstance(child, list):
+                nodes += [x for x in child if not isinstance(x, str)]
+            elif not isinstance(child, str):
+                nodes += [child]
+        return nodes
+
+    # len、int、str の引数
+    return [aNode.children]
+
+
+def rewrite_children(aNode, func):
+    """
+    aNode の子 Node を func(子 Node) で置き換える
+    """
+    if type(aNode.children) not in (list, tuple):
+        # len、int、str の引数
+        aNode.children = func(aNode.children)
+        return
+
+    children = aNode.children
+    for i, child in enumerate(children):
+        if isinstance(child, list):
+            children[i] = [x if isinstance(x, str) else func(x)
+                           for x in child]
+        elif not isinstance(child, str):
+            children[i] = func(child)
+
+
+def is_constant(aNode):
+    return aNode.type in CONSTANT_TYPES
+
+
+def static_type(aNode):
+    """
+    式の値の型が構文からわかるときは int、str、Array のどれかを返す
+    （わからないときは None）
+    """
+    if aNode.type == 'number':
+        return int
+
+    elif aNode.type == 'string':
+        return str
+
+    elif aNode.type in ['array', 'constant_array']:
+        return Array
+
+    elif aNode.type == 'singleop':
+        return int
+
+    elif aNode.type == 'binop':
+        if aNode.leaf in INT_BINOPS:
+            return int
+
+        t0 = static_type(aNode.children[0])
+        t1 = static_type(aNode.children[1])
+        if aNode.leaf == '+' and t0 is t1:
+            return t0
+        if aNode.leaf == '*' and t1 is int and t0 in [int, str]:
+            return t0
+
+    elif aNode.type == 'builtin':
+        if aNode.leaf in ['len', 'int']:
+            return int
+        if aNode.leaf == 'str':
+            if static_type(aNode.children) in [int, str]:
+                return str
+        elif static_type(aNode.children[0]) is str:
+            # left、right、mid
+            return str
+
+    return None
+
+
+def is_boolean(aNode):
+    """
+    式の値が 0 か 1 になることが構文からわかるときに True
+    """
+    if aNode.type == 'singleop':
+        return True
+
+    return aNode.type == 'binop' and aNode.leaf in BOOLEAN_BINOPS
+
+
+
+class Optimizer:
+    def __init__(self, Node, inline_threshold=INLINE_MAX_NODES):
+        """
+        Optimizer(Node, inline_threshold)
+
+         構文木の最適化を行う。Node には新しい Node を作るためのクラスを渡す。
+         最適化はいくつかのパスに分かれていて、removed にはパスごとに
+         取り除いた Node の個数を加算していく（licm は Node を増やすので
+         負の値になる。ループの外に出した式の個数は hoisted に入る）。
+
+         式の演算は、その Node と同じ行の文の中にあるときだけ最適化する
+         （1行ずつの実行で止まる位置を変えないため）。
+
+         inline_calls は、本体の Node の個数が inline_threshold 以下の
+         手続きの呼び出しに、展開したものを付ける（0 のときは展開しない）。
+        """
+        self.Node = Node
+        self.inline_threshold = inline_threshold
+
+        self.passes = [
+            ('fold', self.fold),
+            ('simplify', self.simplify),
+            ('dead_code', self.dead_code),
+            ('licm', self.hoist_invariants),
+            ('counting_loop', self.count_loop),
+            ('tail_call', self.mark_tail_calls),
+        ]
+
+        # dead_code で置き換えた文（id -> Node）
+        self.replaced = {}
+
+        # licm で作った変数の個数
+        self.hoisted = 0
+
+        # inline_calls で展開した呼び出しの個数
+        self.inlined = 0
+
+        # パスの名前 -> 取り除いた Node の個数
+        self.removed = dict([(name, 0) for name, func in self.passes])
+
+
+    def optimize(self, aNode):
+        """
+        トップレベルの文 aNode を最適化したものを返す
+        """
+        for name, func in self.passes:
+            before = count_nodes(aNode)
+            aNode = self.walk(aNode, func, aNode.lineno)
+            self.removed[name] += before - count_nodes(aNode)
+
+        return aNode
+
+
+    def walk(self, aNode, func, lineno):
+        """
+        aNode 以下を帰りがけ順に func(node, lineno) で置き換える。
+        lineno はその Node を含む文の行番号。
+        """
+        if aNode.type in ['binop', 'array_subst', 'unarrayop', 'print',
+                          'while', 'if', 'multi', 'procedure'] \
+           and aNode.leaf not in BINOPS:
+            # 文
+            lineno = aNode.lineno
+
+        rewrite_children(aNode, lambda child: self.walk(child, func, lineno))
+        return func(aNode, lineno)
+
+
+    # -------------------------------------------------
+    # constants
+    # -------------------------------------------------
+    def constant_node(self, value, aNode):
+        """
+        値 value を表す定数の Node（配列は constant_array）を返す
+        """
+        if type(value) is int:
+            return self.Node('number', value, lineno=aNode.lineno)
+
+        if type(value) is Rope:
+            value = str(value)
+
+        if len(value) > MAX_FOLDED_LENGTH:
+            return aNode
+
+        if type(value) is str:
+            return self.Node('string', value, lineno=aNode.lineno)
+
+        return self.Node('constant_array', value, lineno=aNode.lineno)
+
+
+    def fold(self, aNode, lineno):
+        """
+        定数だけの式を計算しておく。
+        エラーになる式（型の組み合わせが不正、0 での割り算など）は、
+        実行時に同じエラーになるようにそのまま残す。
+        """
+        if aNode.lineno != lineno:
+            return aNode
+
+        if aNode.type == 'binop' and aNode.leaf in BINOPS:
+            if is_constant(aNode.children[0]) and \
+               is_constant(aNode.children[1]):
+                try:
+                    value = BINOPS[aNode.leaf](aNode.children[0].leaf,
+                                               aNode.children[1].leaf)
+                except Exception:
+                    return aNode
+
+                return self.constant_node(value, aNode)
+
+        elif aNode.type == 'singleop':
+            if is_constant(aNode.children[0]):
+                return self.constant_node(op_not(aNode.children[0].leaf),
+                                          aNode)
+
+        elif aNode.type == 'builtin':
+            args = child_nodes(aNode)
+            if all([is_constant(x) for x in args]):
+                try:
+                    value = BUILTINS[aNode.leaf](*[x.leaf for x in args])
+                except Exception:
+                    return aNode
+
+                return self.constant_node(value, aNode)
+
+        elif aNode.type == 'array':
+            if all([is_constant(x) for x in aNode.children]):
+                value = Array([x.leaf for x in aNode.children])
+                return self.constant_node(value, aNode)
+
+        return aNode
+
+
+    # -------------------------------------------------
+    # algebraic identities
+    # -------------------------------------------------
+    def simplify(self, aNode, lineno):
+        """
+        x+0、x*1、not(not(e)) などの恒等式を簡単にする。
+        x の型が構文からわかって、結果が変わらないときだけ行う。
+        """
+        if aNode.lineno != lineno:
+            return aNode
+
+        if aNode.type == 'binop' and aNode.leaf in BINOPS:
+            (exp0, exp1) = aNode.children
+            t0 = static_type(exp0)
+            t1 = static_type(exp1)
+
+            if aNode.leaf == '+':
+                # x+0、0+x、x+""、""+x
+                if t0 is int and exp1.type == 'number' and exp1.leaf == 0:
+                    return exp0
+                if t1 is int and exp0.type == 'number' and exp0.leaf == 0:
+                    return exp1
+                if t0 is str and exp1.type == 'string' and exp1.leaf == '':
+                    return exp0
+                if t1 is str and exp0.type == 'string' and exp0.leaf == '':
+                    return exp1
+
+            elif aNode.leaf == '-':
+                # x-0（x は整数値）
+                if t0 is int and exp1.type == 'number' and exp1.leaf == 0:
+                    return exp0
+
+            elif aNode.leaf == '*':
+                # x*1（x は整数値か文字列）、1*x（x は整数値）
+                if t0 in [int, str] and \
+                   exp1.type == 'number' and exp1.leaf == 1:
+                    return exp0
+                if t1 is int and exp0.type == 'number' and exp0.leaf == 1:
+                    return exp1
+
+        elif aNode.type == 'singleop':
+            # not(not(e))（e の値は 0 か 1）
+            inner = aNode.children[0]
+            if inner.type == 'singleop' and inner.lineno == lineno and \
+               is_boolean(inner.children[0]):
+                return inner.children[0]
+
+        return aNode
+
+
+
+    # -------------------------------------------------
+    # dead code
+    # -------------------------------------------------
+    def dead_code(self, aNode, lineno):
+        """
+        条件が定数の if と while を取り除き、到達しない文を消す。
+        残った文の行番号はそのままにし、消した文の代わりには同じ行の
+        nop を置く（1行ずつの実行で、その行に止まるようにするため）。
+        """
+        if aNode.type == 'if':
+            cond = aNode.children[0]
+            if not is_constant(cond):
+                return aNode
+
+            # 条件の値が 1 のときだけ then の側を実行する
+            if cond.leaf == 1:
+                branch = aNode.children[1]
+            elif aNode.leaf == "with-else":
+                branch = aNode.children[2]
+            else:
+                branch = None
+
+            if branch is None or \
+               (branch.type == 'nop' and branch.lineno == 0):
+                branch = self.Node('nop', lineno=aNode.lineno)
+
+            elif branch.lineno != aNode.lineno:
+                # if の行でも止まるように begin ... end で包む
+                branch = self.Node('multi', '', [branch, self.Node('nop')],
+                                   lineno=aNode.lineno)
+
+            return self.replace(aNode, branch)
+
+        elif aNode.type == 'while':
+            cond = aNode.children[0]
+            if is_constant(cond) and cond.leaf != 1:
+                # 一度も実行されない
+                return self.replace(aNode,
+                                    self.Node('nop', lineno=aNode.lineno))
+
+        elif aNode.type == 'multi':
+            return self.dead_code_multi(aNode)
+
+        return aNode
+
+
+    def replace(self, aNode, new_node):
+        self.replaced[id(new_node)] = new_node
+        return new_node
+
+
+    def is_infinite_loop(self, aNode):
+        if aNode.type != 'while':
+            return False
+
+        cond = aNode.children[0]
+        return is_constant(cond) and cond.leaf == 1
+
+
+    def dead_code_multi(self, aNode):
+        """
+        begin ... end の中の到達しない文を消し、中身が空か一つの文だけに
+        なった begin ... end はまとめる。
+        まとめるのは、dead_code で中身が変わったもので、end がまとめた後の
+        文と同じ行にあるものだけにする（1行ずつ実行したときに止まる行を
+        変えないため）。
+        """
+        statements = aNode.children
+
+        # 最後の要素は end の行の目印（nop か nop-end-procedure）
+        (statements, end_mark) = (statements[:-1], statements[-1])
+
+        changed = any([id(x) in self.replaced for x in statements])
+
+        # 終わらない while の後の文には到達しない
+        for i, statement in enumerate(statements):
+            if self.is_infinite_loop(statement) and i + 1 < len(statements):
+                statements = statements[:i + 1]
+                changed = True
+                break
+
+        aNode.children = statements + [end_mark]
+
+        if not changed or end_mark.type == 'nop-end-procedure':
+            # 手続きの本体は、終わりの目印を残すためにまとめない
+            return aNode
+
+        rest = [x for x in statements if x.type != 'nop']
+        if len(rest) == 0:
+            new_node = self.Node('nop', lineno=aNode.lineno)
+        elif len(rest) == 1 and len(statements) == 1:
+            new_node = rest[0]
+        else:
+            return aNode
+
+        # end が別の行にあるときは、その行でも止まるようにまとめない
+        if end_mark.lineno != new_node.lineno:
+            return aNode
+
+        return self.replace(aNode, new_node)
+
+
+
+    # -------------------------------------------------
+    # loop-invariant code motion
+    # -------------------------------------------------
+    def hoist_invariants(self, aNode, lineno):
+        """
+        while の条件と本体から、ループの中で値が変わらない式を
+        ループの前に出す。
+
+            while i < len(a) do ...
+        は
+            begin _不変0 := len(a); while i < _不変0 do ... end
+        になる（begin と end はどちらも while の行）。
+
+        ループの前で計算しても結果が変わらないように、出すのは
+        次のすべてを満たす式だけにする。
+         - 手続きの呼び出しを含まない
+         - 読む変数がループの中で書き換えられない（代入、配列への代入、
+           ++、--、手続きの名前呼びの引数）
+         - エラーにならない（len、not、=、!= と、整数値どうしの演算など）
+         - 本体の式は、条件でも読んでいる変数しか読まない
+           （ループが一度も回らないときに、未定義の変数を作らないため）
+        """
+        if aNode.type != 'while':
+            return aNode
+
+        (cond, body) = aNode.children
+        assigned = set()
+        assigned_names(cond, assigned)
+        assigned_names(body, assigned)
+
+        cond_names = set()
+        read_names(cond, cond_names)
+
+        hoisted = []
+        aNode.children[0] = self.hoist(cond, assigned, None, hoisted,
+                                       aNode.lineno)
+        self.hoist_statement(body, assigned, cond_names, hoisted,
+                             aNode.lineno)
+
+        if not hoisted:
+            return aNode
+
+        return self.Node('multi', '', hoisted + [aNode, self.Node('nop')],
+                         lineno=aNode.lineno)
+
+
+    def hoist_statement(self, aNode, assigned, cond_names, hoisted, lineno):
+        """
+        文 aNode の中の式から、ループの前に出せるものを出す
+        """
+        def hoist(anexp):
+            return self.hoist(anexp, assigned, cond_names, hoisted, lineno)
+
+        if aNode.type == 'binop':
+            # 代入文
+            aNode.children[1] = hoist(aNode.children[1])
+
+        elif aNode.type == 'array_subst':
+            aNode.children[1] = [hoist(x) for x in aNode.children[1]]
+            aNode.children[2] = hoist(aNode.children[2])
+
+        elif aNode.type == 'print':
+            aNode.children = [hoist(x) for x in aNode.children]
+
+        elif aNode.type in ['while', 'if']:
+            aNode.children[0] = hoist(aNode.children[0])
+            for statement in aNode.children[1:]:
+                self.hoist_statement(statement, assigned, cond_names,
+                                     hoisted, lineno)
+
+        elif aNode.type == 'multi':
+            for statement in aNode.children:
+                self.hoist_statement(statement, assigned, cond_names,
+                                     hoisted, lineno)
+
+        # 手続きの本体は別の環境で実行されるので、そのままにする
+
+
+    def hoist(self, aNode, assigned, cond_names, hoisted, lineno):
+        """
+        式 aNode の中で、ループの前に出せる部分を変数に置き換えたものを返す。
+        出した式は hoisted に代入文として加える。
+        cond_names が None でなければ、その変数しか読まない式だけを出す。
+        """
+        if aNode.type == 'call':
+            # 引数を変数に置き換えると名前呼びになってしまうので、
+            # 手続きの呼び出しの中はそのままにする
+            return aNode
+
+        names = set()
+        if is_invariant(aNode, assigned, names) and \
+           (cond_names is None or names <= cond_names):
+            temp = "%s%d" % (HIDDEN_PREFIX, self.hoisted)
+            self.hoisted += 1
+
+            set_lineno(aNode, lineno)
+            hoisted += [self.Node('binop', ':=',
+                                  [self.Node('name', temp), aNode],
+                                  lineno=lineno)]
+            return self.Node('name', temp, lineno=lineno)
+
+        rewrite_children(aNode, lambda child: self.hoist(child, assigned,
+                                                         cond_names,
+                                                         hoisted, lineno))
+        return aNode
+
+
+    # -------------------------------------------------
+    # counting loops
+    # -------------------------------------------------
+    def count_loop(self, aNode, lineno):
+        """
+        while i < n do begin ...; i++ end の形の while に、
+        counter = (i の名前, n の Node, i++ より前の文のリスト) を付ける。
+        n は変数か整数の定数で、本体で i と n が書き換えられないときに限る。
+        構文木は変えないので、counter を使わないエンジンはそのまま動く。
+        """
+        if aNode.type != 'while':
+            return aNode
+
+        (cond, body) = aNode.children
+        if cond.type != 'binop' or cond.leaf != '<':
+            return aNode
+
+        (counter, bound) = cond.children
+        if counter.type != 'name' or bound.type not in ['name', 'number']:
+            return aNode
+
+        if body.type == 'multi' and len(body.children) >= 2 and \
+           body.children[-1].type == 'nop':
+            # 最後は end の行の nop
+            (statements, last) = (body.children[:-2], body.children[-2])
+        else:
+            (statements, last) = ([], body)
+
+        if last.type != 'unarrayop' or last.leaf != '++' or \
+           last.children[0].leaf != counter.leaf:
+            return aNode
+
+        assigned = set()
+        for statement in statements:
+            assigned_names(statement, assigned)
+
+        if counter.leaf in assigned:
+            return aNode
+
+        if bound.type == 'name' and \
+           (bound.leaf in assigned or bound.leaf == counter.leaf):
+            return aNode
+
+        aNode.counter = (counter.leaf, bound, statements)
+        return aNode
+
+
+    # -------------------------------------------------
+    # tail calls
+    # -------------------------------------------------
+    def mark_tail_calls(self, aNode, lineno):
+        """
+        手続きの最後に実行される z := f(...)（z は戻り値の変数、f は
+        その手続き自身）に、tail_call として手続きの情報
+        （procedure の Node の children）を付ける。
+        構文木は変えないので、tail_call を使わないエンジンはそのまま動く。
+        """
+        if aNode.type != 'procedure':
+            return aNode
+
+        procedure_retname = aNode.children[0]
+        for statement in tail_statements(aNode.children[2]):
+            if statement.type == 'binop' and statement.leaf == ':=' and \
+               statement.children[0].leaf == procedure_retname and \
+               statement.children[1].type == 'call' and \
+               statement.children[1].leaf == aNode.leaf:
+                statement.tail_call = aNode.children
+
+        return aNode
+
+
+    # -------------------------------------------------
+    # inlining
+    # -------------------------------------------------
+    def inline_calls(self, node_list):
+        """
+        プログラム全体（トップレベルの文のリスト）を見て、小さな手続きの
+        呼び出し z := f(...) に、inline として InlinedCall を付ける。
+        付けた InlinedCall の展開した文のリストを返す。
+
+        展開するのは、一度しか定義されていない手続きで、本体に手続きの
+        呼び出しも定義も含まず（再帰しない）、本体の Node の個数が
+        inline_threshold 以下のもの。引数に手続きの呼び出しを含む呼び出しと、
+        エラーになりうる引数がある呼び出し（引数のエラーは、手続きの
+        環境ではなく呼び出し側の環境で、引数の変数に 0 を入れてから
+        表示する）は展開しない。構文木は変えないので、inline を使わない
+        エンジンはそのまま動く。
+        """
+        nodes = []
+        for aNode in node_list:
+            procedure_nodes(aNode, nodes)
+
+        names = [aNode.leaf for aNode in nodes]
+        candidates = {}
+        for aNode in nodes:
+            body = aNode.children[2]
+            if names.count(aNode.leaf) == 1 and \
+               not has_call(body) and \
+               count_nodes(body) <= self.inline_threshold:
+                candidates[aNode.leaf] = aNode.children
+
+        inlined = []
+        def inline(aNode, lineno):
+            if aNode.type == 'binop' and aNode.leaf == ':=' and \
+               aNode.children[1].type == 'call' and \
+               aNode.children[1].leaf in candidates:
+                procedure = candidates[aNode.children[1].leaf]
+                call_params = aNode.children[1].children
+                if len(procedure[1]) == len(call_params) and \
+                   not any([has_call(x) for x in call_params]) and \
+                   all([is_safe(x, set(), set()) for x in call_params]):
+                    aNode.inline = self.inline_call(aNode, procedure)
+                    inlined.append(aNode.inline.statement)
+
+            return aNode
+
+        for aNode in node_list:
+            self.walk(aNode, inline, aNode.lineno)
+
+        return inlined
+
+
+    def inline_call(self, aNode, procedure):
+        """
+        z := f(...) の f の本体を、変数の名前を付け替えて展開する
+        """
+        Node = self.Node
+        (procedure_retname, procedure_params, body) = procedure
+        call_node = aNode.children[1]
+        lineno = aNode.lineno
+
+        prefix = "%s%d_" % (INLINE_PREFIX, self.inlined)
+        self.inlined += 1
+
+        local_names = set()
+        def rename(name):
+            local_names.add(prefix + name)
+            return prefix + name
+
+        body = copy.deepcopy(body)
+        rename_names(body, rename)
+
+        # 引数の値を入れてから本体を実行する
+        statements = []
+        writebacks = []
+        for procedure_aparam, call_aparam in zip(procedure_params,
+                                                 call_node.children):
+            statements += [Node("binop", ":=",
+                                [Node("name", rename(procedure_aparam)),
+                                 copy.deepcopy(call_aparam)],
+                                lineno=lineno)]
+
+            if call_aparam.type == 'name':
+                writebacks += [(call_aparam.leaf, rename(procedure_aparam))]
+
+        statements += [body]
+
+        return InlinedCall(procedure,
+                           Node("multi", "", statements, lineno=lineno),
+                           rename(procedure_retname),
+                           writebacks,
+                           sorted(local_names),
+                           prefix)
+
+
+
+class InlinedCall:
+    def __init__(self, procedure, statement, retname, writebacks,
+                 local_names, prefix):
+        """
+        InlinedCall(procedure, statement, retname, writebacks, local_names,
+                    prefix)
+
+         展開した手続きの呼び出し z := f(...)（Optimizer.inline_calls）。
+         procedure は f の procedure の Node の children、statement は
+         引数の値を入れてから本体を実行する文、retname は戻り値の変数の
+         名前、writebacks は名前呼びの (呼び出し側の変数, 引数) のリスト、
+         local_names は展開した文で使う変数の名前のリスト。
+         変数の名前はどれも prefix で始まる。
+
+         statement を実行した後は、呼び出しから戻るときと同じように、
+         名前呼びの引数を書き戻して（コピーはしない）、戻り値をコピーして
+         z に入れ、展開した文で使った変数を消す（finish）。
+        """
+        self.procedure = procedure
+        self.statement = statement
+        self.retname = retname
+        self.writebacks = writebacks
+        self.local_names = local_names
+        self.prefix = prefix
+
+
+    def finish(self, env, target):
+        for call_name, aparam in self.writebacks:
+            env[call_name] = env[aparam]
+
+        # procedure 内で retval が使われていないときは 0 を返すとする
+        retval = env.get(self.retname, 0)
+        if type(retval) is Array:
+            retval = retval.share()
+
+        for name in self.local_names:
+            env.pop(name, None)
+
+        env[target] = retval
+
+
+    def local_env(self, env):
+        """
+        展開した文で使う変数だけを、もとの名前にした環境を返す
+        （展開した文の中でエラーになったときに、手続きの環境として表示する）
+        """
+        prefix = self.prefix
+        return dict([(name[len(prefix):], value)
+                     for name, value in env.items()
+                     if name.startswith(prefix)])
+
+
+
+def procedure_nodes(aNode, nodes):
+    """
+    aNode 以下の procedure 文を nodes に加える
+    """
+    if aNode.type == 'procedure':
+        nodes += [aNode]
+
+    for child in child_nodes(aNode):
+        procedure_nodes(child, nodes)
+
+
+def has_call(aNode):
+    """
+    aNode 以下に手続きの呼び出しか定義があれば True
+    """
+    if aNode.type in ['call', 'procedure']:
+        return True
+
+    return any([has_call(child) for child in child_nodes(aNode)])
+
+
+def rename_names(aNode, rename):
+    """
+    aNode 以下の変数の名前を rename(名前) に付け替える
+    """
+    if aNode.type == 'name':
+        aNode.leaf = rename(aNode.leaf)
+
+    if aNode.counter is not None:
+        (counter, bound, statements) = aNode.counter
+        aNode.counter = (rename(counter), bound, statements)
+
+    for child in child_nodes(aNode):
+        rename_names(child, rename)
+
+
+
+def tail_statements(aNode):
+    """
+    文 aNode を実行したときに、最後に実行されうる文のリスト
+    """
+    if aNode.type == 'multi':
+        for statement in aNode.children[::-1]:
+            if statement.type not in ['nop', 'nop-end-procedure']:
+                return tail_statements(statement)
+        return []
+
+    elif aNode.type == 'if':
+        return sum([tail_statements(branch)
+                    for branch in aNode.children[1:]], [])
+
+    return [aNode]
+
+
+def scoped_children(aNode):
+    """
+    同じ環境で評価される子 Node（手続きの本体は含めない）
+    """
+    if aNode.type == 'procedure':
+        return []
+
+    return child_nodes(aNode)
+
+
+def assigned_names(aNode, names):
+    """
+    aNode の中で書き換えられる変数の名前を names に加える
+    """
+    if aNode.type in ['unarrayop', 'array_subst'] or \
+       (aNode.type == 'binop' and aNode.leaf == ':='):
+        names.add(aNode.children[0].leaf)
+
+    elif aNode.type == 'call':
+        # 名前呼びの引数
+        for call_aparam in aNode.children:
+            if call_aparam.type == 'name':
+                names.add(call_aparam.leaf)
+
+    for child in scoped_children(aNode):
+        assigned_names(child, names)
+
+
+def read_names(aNode, names):
+    """
+    式 aNode が読む変数の名前を names に加える
+    """
+    if aNode.type == 'name':
+        names.add(aNode.leaf)
+
+    for child in scoped_children(aNode):
+        read_names(child, names)
+
+
+def set_lineno(aNode, lineno):
+    """
+    式の演算の Node の行番号を lineno にする
+    """
+    if aNode.type not in ['name', 'number', 'string', 'constant_array']:
+        aNode.lineno = lineno
+
+    for child in child_nodes(aNode):
+        set_lineno(child, lineno)
+
+
+def is_invariant(aNode, assigned, names):
+    """
+    式 aNode がエラーにならず、読む変数が assigned に含まれないなら True。
+    値を積むだけの式（変数や定数）は出しても得にならないので False。
+    読む変数の名前は names に加える。
+    """
+    if aNode.type in ['name', 'number', 'string', 'constant_array']:
+        return False
+
+    return is_safe(aNode, assigned, names)
+
+
+def is_safe(aNode, assigned, names):
+    node_type = aNode.type
+
+    if node_type in ['number', 'string', 'constant_array']:
+        return True
+
+    elif node_type == 'name':
+        names.add(aNode.leaf)
+        return aNode.leaf not in assigned
+
+    elif node_type == 'array_element':
+        var_name = aNode.children[0].leaf
+        names.add(var_name)
+        return var_name not in assigned and \
+            all([is_safe(x, assigned, names) for x in aNode.children[1]])
+
+    elif node_type == 'singleop':
+        return is_safe(aNode.children[0], assigned, names)
+
+    elif node_type == 'builtin':
+        if aNode.leaf in ['len', 'str']:
+            return is_safe(aNode.children, assigned, names)
+
+    elif node_type == 'binop':
+        (exp0, exp1) = aNode.children
+        if aNode.leaf in ['=', '!='] or \
+           (aNode.leaf in SAFE_INT_BINOPS and
+            static_type(exp0) is int and static_type(exp1) is int):
+            return is_safe(exp0, assigned, names) and \
+                is_safe(exp1, assigned, names)
+
+    return False
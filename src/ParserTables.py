@@ -0,0 +1,87 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# ParserTables.py
+#
+# Cached LALR tables for the PLY parsers.  yacc normally regenerates the
+# tables of a grammar every time the module defining it is imported.
+# load_parser pickles them once into __pycache__, under a name that
+# contains a hash of the grammar (start symbol, precedence, tokens and
+# the docstrings of the p_ functions), and later processes load the
+# pickle in optimized mode.  Changing the grammar changes the name, so
+# stale tables are never read.
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import hashlib
+import os
+
+import ply.yacc as yacc
+
+
+# 表を置くディレクトリ（文法を定義したモジュールのディレクトリの中）
+TABLE_DIR = '__pycache__'
+
+
+
+def grammar_hash(module, start=None):
+    """
+    module の文法（開始記号・優先順位・トークン・p_ 関数の docstring）
+    のハッシュ値
+    """
+    functions = [value for (name, value) in vars(module).items()
+                 if name.startswith('p_') and name != 'p_error'
+                 and callable(value)]
+    # yacc と同じく、定義された順に並べる（規則の順番で衝突の解決が変わる）
+    functions.sort(key=lambda f: f.__code__.co_firstlineno)
+
+    parts = [str(start if start is not None
+                 else getattr(module, 'start', None)),
+             repr(getattr(module, 'precedence', ())),
+             ' '.join(module.tokens)]
+    parts += [f.__name__ + ':' + (f.__doc__ or '') for f in functions]
+
+    return hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def table_path(module, start=None):
+    directory = os.path.join(os.path.dirname(os.path.abspath(module.__file__)),
+                             TABLE_DIR)
+    name = module.__name__.split('.')[-1]
+    return os.path.join(directory,
+                        '%s.%s.parsetab' % (name, grammar_hash(module, start)))
+
+
+def load_parser(module, start=None):
+    """
+    module の文法の parser を作る。表のファイルがあればそれを読み、
+    なければ表を作ってファイルに書いておく（書けないときは書かない）。
+    """
+    path = table_path(module, start)
+    if os.path.exists(path):
+        try:
+            # ファイル名にハッシュ値が入っているので、署名は調べなくてよい
+            return yacc.yacc(module=module, start=start, picklefile=path,
+                             optimize=True, debug=False)
+        except Exception:
+            # 壊れた表は作り直す
+            pass
+
+    # 同時に起動したプロセスが書きかけの表を読まないように、
+    # 別の名前で書いてから置き換える
+    work = '%s.%d' % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    except OSError:
+        pass
+
+    parser = yacc.yacc(module=module, start=start, picklefile=work,
+                       debug=False)
+    try:
+        os.replace(work, path)
+    except OSError:
+        pass
+
+    return parser
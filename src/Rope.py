@@ -0,0 +1,134 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# Rope.py
+#
+# Long string values built by concatenation.  s := s + "x" on a plain
+# str copies s every time, so a loop that builds a string is O(n^2).
+# Once a concatenation is ROPE_MIN characters long its result is a Rope,
+# which appends to a list of parts shared with the Rope it was made from
+# (amortised O(1)) and joins the parts only when the contents are needed
+# (left, right, mid, int, comparison, print).
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+# 連結した結果の長さがこれ以上なら Rope にする
+ROPE_MIN = 1024
+
+# 最後の部分がこれより短いときは、新しい部分を足さずにそこへ連結する
+ROPE_CHUNK = 256
+
+
+
+def concat(left, right):
+    """
+    文字列（str か Rope）どうしの連結 left + right
+    """
+    if type(right) is Rope:
+        right = str(right)
+
+    if type(left) is Rope:
+        return left.append(right)
+
+    length = len(left) + len(right)
+    if length < ROPE_MIN:
+        return left + right
+
+    return Rope([left, right], [length], length)
+
+
+
+class Rope:
+    def __init__(self, parts, size, length):
+        """
+        Rope(parts, size, length)
+
+         parts（str の list）を順につないだものの、先頭 length 文字を
+         値とする文字列。
+         parts は、この Rope に連結して作った Rope と共有していて、
+         size はそれらで共有する [parts の文字数の合計]。
+         parts には後ろに連結していくだけなので、共有していても先頭
+         length 文字は変わらない。
+        """
+        self.parts = parts
+        self.size = size
+        self.length = length
+
+
+    def append(self, string):
+        """
+        self + string
+        """
+        length = self.length + len(string)
+
+        if self.size[0] != self.length:
+            # ほかの Rope が parts の後ろに連結しているので、parts を分ける
+            return Rope([str(self), string], [length], length)
+
+        parts = self.parts
+        if len(parts[-1]) < ROPE_CHUNK:
+            parts[-1] += string
+        else:
+            parts.append(string)
+
+        self.size[0] = length
+        return Rope(parts, self.size, length)
+
+
+    def __str__(self):
+        parts = self.parts
+        if len(parts) > 1:
+            # 共有している Rope のためにも、つないだものに置き換えておく
+            parts[:] = [''.join(parts)]
+
+        return parts[0][:self.length]
+
+
+    def __len__(self):
+        return self.length
+
+
+    def __repr__(self):
+        return "Rope(%r)" % str(self)
+
+
+    def __deepcopy__(self, memo):
+        # 値は変わらないので、コピーしなくてよい
+        return self
+
+
+    def __hash__(self):
+        return hash(str(self))
+
+
+    # str とも、中身の文字列で比べる
+    def __eq__(self, other):
+        if type(other) is Rope or type(other) is str:
+            return str(self) == str(other)
+        return NotImplemented
+
+
+    def __lt__(self, other):
+        if type(other) is Rope or type(other) is str:
+            return str(self) < str(other)
+        return NotImplemented
+
+
+    def __le__(self, other):
+        if type(other) is Rope or type(other) is str:
+            return str(self) <= str(other)
+        return NotImplemented
+
+
+    def __gt__(self, other):
+        if type(other) is Rope or type(other) is str:
+            return str(self) > str(other)
+        return NotImplemented
+
+
+    def __ge__(self, other):
+        if type(other) is Rope or type(other) is str:
+            return str(self) >= str(other)
+        return NotImplemented
@@ -0,0 +1,550 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# TraceJIT.py
+#
+# A tracing JIT for hot while loops.  Every iteration of a while loop
+# run by eval_all is counted; once a loop gets hot, its condition and
+# body are specialised to the types of the variables observed on entry
+# and compiled into a Python function that runs the rest of the loop.
+# When the types do not match a compiled trace, the loop stays in the
+# interpreter.
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+from src.Array import Array
+from src.Rope import Rope
+from src.Operators import (op_plus, op_minus, op_times, op_div, op_ne,
+                           op_eq, op_and, op_or, builtin_len, builtin_left,
+                           builtin_right, builtin_mid, builtin_int,
+                           builtin_str)
+
+
+# この回数だけ繰り返した while をトレースにする
+HOT_LOOP_THRESHOLD = 50
+
+# 要素がすべて整数値の配列の型
+INT_ARRAY = 'int_array'
+
+# 未定義の変数
+_U = object()
+
+# 整数値どうしで、Python の演算子をそのまま使える二項演算子
+INT_OPERATORS = {
+    '+': '+',
+    '*': '*',
+    'mod': '%',
+}
+
+# 比較演算子（整数値どうし、文字列どうしのときだけ使える）
+COMPARISONS = {
+    '>=': '>=',
+    '>': '>',
+    '<=': '<=',
+    '<': '<',
+}
+
+# 生成するコードから使う関数
+TRACE_GLOBALS = {
+    'op_plus': op_plus,
+    'op_minus': op_minus,
+    'op_times': op_times,
+    'op_div': op_div,
+    'op_ne': op_ne,
+    'op_eq': op_eq,
+    'op_and': op_and,
+    'op_or': op_or,
+    'builtin_len': builtin_len,
+    'builtin_left': builtin_left,
+    'builtin_right': builtin_right,
+    'builtin_mid': builtin_mid,
+    'builtin_int': builtin_int,
+    'builtin_str': builtin_str,
+}
+
+
+
+class NotTraceable(Exception):
+    """
+    トレースにできない while や型の組み合わせのときに投げる例外
+    """
+    pass
+
+
+
+def value_type(value, indexed):
+    """
+    変数の値の型（indexed が True で、要素がすべて整数値の配列なら INT_ARRAY）
+    Rope は str として扱う（演算も比較も str と同じようにできる）
+    """
+    t = type(value)
+    if t is Rope:
+        return str
+    if t is Array and indexed:
+        for element in value.values():
+            if type(element) is not int:
+                return Array
+        return INT_ARRAY
+
+    return t
+
+
+def plain_type(t):
+    if t is INT_ARRAY:
+        return Array
+    return t
+
+
+
+class Loop:
+    def __init__(self, aNode):
+        """
+        Loop(aNode)
+
+         while の Node aNode の中で使われる変数を集める。
+         手続きの呼び出しや入れ子の while など、トレースにできない文や式が
+         あれば NotTraceable を投げる。
+         names には使われる変数の名前、indexed には name[...] の形で
+         使われる変数の名前が入る。
+        """
+        self.names = []
+        self.indexed = []
+
+        self.collect(aNode.children[0])
+        self.collect(aNode.children[1])
+
+        self.indexed_flags = [name in self.indexed for name in self.names]
+
+
+    def add(self, name, indexed=False):
+        if name not in self.names:
+            self.names += [name]
+
+        if indexed and name not in self.indexed:
+            self.indexed += [name]
+
+
+    def collect(self, aNode):
+        node_type = aNode.type
+
+        if node_type in ['while', 'procedure', 'call', 'array',
+                         'constant_array', 'stored']:
+            raise NotTraceable(node_type)
+
+        if node_type in ['name', 'unarrayop']:
+            if node_type == 'name':
+                self.add(aNode.leaf)
+            else:
+                self.add(aNode.children[0].leaf)
+            return
+
+        if node_type in ['array_element', 'array_subst']:
+            if len(aNode.children[1]) != 1:
+                raise NotTraceable("多次元の配列")
+
+            self.add(aNode.children[0].leaf, indexed=True)
+            children = aNode.children[1:]
+        elif type(aNode.children) in (list, tuple):
+            # 葉の children は空の tuple
+            children = aNode.children
+        else:
+            # len、int、str の引数
+            children = [aNode.children]
+
+        for child in children:
+            if isinstance(child, list):
+                for x in child:
+                    self.collect(x)
+            elif not isinstance(child, str):
+                self.collect(child)
+
+
+    def signature(self, env):
+        """
+        env での変数の型の組（未定義の変数があれば None）
+        """
+        types = []
+        for name, indexed in zip(self.names, self.indexed_flags):
+            value = env.get(name, _U)
+            if value is _U:
+                return None
+            types += [value_type(value, indexed)]
+
+        return tuple(types)
+
+
+
+class TraceBuilder:
+    def __init__(self, loop, signature):
+        """
+        TraceBuilder(loop, signature)
+
+         while をトレース（Python の関数）のソースコードにする。
+         signature はループに入るときの変数の型の組で、式の型はそこから
+         決めていく。演算子がエラーになる型の組み合わせや、繰り返しの
+         前後で変数の型が変わるときには NotTraceable を投げる。
+        """
+        self.loop = loop
+        self.entry = dict(zip(loop.names, signature))
+        self.lines = []
+        self.assigned = []
+        self.temp_count = 0
+
+
+    def var(self, name):
+        return "v%d" % self.loop.names.index(name)
+
+
+    def new_temp(self):
+        self.temp_count += 1
+        return "_t%d" % self.temp_count
+
+
+    def emit(self, indent, code):
+        self.lines += ["    " * indent + code]
+
+
+    def build(self, aNode):
+        """
+        def trace(env): ... のソースコードを返す
+        """
+        (cond, body) = aNode.children
+        names = self.loop.names
+
+        self.emit(0, "def trace(env):")
+        for name in names:
+            self.emit(1, "%s = env[%r]" % (self.var(name), name))
+
+        state = dict(self.entry)
+        self.emit(1, "try:")
+        self.emit(2, "while %s:" % self.gen_cond(cond, state))
+        self.gen_statement(body, state, 3)
+        self.emit(3, "pass")
+
+        if state != self.entry:
+            # 繰り返しの前後で型が変わる
+            raise NotTraceable("型が変わる変数")
+
+        # エラーで止まったときも、そこまでの値を環境に戻す
+        self.emit(1, "finally:")
+        for name in self.assigned:
+            self.emit(2, "env[%r] = %s" % (name, self.var(name)))
+        self.emit(2, "pass")
+
+        return "\n".join(self.lines) + "\n"
+
+
+    # -------------------------------------------------
+    # statements
+    # -------------------------------------------------
+    def gen_statement(self, aNode, state, indent):
+        node_type = aNode.type
+
+        if node_type == 'binop':
+            # 代入文
+            name = aNode.children[0].leaf
+            (code, t) = self.gen_exp(aNode.children[1], state)
+            if plain_type(t) is Array:
+                raise NotTraceable("配列の代入")
+
+            self.emit(indent, "%s = %s" % (self.var(name), code))
+            self.assign(name, t, state)
+
+        elif node_type == 'unarrayop':
+            name = aNode.children[0].leaf
+            if state[name] is not int:
+                raise NotTraceable("整数値でない変数の %s" % aNode.leaf)
+
+            v = self.var(name)
+            if aNode.leaf == '++':
+                self.emit(indent, "%s += 1" % v)
+            else:
+                self.emit(indent, "%s = %s - 1 if %s > 0 else 0" % (v, v, v))
+            self.assign(name, int, state)
+
+        elif node_type == 'array_subst':
+            name = aNode.children[0].leaf
+            if state[name] is not INT_ARRAY:
+                raise NotTraceable("整数値の配列でない変数への代入")
+
+            # index、値の順に計算する
+            index = self.gen_index(aNode.children[1][0], state)
+            temp = self.new_temp()
+            self.emit(indent, "%s = %s" % (temp, index))
+
+            (code, t) = self.gen_exp(aNode.children[2], state)
+            if t is not int:
+                raise NotTraceable("整数値でない値の配列への代入")
+
+            self.emit(indent, "%s[%s] = %s" % (self.var(name), temp, code))
+
+        elif node_type == 'print':
+            # 後ろの式から順に計算する
+            temps = []
+            for anexp in aNode.children[::-1]:
+                (code, t) = self.gen_exp(anexp, state)
+                temp = self.new_temp()
+                self.emit(indent, "%s = %s" % (temp, code))
+                temps = [temp] + temps
+
+            self.emit(indent, "print_values([%s])" %
+                      ", ".join(["pretty_print_value(%s)" % temp
+                                 for temp in temps]))
+
+        elif node_type == 'if':
+            self.emit(indent, "if %s:" % self.gen_cond(aNode.children[0],
+                                                      state))
+            then_state = dict(state)
+            self.gen_statement(aNode.children[1], then_state, indent + 1)
+            self.emit(indent + 1, "pass")
+
+            else_state = dict(state)
+            if aNode.leaf == "with-else":
+                self.emit(indent, "else:")
+                self.gen_statement(aNode.children[2], else_state, indent + 1)
+                self.emit(indent + 1, "pass")
+
+            if then_state != else_state:
+                raise NotTraceable("分岐で型が変わる変数")
+            state.update(then_state)
+
+        elif node_type == 'multi':
+            for statement_node in aNode.children:
+                self.gen_statement(statement_node, state, indent)
+
+        elif node_type in ['nop', 'nop-end-procedure']:
+            pass
+
+        else:
+            raise NotTraceable(node_type)
+
+
+    def assign(self, name, t, state):
+        state[name] = t
+        if name not in self.assigned:
+            self.assigned += [name]
+
+
+    # -------------------------------------------------
+    # expressions
+    # -------------------------------------------------
+    def gen_cond(self, aNode, state):
+        """
+        「式の値が 1」を表す Python の条件式
+        """
+        if aNode.type == 'binop' and aNode.leaf in COMPARISONS:
+            (code0, t0) = self.gen_exp(aNode.children[0], state)
+            (code1, t1) = self.gen_exp(aNode.children[1], state)
+            if t0 is t1 and t0 in [int, str]:
+                return "%s %s %s" % (code0, COMPARISONS[aNode.leaf], code1)
+
+        (code, t) = self.gen_exp(aNode, state)
+        return "%s == 1" % code
+
+
+    def gen_index(self, aNode, state):
+        (code, t) = self.gen_exp(aNode, state)
+        if t not in [int, str]:
+            raise NotTraceable("配列の index")
+        return code
+
+
+    def gen_exp(self, aNode, state):
+        """
+        式の Python のコードと、値の型の組を返す
+        """
+        node_type = aNode.type
+
+        if node_type == 'number':
+            return (repr(aNode.leaf), int)
+
+        elif node_type == 'string':
+            return (repr(aNode.leaf), str)
+
+        elif node_type == 'name':
+            return (self.var(aNode.leaf), state[aNode.leaf])
+
+        elif node_type == 'array_element':
+            name = aNode.children[0].leaf
+            if state[name] is not INT_ARRAY:
+                raise NotTraceable("整数値の配列でない変数の要素")
+
+            index = self.gen_index(aNode.children[1][0], state)
+            # 無い要素は 0
+            return ("%s[%s]" % (self.var(name), index), int)
+
+        elif node_type == 'singleop':
+            (code, t) = self.gen_exp(aNode.children[0], state)
+            return ("(1 if %s == 0 else 0)" % code, int)
+
+        elif node_type == 'binop':
+            return self.gen_binop(aNode, state)
+
+        elif node_type == 'builtin':
+            return self.gen_builtin(aNode, state)
+
+        raise NotTraceable(node_type)
+
+
+    def gen_binop(self, aNode, state):
+        operator = aNode.leaf
+        (code0, t0) = self.gen_exp(aNode.children[0], state)
+        (code1, t1) = self.gen_exp(aNode.children[1], state)
+        (t0, t1) = (plain_type(t0), plain_type(t1))
+        ints = t0 is int and t1 is int
+
+        if operator in INT_OPERATORS and ints:
+            return ("(%s %s %s)" % (code0, INT_OPERATORS[operator], code1),
+                    int)
+
+        elif operator == '+' and t0 is t1:
+            return ("op_plus(%s, %s)" % (code0, code1), t0)
+
+        elif operator == '-' and ints:
+            return ("op_minus(%s, %s)" % (code0, code1), int)
+
+        elif operator == '*' and t0 is str and t1 is int:
+            return ("op_times(%s, %s)" % (code0, code1), str)
+
+        elif operator == 'div' and ints:
+            return ("op_div(%s, %s)" % (code0, code1), int)
+
+        elif operator in COMPARISONS and t0 is t1 and t0 in [int, str]:
+            return ("(1 if %s %s %s else 0)" %
+                    (code0, COMPARISONS[operator], code1), int)
+
+        elif operator == '=':
+            return ("op_eq(%s, %s)" % (code0, code1), int)
+
+        elif operator == '!=':
+            return ("op_ne(%s, %s)" % (code0, code1), int)
+
+        elif operator in ['and', 'or'] and int in [t0, t1]:
+            return ("op_%s(%s, %s)" % (operator, code0, code1), int)
+
+        raise NotTraceable("%s %s %s" % (t0, operator, t1))
+
+
+    def gen_builtin(self, aNode, state):
+        function = aNode.leaf
+
+        if function in ['len', 'int', 'str']:
+            (code, t) = self.gen_exp(aNode.children, state)
+            t = plain_type(t)
+
+            if function == 'len':
+                return ("builtin_len(%s)" % code, int)
+            elif function == 'int':
+                return ("builtin_int(%s)" % code, int)
+            elif t in [int, str]:
+                return ("builtin_str(%s)" % code, str)
+            else:
+                return ("builtin_str(%s)" % code, int)
+
+        # left、right、mid
+        args = [self.gen_exp(anexp, state) for anexp in aNode.children]
+        if args[0][1] is not str or \
+           any([t is not int for (code, t) in args[1:]]):
+            raise NotTraceable("%s の引数" % function)
+
+        return ("builtin_%s(%s)" % (function,
+                                    ", ".join([code for (code, t) in args])),
+                str)
+
+
+
+class TraceJIT:
+    def __init__(self, evaluator, threshold=HOT_LOOP_THRESHOLD):
+        """
+        TraceJIT(evaluator, threshold)
+
+         while の繰り返しの回数を Node ごとに数え、threshold 回を超えた
+         ループをトレースにして実行する。トレースはループに入るときの
+         変数の型の組ごとに作り、型が合わないときはインタプリタに任せる。
+        """
+        self.evaluator = evaluator
+        self.threshold = threshold
+
+        # while の Node -> 繰り返しの回数
+        self.counts = {}
+
+        # while の Node -> Loop（トレースにできないときは None）
+        self.loops = {}
+
+        # (while の Node, 型の組) -> トレース（作れなかったときは None）
+        self.traces = {}
+
+        # 作ったトレースの数と、型が合わずにインタプリタに戻った回数
+        self.compiled = 0
+        self.fallbacks = 0
+
+
+    def is_traceable(self, aNode):
+        """
+        トレースにできる形の while なら True
+        """
+        if aNode not in self.loops:
+            try:
+                self.loops[aNode] = Loop(aNode)
+            except NotTraceable:
+                self.loops[aNode] = None
+
+        return self.loops[aNode] is not None
+
+
+    def run(self, aNode, env):
+        """
+        while aNode の繰り返しの前に毎回呼ぶ。ループが熱くなっていて、
+        env の変数の型に合うトレースがあれば、残りの繰り返しをすべて
+        実行して True を返す。
+        """
+        count = self.counts.get(aNode, 0) + 1
+        if count < self.threshold:
+            self.counts[aNode] = count
+            return False
+
+        if not self.is_traceable(aNode):
+            # 二度と数えないようにする
+            self.counts[aNode] = float('-inf')
+            return False
+
+        trace = self.lookup(aNode, env)
+        if trace is None:
+            # しばらくはインタプリタで実行する
+            self.counts[aNode] = 0
+            self.fallbacks += 1
+            return False
+
+        self.counts[aNode] = count
+        trace(env)
+        return True
+
+
+    def lookup(self, aNode, env):
+        signature = self.loops[aNode].signature(env)
+        if signature is None:
+            return None
+
+        key = (aNode, signature)
+        if key not in self.traces:
+            self.traces[key] = self.compile(aNode, signature)
+
+        return self.traces[key]
+
+
+    def compile(self, aNode, signature):
+        try:
+            source = TraceBuilder(self.loops[aNode], signature).build(aNode)
+        except NotTraceable:
+            return None
+
+        namespace = dict(TRACE_GLOBALS)
+        namespace['print_values'] = self.evaluator.print_values
+        namespace['pretty_print_value'] = self.evaluator.pretty_print_value
+        exec(compile(source, "<trace line %d>" % aNode.lineno, "exec"),
+             namespace)
+
+        self.compiled += 1
+        return namespace['trace']
@@ -0,0 +1,931 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# Transpiler.py
+#
+# A code generator from the syntax trees of while programs into a Python
+# module.  Variables become local variables, while statements become native
+# loops and procedures become Python functions.  Statements that call
+# procedures compute their operands into temporaries in the same order as
+# the task stack, and self tail calls become loops.
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import importlib.util
+import os
+
+from src.Evaluator import Node, Evaluator
+from src.Optimizer import is_hidden_name, tail_statements
+
+
+# 生成されるモジュールの先頭部分
+#  - 演算子と組み込み関数は src.Operators のものをそのまま使う
+#  - 手続きは _procedures に (関数, 引数の個数) として登録する
+PRELUDE = '''\
+#-*- coding:utf-8 -*-
+# This module was generated from a while program by src/Transpiler.py.
+
+import copy
+
+from src.Array import Array
+from src.Operators import (OperandMismatch, BINOPS, op_plus, op_minus,
+                           op_times, op_div, op_mod, op_ne, op_eq, op_ge,
+                           op_gt, op_le, op_lt, op_and, op_or, op_not,
+                           builtin_len, builtin_left, builtin_right,
+                           builtin_mid, builtin_int, builtin_str,
+                           pretty_print_value, message_err_expression)
+
+
+class WhileError(Exception):
+    pass
+
+
+class _Stop(Exception):
+    # 呼び出す手続きがないときに止まる（メッセージは _resolve で表示している）
+    pass
+
+
+class _Fixed:
+    # 末尾呼び出しの後で、名前呼びの引数に書き戻す値（_tail_sources）
+    def __init__(self, value):
+        self.value = value
+
+
+# 未定義の変数（配列への代入で Array() を作る変数にだけ使う）
+_U = object()
+
+# 手続き名 -> (関数, 引数の個数)
+_procedures = {}
+
+# 演算子の関数名 -> 演算子
+_OPERATORS = dict((func.__name__, op) for op, func in BINOPS.items())
+
+
+def _copy(value):
+    if type(value) is Array:
+        return value.share()
+    return value
+
+
+def _resolve(procedure_name, lineno, args_len):
+    # 呼び出す手続きの関数。エラーのときはメッセージを表示して None を返す
+    # （タスクスタック版と同じく、止まるのは呼び出すところ）
+    try:
+        (function, params_len) = _procedures[procedure_name]
+    except KeyError:
+        _output("%d行目: 手続き '%s' が定義されていません。" % (lineno, procedure_name), True)
+        return None
+
+    # 引数の個数のチェック
+    if params_len > args_len:
+        _output("%d行目: 手続き '%s' に与えらた引数の個数が少なすぎです（%d個にしてください）。" % (lineno, procedure_name, params_len), True)
+        return None
+
+    elif params_len < args_len:
+        _output("%d行目: 手続き '%s' に与えらた引数の個数が多すぎです（%d個にしてください）。" % (lineno, procedure_name, params_len), True)
+        return None
+
+    return function
+
+
+def _tail_sources(sources, values, passed, keep):
+    # 末尾呼び出しの後で、元の呼び出しの引数ごとに、名前呼びで書き戻す値が
+    # 今の引数の何番目にあるか（_Fixed なら値そのもの）
+    if sources is None:
+        sources = range(len(values))
+
+    result = []
+    for source in sources:
+        if type(source) is _Fixed or source in keep:
+            # 戻り値の変数と同じ名前の引数は、戻り値を書き戻す
+            result += [source]
+        elif source in passed:
+            result += [passed[source]]
+        else:
+            result += [_Fixed(copy.deepcopy(values[source]))]
+
+    return result
+
+
+def _results(retval, values, sources):
+    # 戻り値と、名前呼びで書き戻すための引数の値
+    if sources is None:
+        return (retval,) + values
+
+    return (retval,) + tuple([source.value if type(source) is _Fixed
+                              else values[source] for source in sources])
+
+
+def _item(target, index):
+    try:
+        return target[index]
+    except:
+        return 0
+
+
+def _element(target, indexes, last_index):
+    for i in indexes:
+        if type(target) is Array and \\
+           type(target[i]) is Array:
+            target = target[i]
+        else:
+            # 巡れないときには 0 を返して終了
+            return 0
+
+    try:
+        return target[last_index]
+    except:
+        return 0
+
+
+def _subst(target, indexes, last_index, value):
+    if type(value) is Array:
+        # a[i][j] := a のように自分自身を代入するときのために、先に共有しておく
+        value = value.share()
+
+    for i in indexes:
+        if type(target) is Array:
+            # 共有している配列は、ここでコピーしてから書き換える
+            target = target.writable(i)
+        else:
+            target[i] = Array()
+            target = target[i]
+
+    target[last_index] = value
+
+
+def _mismatch_message(e):
+    # 生成されたコードの中で最後に実行していた行から、while プログラムの
+    # 行番号を、演算子の関数名から演算子を求める
+    lineno = 0
+    operator = ""
+    tb = e.__traceback__
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        if tb.tb_frame.f_globals is globals():
+            lineno = _LINENOS.get(tb.tb_lineno, lineno)
+        operator = _OPERATORS.get(code.co_name, operator)
+        tb = tb.tb_next
+
+    (val0, val1) = e.args
+    return message_err_expression(lineno, val0, val1, operator)
+
+
+def _default_output(mes, error=False):
+    print(mes)
+
+
+# print とエラーの出力先（main で設定する）
+_output = _default_output
+
+'''
+
+
+# 結果が配列にならない式（代入のときにコピーが要らない）
+SCALAR_BINOPS = ['-', '*', 'div', 'mod', '!=', '=', '>=', '>', '<=', '<',
+                 'and', 'or']
+
+# 結果が必ず 1 か 0 になる式（条件にそのまま使える）
+BOOLEAN_BINOPS = ['!=', '=', '>=', '>', '<=', '<', 'and', 'or']
+
+BINOP_FUNCTIONS = {
+    '+': 'op_plus',
+    '-': 'op_minus',
+    '*': 'op_times',
+    'div': 'op_div',
+    'mod': 'op_mod',
+    '!=': 'op_ne',
+    '=': 'op_eq',
+    '>=': 'op_ge',
+    '>': 'op_gt',
+    '<=': 'op_le',
+    '<': 'op_lt',
+    'and': 'op_and',
+    'or': 'op_or',
+}
+
+
+
+def child_nodes(aNode):
+    """
+    文や式の直接の子 Node のリストを返す
+    （procedure の本体は別のスコープなので含めない）
+    """
+    if aNode.type == 'procedure':
+        return []
+
+    if isinstance(aNode.children, Node):
+        # len、int、str の引数
+        return [aNode.children]
+
+    nodes = []
+    for child in aNode.children:
+        if isinstance(child, Node):
+            nodes += [child]
+        elif isinstance(child, list):
+            nodes += [x for x in child if isinstance(x, Node)]
+
+    return nodes
+
+
+
+def has_call(aNode):
+    if aNode.type == 'call':
+        return True
+
+    return any([has_call(child) for child in child_nodes(aNode)])
+
+
+
+class Scope:
+    def __init__(self, statements, params=[]):
+        """
+        Scope(statements, params)
+
+         一つの関数（トップレベルまたは手続き）で使われる変数を集める。
+         names には全ての変数名、undefined には未定義の状態（_U）から
+         始める変数名が入る。undefined になるのは、配列への代入
+         （name[...] := ...）の対象になる変数と、配列の要素としてしか
+         参照されない変数である。
+        """
+        self.names = list(params)
+        self.arrays = []
+        self.plain = list(params)
+
+        for aNode in statements:
+            self.collect(aNode)
+
+        self.undefined = [name for name in self.names
+                          if name in self.arrays or name not in self.plain]
+
+
+    def add(self, name, plain=True):
+        if name not in self.names:
+            self.names += [name]
+
+        if plain and name not in self.plain:
+            self.plain += [name]
+
+
+    def collect(self, aNode):
+        if aNode.type in ['name', 'unarrayop']:
+            if aNode.type == 'name':
+                self.add(aNode.leaf)
+            else:
+                self.add(aNode.children[0].leaf)
+
+        elif aNode.type == 'array_element':
+            self.add(aNode.children[0].leaf, plain=False)
+
+        elif aNode.type == 'array_subst':
+            name = aNode.children[0].leaf
+            self.add(name, plain=False)
+            if name not in self.arrays:
+                self.arrays += [name]
+
+        for child in child_nodes(aNode):
+            if aNode.type in ['array_element', 'array_subst'] and \
+               child is aNode.children[0]:
+                continue
+            self.collect(child)
+
+
+
+class Function:
+    def __init__(self, scope):
+        """
+        Function(scope)
+
+         生成する関数一つ分のソースコード。
+         lines には (インデント, コード, while プログラムの行番号) が入る。
+        """
+        self.scope = scope
+        self.lines = []
+        self.temp_count = 0
+
+
+    def emit(self, indent, code, lineno=0):
+        self.lines += [(indent, code, lineno)]
+
+
+    def new_temp(self):
+        self.temp_count += 1
+        return "_t%d" % self.temp_count
+
+
+
+class Transpiler:
+    def __init__(self):
+        """
+        Transpiler()
+
+         Evaluator.setup で得られる構文木のリスト（node_list）から
+         Python のモジュールのソースコードを作る。
+
+         生成されたモジュールの main(env, output) を呼ぶとプログラムが実行され、
+         実行後の環境が dict で返される。print の結果とエラーは
+         output(mes, error) に渡される。
+        """
+        self.functions = []
+        self.procedure_count = 0
+
+        # 手続きを呼び出す文で、展開するときに値を読んでおいた変数と、
+        # 調べておいた手続きの Node -> 一時変数（gen_ordered）
+        self.captured = {}
+
+        # 生成している手続きの、末尾呼び出しをループにする文と情報
+        # （gen_procedure）
+        self.tail_calls = []
+        self.tail = None
+
+
+    # -------------------------------------------------
+    # public
+    # -------------------------------------------------
+    def transpile(self, node_list):
+        """
+        node_list から Python のソースコード（文字列）を作る
+        """
+        self.functions = []
+        self.procedure_count = 0
+
+        main = Function(Scope(node_list))
+        main.emit(0, "def main(env=None, output=None):")
+        main.emit(1, "global _output")
+        main.emit(1, "if env is None: env = {}")
+        main.emit(1, "if output is None: output = _default_output")
+        main.emit(1, "_output = output")
+
+        for name in main.scope.names:
+            if name in main.scope.undefined:
+                main.emit(1, "%s = env.get(%r, _U)" % (self.var(name), name))
+            else:
+                main.emit(1, "%s = env.get(%r, 0)" % (self.var(name), name))
+
+        main.emit(1, "try:")
+        count = len(main.lines)
+        for aNode in node_list:
+            self.gen_statement(main, aNode, 2)
+
+        if len(main.lines) == count:
+            main.emit(2, "pass")
+
+        main.emit(1, "except _Stop:")
+        main.emit(2, "pass")
+        main.emit(1, "except WhileError as e:")
+        main.emit(2, "output(str(e), True)")
+        main.emit(1, "except OperandMismatch as e:")
+        main.emit(2, "output(_mismatch_message(e), True)")
+        main.emit(1, "except RecursionError:")
+        main.emit(2, "output(\"手続きの呼び出しが深すぎます。\", True)")
+
+        main.emit(1, "result = dict(env)")
+        for name in main.scope.names:
+            if is_hidden_name(name):
+                # 最適化で作った変数は結果に含めない
+                continue
+            main.emit(1, "if %s is not _U: result[%r] = %s" % (self.var(name), name, self.var(name)))
+        main.emit(1, "return result")
+
+        self.functions += [main]
+
+        # 行番号の対応表を作りながらソースコードをまとめる
+        source_lines = PRELUDE.split("\n")
+        linenos = {}
+        for function in self.functions:
+            source_lines += [""]
+            for (indent, code, lineno) in function.lines:
+                source_lines += ["    " * indent + code]
+                if lineno:
+                    linenos[len(source_lines)] = lineno
+
+        source_lines += ["", "# 生成されたコードの行番号 -> while プログラムの行番号",
+                         "_LINENOS = %r" % linenos, ""]
+
+        return "\n".join(source_lines)
+
+
+    def write_module(self, node_list, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.transpile(node_list))
+
+
+    # -------------------------------------------------
+    # names
+    # -------------------------------------------------
+    def var(self, name):
+        # Python の予約語や生成コードの名前と衝突しないように接頭辞をつける
+        return "v_" + name
+
+
+    def read(self, function, name):
+        if name in function.scope.undefined:
+            return "(0 if %s is _U else %s)" % (self.var(name), self.var(name))
+        return self.var(name)
+
+
+    # -------------------------------------------------
+    # statements
+    # -------------------------------------------------
+    def gen_statement(self, function, aNode, indent):
+        lineno = aNode.lineno
+
+        if aNode.type == 'binop' and aNode in self.tail_calls:
+            self.gen_tail_call(function, aNode, indent)
+
+        elif aNode.type == 'binop':
+            # NAME := expression
+            if has_call(aNode.children[1]):
+                (exp,) = self.gen_ordered(function, [aNode.children[1]], indent)
+            else:
+                exp = self.gen_exp(function, aNode.children[1], indent)
+
+            if self.is_scalar(aNode.children[1]):
+                function.emit(indent, "%s = %s" % (self.var(aNode.children[0].leaf), exp), lineno)
+            else:
+                # 配列は別のオブジェクトとして代入
+                function.emit(indent, "%s = _copy(%s)" % (self.var(aNode.children[0].leaf), exp), lineno)
+
+        elif aNode.type == 'array_subst':
+            name = aNode.children[0].leaf
+            nodes = [aNode.children[2]] + aNode.children[1]
+            if any([has_call(x) for x in nodes]):
+                # index を後ろから順に計算してから、値を計算する
+                values = self.gen_ordered(function, nodes, indent)
+            else:
+                values = [self.gen_exp(function, x, indent) for x in nodes]
+            (value, indexes) = (values[0], values[1:])
+
+            if name in function.scope.undefined:
+                # 環境に存在しないときには 空の配列 を作成しておく
+                function.emit(indent, "if %s is _U: %s = Array()" % (self.var(name), self.var(name)), lineno)
+
+            if len(indexes) == 1:
+                function.emit(indent, "%s[%s] = %s" % (self.var(name), indexes[0], value), lineno)
+            else:
+                function.emit(indent, "_subst(%s, (%s,), %s, %s)" % (self.var(name), ", ".join(indexes[:-1]), indexes[-1], value), lineno)
+
+        elif aNode.type == 'unarrayop':
+            name = aNode.children[0].leaf
+            v = self.var(name)
+            if aNode.leaf == '++':
+                if name in function.scope.undefined:
+                    function.emit(indent, "%s = 1 if %s is _U else %s + 1" % (v, v, v), lineno)
+                else:
+                    function.emit(indent, "%s += 1" % v, lineno)
+            else:
+                function.emit(indent, "%s = %s - 1 if %s > 0 else 0" % (v, v, self.read(function, name)), lineno)
+
+        elif aNode.type == 'print':
+            if any([has_call(x) for x in aNode.children]):
+                # 後ろの式から順に計算する
+                exps = self.gen_ordered(function, aNode.children, indent)
+            elif self.is_ordered(aNode.children):
+                exps = [self.gen_exp(function, anexp, indent)
+                        for anexp in aNode.children]
+            else:
+                exps = self.gen_list(function, aNode.children, indent)
+                function.emit(indent, "_output(\" \".join([pretty_print_value(x) for x in %s]))" % exps, lineno)
+                return
+
+            pretty = ", ".join(["pretty_print_value(%s)" % exp for exp in exps])
+            function.emit(indent, "_output(\" \".join([%s]))" % pretty, lineno)
+
+        elif aNode.type == 'while':
+            prelude = Function(function.scope)
+            prelude.temp_count = function.temp_count
+            cond = self.gen_cond(prelude, aNode.children[0], indent + 1)
+            function.temp_count = prelude.temp_count
+
+            if prelude.lines:
+                # 条件に手続き呼び出しがあるときは、毎回その呼び出しから行う
+                function.emit(indent, "while True:", lineno)
+                function.lines += prelude.lines
+                function.emit(indent + 1, "if not (%s): break" % cond, lineno)
+            else:
+                function.emit(indent, "while %s:" % cond, lineno)
+
+            self.gen_block(function, aNode.children[1], indent + 1)
+
+        elif aNode.type == 'if':
+            self.gen_if(function, aNode, indent, "if")
+
+        elif aNode.type == 'multi':
+            for statement_node in aNode.children:
+                self.gen_statement(function, statement_node, indent)
+
+        elif aNode.type == 'procedure':
+            function_name = self.gen_procedure(aNode)
+            function.emit(indent, "_procedures[%r] = (%s, %d)" % (aNode.leaf, function_name, len(aNode.children[1])), lineno)
+
+        elif aNode.type in ['nop', 'nop-end-procedure']:
+            pass
+
+        else:
+            function.emit(indent, "raise WhileError(%r)" % ("There is no operation: %s" % aNode.type), lineno)
+
+
+    def gen_if(self, function, aNode, indent, keyword):
+        cond = self.gen_cond(function, aNode.children[0], indent)
+        function.emit(indent, "%s %s:" % (keyword, cond), aNode.lineno)
+        self.gen_block(function, aNode.children[1], indent + 1)
+
+        if aNode.leaf == "with-else":
+            else_part = aNode.children[2]
+
+            if else_part.type == 'if' and not has_call(else_part.children[0]):
+                # else if はネストさせずに elif にする
+                self.gen_if(function, else_part, indent, "elif")
+            else:
+                function.emit(indent, "else:", aNode.lineno)
+                self.gen_block(function, else_part, indent + 1)
+
+
+    def gen_block(self, function, aNode, indent):
+        count = len(function.lines)
+        self.gen_statement(function, aNode, indent)
+
+        if len(function.lines) == count:
+            function.emit(indent, "pass")
+
+
+    def gen_procedure(self, aNode):
+        (procedure_retname, procedure_params, procedure_body) = aNode.children
+
+        self.procedure_count += 1
+        function_name = "_procedure%d_%s" % (self.procedure_count, aNode.leaf)
+
+        scope = Scope([procedure_body], procedure_params + [procedure_retname])
+        function = Function(scope)
+        params = ", ".join([self.var(name) for name in procedure_params])
+        function.emit(0, "def %s(%s):" % (function_name, params), aNode.lineno)
+
+        # 手続きの最後の z := f(...)（f はこの手続き自身）
+        tail_calls = [statement for statement in tail_statements(procedure_body)
+                      if statement.type == 'binop' and
+                      statement.children[0].leaf == procedure_retname and
+                      statement.children[1].type == 'call' and
+                      statement.children[1].leaf == aNode.leaf and
+                      len(statement.children[1].children) ==
+                      len(procedure_params) and
+                      not any([has_call(x)
+                               for x in statement.children[1].children])]
+
+        outer = (self.tail_calls, self.tail)
+        self.tail_calls = tail_calls
+        self.tail = (aNode.leaf, function_name, aNode.children)
+        try:
+            if tail_calls:
+                # 末尾呼び出しは、引数を置き換えて本体をもう一度実行する
+                function.emit(1, "_s = None")
+                function.emit(1, "while True:")
+                self.gen_locals(function, scope, procedure_params, 2)
+                self.gen_block(function, procedure_body, 2)
+                function.emit(2, "break")
+            else:
+                self.gen_locals(function, scope, procedure_params, 1)
+                self.gen_block(function, procedure_body, 1)
+        finally:
+            (self.tail_calls, self.tail) = outer
+
+        # 戻り値と、名前呼びで書き戻すための引数の値を返す
+        # （procedure 内で retval が使われていないときは 0 を返すとする）
+        retval = self.read(function, procedure_retname)
+        params = [self.var(name) for name in procedure_params]
+        if tail_calls:
+            function.emit(1, "return _results(%s, (%s), _s)" % (retval, "".join([x + ", " for x in params])))
+        else:
+            function.emit(1, "return (%s,)" % ", ".join([retval] + params))
+
+        self.functions += [function]
+        return function_name
+
+
+    def gen_locals(self, function, scope, procedure_params, indent):
+        """
+        手続きの引数でない変数を、値のない状態にする
+        """
+        for name in scope.names:
+            if name in procedure_params:
+                continue
+            if name in scope.undefined:
+                function.emit(indent, "%s = _U" % self.var(name))
+            else:
+                function.emit(indent, "%s = 0" % self.var(name))
+
+
+    def gen_tail_call(self, function, aNode, indent):
+        """
+        手続きの最後の z := f(...)。f が定義し直されていなければ、
+        引数を後ろから順に計算して置き換え、ループの先頭に戻る。
+        名前呼びで書き戻す値は _tail_sources で追いかける
+        （Compiler.tail_source と同じ）。
+        """
+        (procedure_name, function_name, procedure) = self.tail
+        (procedure_retname, procedure_params, procedure_body) = procedure
+        call_params = aNode.children[1].children
+
+        function.emit(indent, "if _procedures.get(%r, (None,))[0] is %s:" % (procedure_name, function_name), aNode.lineno)
+
+        args = [None] * len(call_params)
+        for i in reversed(range(len(call_params))):
+            args[i] = function.new_temp()
+            function.emit(indent + 1, "%s = %s" % (args[i], self.gen_exp(function, call_params[i], indent + 1)), aNode.lineno)
+
+        # 名前呼びで渡す引数 -> 受け取る引数（どちらも何番目か）
+        passed = {}
+        for j, call_aparam in enumerate(call_params):
+            if call_aparam.type == 'name' and \
+               call_aparam.leaf in procedure_params:
+                passed[procedure_params.index(call_aparam.leaf)] = j
+        keep = tuple([i for i, name in enumerate(procedure_params)
+                      if name == procedure_retname])
+
+        params = [self.var(name) for name in procedure_params]
+        function.emit(indent + 1, "_s = _tail_sources(_s, (%s), %r, %r)" % ("".join([x + ", " for x in params]), passed, keep), aNode.lineno)
+        if params:
+            function.emit(indent + 1, "%s = %s" % (", ".join(params), ", ".join(["_copy(%s)" % x for x in args])), aNode.lineno)
+        function.emit(indent + 1, "continue", aNode.lineno)
+
+        # 定義し直されたときは、通常の呼び出しにする
+        function.emit(indent, "else:", aNode.lineno)
+        self.tail_calls.remove(aNode)
+        try:
+            self.gen_statement(function, aNode, indent + 1)
+        finally:
+            self.tail_calls.append(aNode)
+
+
+    # -------------------------------------------------
+    # expressions
+    # -------------------------------------------------
+    def is_scalar(self, aNode):
+        """
+        式の値が配列にならないことが構文からわかるときに True
+        """
+        if aNode.type in ['number', 'string', 'singleop', 'builtin']:
+            return True
+
+        if aNode.type == 'binop':
+            return aNode.leaf in SCALAR_BINOPS
+
+        if aNode.type == 'array':
+            return all([x.type in ['number', 'string'] for x in aNode.children])
+
+        if aNode.type == 'constant_array':
+            # Array(...) の表示は評価のたびに新しい配列になる
+            return True
+
+        return False
+
+
+    def gen_cond(self, function, aNode, indent):
+        if has_call(aNode):
+            (exp,) = self.gen_ordered(function, [aNode], indent)
+        else:
+            exp = self.gen_exp(function, aNode, indent)
+
+        if (aNode.type == 'binop' and aNode.leaf in BOOLEAN_BINOPS) or \
+           aNode.type == 'singleop':
+            return exp
+
+        return "%s == 1" % exp
+
+
+    def is_ordered(self, nodes):
+        """
+        式の列を前から計算しても、タスクスタック版（後ろから計算する）と
+        同じ結果になるなら True（エラーになりうる式が一つまで）
+        """
+        return len([x for x in nodes
+                    if x.type not in ['number', 'string', 'name',
+                                      'constant_array']]) <= 1
+
+
+    def gen_list(self, function, nodes, indent):
+        """
+        式の列を後ろから計算して、前からの順のリストにするコード
+        """
+        exps = [self.gen_exp(function, x, indent) for x in nodes[::-1]]
+        return "[%s][::-1]" % ", ".join(exps)
+
+
+    def gen_exp(self, function, aNode, indent):
+        """
+        手続きの呼び出しを含まない式の Python コードを返す。
+        """
+        if aNode.type in ['number', 'string']:
+            return repr(aNode.leaf)
+
+        elif aNode.type == 'name':
+            if aNode in self.captured:
+                # 文を展開したときに読んでおいた値
+                return self.captured[aNode]
+            return self.read(function, aNode.leaf)
+
+        elif aNode.type == 'binop':
+            exp0 = self.gen_exp(function, aNode.children[0], indent)
+            exp1 = self.gen_exp(function, aNode.children[1], indent)
+            return "%s(%s, %s)" % (BINOP_FUNCTIONS[aNode.leaf], exp0, exp1)
+
+        elif aNode.type == 'singleop':
+            return "op_not(%s)" % self.gen_exp(function, aNode.children[0], indent)
+
+        elif aNode.type == 'builtin':
+            if aNode.leaf in ['len', 'int', 'str']:
+                args = [self.gen_exp(function, aNode.children, indent)]
+            else:
+                args = [self.gen_exp(function, x, indent) for x in aNode.children]
+            return "builtin_%s(%s)" % (aNode.leaf, ", ".join(args))
+
+        elif aNode.type == 'array':
+            if self.is_ordered(aNode.children):
+                elements = [self.gen_exp(function, x, indent) for x in aNode.children]
+                return "Array([%s])" % ", ".join(elements)
+            return "Array(%s)" % self.gen_list(function, aNode.children, indent)
+
+        elif aNode.type == 'constant_array':
+            return repr(aNode.leaf)
+
+        elif aNode.type == 'array_element':
+            name = aNode.children[0].leaf
+            indexes = [self.gen_exp(function, index, indent)
+                       for index in aNode.children[1]]
+            if len(indexes) == 1:
+                return "_item(%s, %s)" % (self.var(name), indexes[0])
+            return "_element(%s, (%s), %s)" % (self.var(name), "".join([x + ", " for x in indexes[:-1]]), indexes[-1])
+
+        return "0"
+
+
+    # -------------------------------------------------
+    # expressions with procedure calls
+    # -------------------------------------------------
+    def gen_ordered(self, function, nodes, indent):
+        """
+        手続きの呼び出しを含む文の式のリスト nodes を、タスクスタック版と
+        同じ順番で計算するコードを出力し、それぞれの値の Python コードを返す。
+
+        タスクスタック版は、まず式を展開して（変数の値を読み、呼び出す
+        手続きを調べておく）、それから演算と呼び出しを行う。
+        ここでも、展開するときに読む値を一時変数に入れておき（gen_expand）、
+        演算と呼び出しの結果を、実行する順番に一時変数に入れていく
+        （gen_flatten）。
+        """
+        self.captured = {}
+        try:
+            for aNode in nodes:
+                self.gen_expand(function, aNode, indent)
+
+            values = [self.gen_flatten(function, aNode, indent)
+                      for aNode in nodes[::-1]]
+        finally:
+            self.captured = {}
+
+        return values[::-1]
+
+
+    def gen_expand(self, function, aNode, indent):
+        if aNode.type == 'name':
+            temp = self.captured[aNode] = function.new_temp()
+            function.emit(indent, "%s = %s" % (temp, self.read(function, aNode.leaf)))
+
+        elif aNode.type == 'call':
+            # 手続きがない・引数の個数が違うときは、引数を展開しない
+            temp = self.captured[aNode] = function.new_temp()
+            function.emit(indent, "%s = _resolve(%r, %d, %d)" % (temp, aNode.leaf, aNode.lineno, len(aNode.children)), aNode.lineno)
+
+            count = len(function.lines)
+            function.emit(indent, "if %s is not None:" % temp)
+            for call_aparam in aNode.children:
+                self.gen_expand(function, call_aparam, indent + 1)
+            if len(function.lines) == count + 1:
+                function.lines.pop()
+
+        elif aNode.type == 'binop':
+            self.gen_expand(function, aNode.children[1], indent)
+            self.gen_expand(function, aNode.children[0], indent)
+
+        elif aNode.type == 'builtin' and aNode.leaf in ['len', 'int', 'str']:
+            self.gen_expand(function, aNode.children, indent)
+
+        elif aNode.type == 'builtin':
+            for x in aNode.children[::-1]:
+                self.gen_expand(function, x, indent)
+
+        elif aNode.type in ['singleop', 'array']:
+            for x in aNode.children:
+                self.gen_expand(function, x, indent)
+
+        elif aNode.type == 'array_element':
+            # 配列の変数は要素を読むときに読む
+            for index in aNode.children[1]:
+                self.gen_expand(function, index, indent)
+
+
+    def gen_flatten(self, function, aNode, indent):
+        """
+        式 aNode の演算と呼び出しを実行する順番に一時変数へ代入し、
+        値の Python コードを返す
+        """
+        if not has_call(aNode):
+            exp = self.gen_exp(function, aNode, indent)
+            if aNode.type in ['number', 'string', 'name']:
+                return exp
+            code = exp
+
+        elif aNode.type == 'call':
+            return self.gen_call(function, aNode, indent)
+
+        elif aNode.type == 'binop':
+            exp0 = self.gen_flatten(function, aNode.children[0], indent)
+            exp1 = self.gen_flatten(function, aNode.children[1], indent)
+            code = "%s(%s, %s)" % (BINOP_FUNCTIONS[aNode.leaf], exp0, exp1)
+
+        elif aNode.type == 'singleop':
+            code = "op_not(%s)" % self.gen_flatten(function, aNode.children[0], indent)
+
+        elif aNode.type == 'builtin':
+            if aNode.leaf in ['len', 'int', 'str']:
+                args = [self.gen_flatten(function, aNode.children, indent)]
+            else:
+                args = [self.gen_flatten(function, x, indent) for x in aNode.children]
+            code = "builtin_%s(%s)" % (aNode.leaf, ", ".join(args))
+
+        elif aNode.type == 'array':
+            # 要素は後ろから順に計算する
+            elements = [self.gen_flatten(function, x, indent)
+                        for x in aNode.children[::-1]][::-1]
+            code = "Array([%s])" % ", ".join(elements)
+
+        else:
+            # array_element の index は後ろから順に計算する
+            name = aNode.children[0].leaf
+            indexes = [self.gen_flatten(function, index, indent)
+                       for index in aNode.children[1][::-1]][::-1]
+            if len(indexes) == 1:
+                code = "_item(%s, %s)" % (self.var(name), indexes[0])
+            else:
+                code = "_element(%s, (%s), %s)" % (self.var(name), "".join([x + ", " for x in indexes[:-1]]), indexes[-1])
+
+        temp = function.new_temp()
+        function.emit(indent, "%s = %s" % (temp, code), aNode.lineno)
+        return temp
+
+
+    def gen_call(self, function, aNode, indent):
+        """
+        手続きの呼び出し。展開したときにエラーになっていればここで止まり、
+        そうでなければ引数を後ろから順に計算してから呼び出す
+        """
+        procedure = self.captured[aNode]
+        function.emit(indent, "if %s is None: raise _Stop()" % procedure, aNode.lineno)
+
+        args = [self.gen_flatten(function, x, indent)
+                for x in aNode.children[::-1]][::-1]
+
+        # 配列は呼び出し側に影響が及ばないようにコピーして渡す
+        args = [arg if self.is_scalar(x) else "_copy(%s)" % arg
+                for x, arg in zip(aNode.children, args)]
+        temp = function.new_temp()
+        function.emit(indent, "%s = %s(%s)" % (temp, procedure, ", ".join(args)), aNode.lineno)
+
+        # 名前呼びの引数は呼び出し側の変数へ書き戻す
+        for i, call_aparam in enumerate(aNode.children):
+            if call_aparam.type == 'name':
+                function.emit(indent, "%s = %s[%d]" % (self.var(call_aparam.leaf), temp, i + 1), aNode.lineno)
+
+        return "%s[0]" % temp
+
+
+
+# -----------------------------------------------------------------
+# 便利関数
+# -----------------------------------------------------------------
+def transpile_file(while_path, py_path):
+    """
+    while プログラムのファイルを Python のモジュールに変換して保存する。
+    文法エラーがあるときは False を返す。
+    """
+    with open(while_path, encoding="utf-8") as f:
+        program = f.read()
+
+    evaluator = Evaluator(GUI=False)
+    if not evaluator.setup(program)['noerror']:
+        return False
+
+    Transpiler().write_module(evaluator.node_list, py_path)
+    return True
+
+
+def load_module(py_path):
+    """
+    生成されたモジュールを import する
+    """
+    name = os.path.splitext(os.path.basename(py_path))[0]
+    spec = importlib.util.spec_from_file_location(name, py_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
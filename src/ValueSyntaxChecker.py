@@ -94,8 +94,10 @@ def p_error(t):
         Error_mes += "式が途中で終了しています。\n"
 
 
-import ply.yacc as yacc
-parser = yacc.yacc(write_tables=False, debug=False)
+# parser は最初に調べるときに作る（表は src/ParserTables.py）
+import sys
+from src.ParserTables import load_parser
+parser = None
 
 # ----------------------------------------------------------------
 class SyntaxChecker:
@@ -108,9 +110,12 @@ class SyntaxChecker:
     def is_valid(self, text):
         global parser, Error_alised, Error_mes
 
+        if parser is None:
+            parser = load_parser(sys.modules[__name__])
+
         Error_alised = False
         Error_mes = ""
-        aNode = parser.parse(text)
+        aNode = parser.parse(text, lexer=lexer)
 
         return Error_mes
 
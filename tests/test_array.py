@@ -0,0 +1,180 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# test_array.py
+#
+# Tests for the array values: the PersistentVector trie that large
+# shared arrays switch to (appending past the point where the root
+# grows, fork keeping both vectors apart, random updates against a
+# list) and Array copy-on-write through it, including nested arrays
+# made writable with writable().
+#
+#   python3 -m pytest tests
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import copy
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from src.Array import (Array, PersistentVector, VECTOR_MIN, VECTOR_BITS,
+                       VECTOR_WIDTH)
+
+
+# 根が2回深くなるまで要素を足す（32 * 32 * 32 個を超える）
+GROWN = VECTOR_WIDTH ** 3 + 2 * VECTOR_WIDTH + 1
+
+
+
+class PersistentVectorTest(unittest.TestCase):
+    def test_append_grows_root(self):
+        vector = PersistentVector(list(range(VECTOR_MIN)))
+        shifts = set([vector.shift])
+        for i in range(VECTOR_MIN, GROWN):
+            vector.append(i)
+            shifts.add(vector.shift)
+
+        self.assertEqual(shifts, set([VECTOR_BITS, 2 * VECTOR_BITS,
+                                      3 * VECTOR_BITS]))
+        self.assertEqual(len(vector), GROWN)
+        self.assertEqual(vector.to_list(), list(range(GROWN)))
+        for i in [0, 31, 32, 1023, 1024, 1055, 1056, 32767, 32768,
+                  GROWN - 1]:
+            self.assertEqual(vector.get(i), i)
+
+
+    def test_append_from_empty(self):
+        vector = PersistentVector([])
+        for i in range(3 * VECTOR_MIN):
+            vector.append(i)
+        self.assertEqual(vector.to_list(), list(range(3 * VECTOR_MIN)))
+
+
+    def test_fork_isolation(self):
+        n = 2 * VECTOR_MIN + 5
+        vector = PersistentVector(list(range(n)))
+        forked = vector.fork()
+
+        # 木の中の要素、tail の要素、足した要素
+        for i in [0, 100, VECTOR_MIN, n - 1]:
+            forked.set(i, -i - 1)
+        forked.append('x')
+        vector.set(200, 'v')
+        vector.append('y')
+
+        expected = list(range(n))
+        expected[200] = 'v'
+        self.assertEqual(vector.to_list(), expected + ['y'])
+
+        expected = list(range(n))
+        for i in [0, 100, VECTOR_MIN, n - 1]:
+            expected[i] = -i - 1
+        self.assertEqual(forked.to_list(), expected + ['x'])
+
+
+    def test_fork_after_growth(self):
+        vector = PersistentVector([])
+        for i in range(GROWN):
+            vector.append(i)
+
+        forked = vector.fork()
+        for i in range(GROWN, GROWN + VECTOR_WIDTH * 2):
+            forked.append(i)
+        forked.set(5, 'f')
+
+        self.assertEqual(vector.to_list(), list(range(GROWN)))
+        self.assertEqual(forked.get(5), 'f')
+        self.assertEqual(len(forked), GROWN + VECTOR_WIDTH * 2)
+
+
+    def test_random_updates(self):
+        rand = random.Random(1)
+        expected = list(range(VECTOR_MIN + 7))
+        vectors = [(PersistentVector(list(expected)), expected)]
+
+        for step in range(2000):
+            (vector, elements) = rand.choice(vectors)
+            action = rand.random()
+            if action < 0.1:
+                vectors.append((vector.fork(), list(elements)))
+            elif action < 0.4:
+                vector.append(step)
+                elements.append(step)
+            else:
+                i = rand.randrange(len(elements))
+                vector.set(i, step)
+                elements[i] = step
+
+        for (vector, elements) in vectors:
+            self.assertEqual(vector.to_list(), elements)
+            self.assertEqual(len(vector), len(elements))
+
+
+
+class SharedArrayTest(unittest.TestCase):
+    def test_large_copy_becomes_vector(self):
+        n = VECTOR_MIN + 10
+        a = Array(list(range(n)))
+        b = copy.deepcopy(a)
+        b[3] = -1
+
+        self.assertIsNotNone(b.vector)
+        self.assertEqual(a.to_list(), list(range(n)))
+        self.assertEqual(b[3], -1)
+
+        c = copy.deepcopy(b)
+        c[n - 1] = 'c'
+        c[n] = 'd'
+        b[0] = 'b'
+
+        self.assertEqual(b.to_list()[:4], ['b', 1, 2, -1])
+        self.assertEqual(b[n - 1], n - 1)
+        self.assertEqual(len(b), n)
+        self.assertEqual(c.to_list()[:4], [0, 1, 2, -1])
+        self.assertEqual((c[n - 1], c[n], len(c)), ('c', 'd', n + 1))
+
+
+    def test_small_copy_stays_list(self):
+        a = Array(list(range(VECTOR_MIN - 1)))
+        b = copy.deepcopy(a)
+        b[0] = 1
+        self.assertIsNone(b.vector)
+        self.assertEqual(a[0], 0)
+
+
+    def test_nested_writable(self):
+        n = VECTOR_MIN + 10
+        a = Array([Array([i]) for i in range(n)] + [5])
+        b = copy.deepcopy(a)
+
+        b.writable(7)[0] = 'b'
+        b.writable(n - 1)[1] = 'tail'
+        # 配列でない要素は空の配列になる
+        b.writable(n)[0] = 'new'
+
+        self.assertIsNotNone(b.vector)
+        self.assertEqual(b[7].to_list(), ['b'])
+        self.assertEqual(b[n - 1].to_list(), [n - 1, 'tail'])
+        self.assertEqual(b[n].to_list(), ['new'])
+        self.assertEqual(a[7].to_list(), [7])
+        self.assertEqual(a[n - 1].to_list(), [n - 1])
+        self.assertEqual(a[n], 5)
+
+        # vector どうしのコピーでも、中の配列は別になる
+        c = copy.deepcopy(b)
+        c.writable(7)[0] = 'c'
+        self.assertEqual(b[7].to_list(), ['b'])
+        self.assertEqual(c[7].to_list(), ['c'])
+        self.assertEqual(a[7].to_list(), [7])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,402 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# test_engines.py
+#
+# Runs the same programs with every way of executing them (one step at
+# a time, eval_all with the task stack, the compiled closures with and
+# without the optimizer, memoization and node_store, and the bytecode VM
+# with eval_all and one step at a time) and checks that they all print
+# the same output and end with the same environment as one-step
+# execution.  The programs are the samples, by-name arguments
+# evaluated in different orders, deep recursion, runtime errors and
+# large shared values.
+# Stepping with the state deep-copied between steps, as the GUI does,
+# is checked as well, and so are the lines stepping stops on when the
+# optimizer removes unreachable code.
+#
+#   python3 -m pytest tests
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import copy
+import glob
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from src.Evaluator import Evaluator
+from src.Transpiler import Transpiler, load_module
+
+
+def program(procedures, *statements):
+    """
+    手続きの定義のリストと、トップレベルの文からなるプログラム
+    """
+    return "".join([procedure + "\n" for procedure in procedures]) + \
+        "begin\n" + ";\n".join(statements) + "\nend\n"
+
+
+# 引数を名前呼びで書き換える手続き
+G = "procedure z := g(a): begin a := a + 1; z := a end"
+H = "procedure z := h(p, q): begin z := p end"
+
+BY_NAME = {
+    'binop-left': program([G], "x := 1", "r := g(x) + x"),
+    'binop-right': program([G], "x := 1", "r := x + g(x)"),
+    'array': program([G], "y := 1", "r := [g(y), y, g(y)]"),
+    'args': program([G, H], "x := 1", "r := h(g(x), x)"),
+    'if': program([G], "x := 1",
+                  'if g(x) = x then r := "eq" else r := "ne"'),
+    'while': program([G], "x := 0", "n := 0",
+                     "while g(x) < 5 do n := n + x"),
+    'nested': program([G], "x := 1", "r := g(g(x))"),
+    'array-subst': program([G], "a := [0, 0, 0]", "i := 0", "a[g(i)] := i"),
+    'array-subst-nested': program([G], "i := 0", "b[g(i)][i] := g(i)"),
+    'print': program([G], "x := 1", "print(g(x), x, g(x))"),
+    'builtin': program([G], 's := "abcdef"', "x := 1",
+                       "r := mid(s, g(x), x)"),
+    'element': program([G], "a := [10, 20, 30]", "i := 0",
+                        "r := a[g(i)] + a[i]"),
+    'element-unbound': program([G], "i := 0", "r := a[g(i)]", "a := [5]",
+                               "r2 := a[g(i) - 2] + i"),
+    'not-len': program([G], "x := 1", "r := not (g(x) = x)",
+                       "s := len([g(x), x])"),
+    'memo': program(["procedure z := p(a): begin z := a * 2 end", G],
+                    "x := 1", "r := g(x) + p(x)", "s := p(x) + g(x)"),
+    'print-in-procedure': program(
+        ["procedure z := pr(a): begin print(a); z := a end"],
+        "r := pr(1) + pr(2)", "q := [pr(3), pr(4)]", "print(pr(5), pr(6))"),
+    'swap': program(
+        ["procedure z := sw(p, q): begin t := p; p := q; q := t; z := 0 end"],
+        "x := 1", "y := 2", "r := sw(x, y)", "s := sw(x, x)"),
+    'tail-call': program(
+        ["procedure z := c(n, k): begin k := k + 1; "
+         "if n = 0 then z := 0 else z := c(n - 1, k) end"],
+        "k := 0", "r := c(10, k)"),
+    'redefine': program([G], "x := 1", "r := g(x)",
+                        "procedure z := g(a): begin z := a * 10 end",
+                        "s := g(x)"),
+}
+
+DEEP = {
+    'recursion-1000': program(
+        ["procedure z := f(n): begin "
+         "if n = 0 then z := 0 else z := f(n - 1) + 1 end"],
+        "r := f(1000)"),
+    'recursion-3000': program(
+        ["procedure z := f(n): begin "
+         "if n = 0 then z := 0 else z := f(n - 1) + 1 end"],
+        "r := f(3000)"),
+    'tail-5000': program(
+        ["procedure z := t(n, acc): begin "
+         "if n = 0 then z := acc else z := t(n - 1, acc + 1) end"],
+        "r := t(5000, 0)"),
+}
+
+ERRORS = {
+    'unbound': program([], 'a := "x"', "z := (a or a) = s1"),
+    'unbound-array': program([], 'a := "x"', "z := [s2, a + 1, s3]"),
+    'unbound-print': program([], 'a := "x"', "print(s4, a + 1, s5)"),
+    'first-error': program([], 'a := "x"', "z := [a + 1, a < 2]"),
+    'undefined': program([G], "x := 1", "r := g(x) + u(x)"),
+    'undefined-first': program([G], "x := 1", "r := u(x) + g(x)"),
+    'undefined-array': program([G], "x := 1", "r := [u(x), g(x), v(w)]"),
+    'arguments': program([G], "x := 1", "r := g(x) + g(x, x)"),
+    'in-procedure': program(
+        ['procedure z := bad(a): begin z := a + "s" end'],
+        "x := 1", "r := bad(x) + y"),
+    'in-argument': program([G], 'x := "s"', "r := g(y) + g(x + 1)"),
+    'deep': program(
+        ['procedure z := f(n): begin '
+         'if n = 0 then z := n + "s" else z := f(n - 1) + 1 end'],
+        "r := f(50)"),
+    'inlined': program(["procedure z := add(p, q): begin z := p + q end"],
+                       'a := "s"', "r := add(a + 1, b)"),
+}
+
+# 共有する大きな配列（Array.VECTOR_MIN 以上）
+LARGE = {
+    'shared-array': program(
+        [], "a := [0]", "i := 0",
+        "while i < 1100 do begin a[i] := [i]; i := i + 1 end",
+        "b := a", "b[3] := 99", "b[1099][1] := 2", "c := b", "c[1100] := 7",
+        "b[0][0] := 9",
+        "r := [len(a), len(b), len(c), a[3][0], b[3], c[3], a[1099], "
+        "b[1099], c[1099], a[0], b[0], c[0], c[1100]]"),
+    'shared-rope': program(
+        [], 's := ""', 'while len(s) < 1100 do s := s + "12345"',
+        "t := s", 's := s + "1"', 't := t + "2"', 'u := t + "3"',
+        'r := [len(s), len(t), len(u), right(s, 3), right(t, 3), '
+        'right(u, 3), left(u, 4), mid(u, 1098, 3), s = t, t < s, '
+        'u = t + "3", int(s) = int(s)]',
+        "n := int(mid(s, 1091, 5))"),
+}
+
+# GUI で1行ずつ実行するときの、再帰と定義し直し
+STEPPED = {
+    'recursion': program(
+        ["procedure z := f(n): begin\n"
+         "    if n = 0 then z := 0\n"
+         "    else z := f(n - 1) + 1\nend"],
+        "print(f(30))"),
+    'tail-call': program(
+        ["procedure z := t(n, acc): begin\n"
+         "    if n = 0 then z := acc\n"
+         "    else z := t(n - 1, acc + 1)\nend"],
+        "print(t(50, 0))"),
+    'redefine-in-loop': program(
+        ["procedure z := g(a): begin z := a * 10 end"],
+        "i := 0",
+        "while i < 2 do begin\n"
+        "    print(g(1));\n"
+        "    procedure z := g(a): begin z := a * 50 end;\n"
+        "    i := i + 1\nend"),
+}
+
+# 到達しない文を消したときの、1行ずつ実行して止まる行
+DEAD_CODE = {
+    'collapsed-block': program(
+        [], "i := 0",
+        "while i < 3 do begin\n"
+        "    if 1 then i := i + 1 else i := 100\nend",
+        "print(i)"),
+    'emptied-block': program(
+        [], "i := 0", "begin\n    if 0 then i := i + 1\nend",
+        "begin if 1 then i := i + 5 end", "print(i)"),
+}
+
+SAMPLES = dict([(os.path.basename(path), open(path, encoding='utf-8').read())
+                for path in sorted(glob.glob(os.path.join(ROOT, 'sample',
+                                                          '*.while')))])
+
+
+# 実行のしかた -> (Evaluator の引数, 1行ずつ実行するか)
+MODES = {
+    'task': ({}, False),
+    'compiled': ({}, False),
+    'no-optimize': ({'optimize': False}, False),
+    'memoize': ({'memoize': True}, False),
+    'node-store': ({'node_store': True}, False),
+    'vm': ({'engine': 'vm'}, False),
+    'vm-onestep': ({'engine': 'vm'}, True),
+}
+
+
+def run(source, options, onestep, task=False):
+    """
+    source を実行し、(環境の表示, 表示したメッセージのリスト) を返す。
+    task のときは、最初の文を1行実行してから eval_all を呼ぶ
+    （eval_all がタスクスタックの続きを実行する）。
+    """
+    output = []
+    evaluator = Evaluator(GUI=True,
+                          callback=lambda mes, error=False:
+                          output.append((mes, error)),
+                          **options)
+    assert evaluator.setup(source)['noerror'], output
+
+    if onestep or task:
+        result = evaluator.eval_onestep()
+        while onestep and not result['empty']:
+            result = evaluator.eval_onestep()
+        if not result['empty']:
+            result = evaluator.eval_all()
+        env = evaluator.pretty_env(evaluator.env)
+    else:
+        env = evaluator.eval_all()['pretty_env']
+
+    return (env, output)
+
+
+def stepped_lines(source, options):
+    """
+    source を1行ずつ実行したときに止まる行番号のリスト
+    """
+    evaluator = Evaluator(GUI=True, callback=lambda mes, error=False: None,
+                          **options)
+    evaluator.setup(source)
+
+    lines = []
+    result = evaluator.eval_onestep()
+    while not result['empty']:
+        lines.append(result['lineno'])
+        result = evaluator.eval_onestep()
+
+    return lines
+
+
+def run_copied(source):
+    """
+    GUI（Wice.pyw）と同じように、1行実行するごとに状態を deepcopy して
+    set_env で戻してから次の行を実行し、run と同じ形で返す
+    """
+    output = []
+    evaluator = Evaluator(GUI=True,
+                          callback=lambda mes, error=False:
+                          output.append((mes, error)))
+    assert evaluator.setup(source)['noerror'], output
+
+    result = evaluator.eval_onestep()
+    while not result['empty']:
+        evaluator.set_env(copy.deepcopy(result))
+        result = evaluator.eval_onestep()
+
+    return (evaluator.pretty_env(evaluator.env), output)
+
+
+def run_transpiled(source, directory):
+    """
+    source を Python のモジュールに変換して実行し、run と同じ形で返す
+    """
+    output = []
+    evaluator = Evaluator(GUI=True,
+                          callback=lambda mes, error=False:
+                          output.append((mes, error)))
+    assert evaluator.setup(source)['noerror'], output
+
+    path = os.path.join(directory, 'program%d.py' % len(os.listdir(directory)))
+    Transpiler().write_module(evaluator.node_list, path)
+    env = load_module(path).main({}, lambda mes, error=False:
+                                 output.append((mes, error)))
+
+    return (evaluator.pretty_env(env), output)
+
+
+
+class EnginesTest(unittest.TestCase):
+    def check(self, programs, modes=MODES):
+        for name, source in programs.items():
+            expected = run(source, {}, True)
+            for mode, (options, onestep) in modes.items():
+                with self.subTest(program=name, mode=mode):
+                    self.assertEqual(run(source, options, onestep,
+                                         task=(mode == 'task')),
+                                     expected)
+
+
+    def test_samples(self):
+        self.check(SAMPLES)
+
+
+    def test_by_name(self):
+        self.check(BY_NAME)
+
+
+    def test_deep_recursion(self):
+        self.check(DEEP)
+
+
+    def test_errors(self):
+        self.check(ERRORS)
+
+
+    def test_large_values(self):
+        self.check(LARGE)
+
+
+    def test_by_name_results(self):
+        # 1行ずつ実行したときの、名前呼びの引数を書き換える手続きの結果
+        cases = [('binop-left', 'r', '3'),
+                 ('binop-right', 'r', '3'),
+                 ('array', 'r', '[2, 1, 2]'),
+                 ('args', 'x', '1'),
+                 ('if', 'r', '"ne"'),
+                 ('array-subst', 'a', '[0, 0, 0]')]
+        for name, var, value in cases:
+            for mode, (options, onestep) in MODES.items():
+                with self.subTest(program=name, mode=mode):
+                    (env, output) = run(BY_NAME[name], options, onestep,
+                                        task=(mode == 'task'))
+                    self.assertEqual(env[var], value)
+
+
+    def test_syntax_error(self):
+        # setup でエラーになったプログラムは、どの実行のしかたでも何もしない
+        for mode, (options, onestep) in MODES.items():
+            for first in [None, "x := 1"]:
+                with self.subTest(mode=mode, first=first):
+                    evaluator = Evaluator(GUI=True,
+                                          callback=lambda mes, error=False:
+                                          None,
+                                          **options)
+                    if first is not None:
+                        evaluator.setup(first)
+                    self.assertFalse(evaluator.setup("x := := 1")['noerror'])
+
+                    if onestep:
+                        result = evaluator.eval_onestep()
+                        self.assertTrue(result['empty'])
+                        self.assertEqual(result['env'], {})
+                    else:
+                        self.assertEqual(evaluator.eval_all()['env'], {})
+
+
+    def test_dead_code_lines(self):
+        for name, source in DEAD_CODE.items():
+            with self.subTest(program=name):
+                self.assertEqual(stepped_lines(source, {'optimize': True}),
+                                 stepped_lines(source, {'optimize': False}))
+
+
+    def test_copied_state(self):
+        for name, source in dict(STEPPED, **BY_NAME).items():
+            with self.subTest(program=name):
+                self.assertEqual(run_copied(source), run(source, {}, True))
+
+
+    def test_copied_state_results(self):
+        for name, printed in [('recursion', ['30']),
+                              ('tail-call', ['50']),
+                              ('redefine-in-loop', ['10', '50'])]:
+            with self.subTest(program=name):
+                (env, output) = run_copied(STEPPED[name])
+                self.assertEqual([mes for (mes, error) in output], printed)
+
+
+    def test_deep_recursion_results(self):
+        for name, value in [('recursion-1000', '1000'),
+                            ('recursion-3000', '3000'),
+                            ('tail-5000', '5000')]:
+            for mode, (options, onestep) in MODES.items():
+                with self.subTest(program=name, mode=mode):
+                    (env, output) = run(DEEP[name], options, onestep,
+                                        task=(mode == 'task'))
+                    self.assertEqual(env['r'], value)
+                    self.assertEqual(output, [])
+
+
+
+class TranspilerTest(unittest.TestCase):
+    # 生成したコードは、変数を最初に 0 にしておくのでエラーで止まったときの
+    # 環境が違い、手続きの呼び出しは Python の再帰なので深い再帰はできない。
+    # それ以外のプログラムは1行ずつ実行したときと同じ結果になる
+    def check(self, programs):
+        with tempfile.TemporaryDirectory() as directory:
+            for name, source in programs.items():
+                with self.subTest(program=name):
+                    self.assertEqual(run_transpiled(source, directory),
+                                     run(source, {}, True))
+
+
+    def test_samples(self):
+        self.check(SAMPLES)
+
+
+    def test_by_name(self):
+        self.check(BY_NAME)
+
+
+    def test_tail_call(self):
+        self.check({'tail-5000': DEEP['tail-5000']})
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,179 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# test_memo.py
+#
+# Tests for ProcedureCache: least-recently-used order, eviction when
+# the number of results or their approximate size goes over the caps,
+# the hits/misses/evictions counters, and keys and results that are
+# arrays or ropes.
+#
+#   python3 -m pytest tests
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from src.Array import Array
+from src.Rope import concat, ROPE_MIN
+from src.Memo import ProcedureCache, approximate_size
+
+
+def keys(cache, *args):
+    return [cache.key('f', [arg]) for arg in args]
+
+
+def counters(cache):
+    return (cache.hits, cache.misses, cache.evictions)
+
+
+
+class ProcedureCacheTest(unittest.TestCase):
+    def test_lookup(self):
+        cache = ProcedureCache()
+        (k0, k1) = keys(cache, 0, 1)
+        cache.store(k0, 10)
+
+        self.assertEqual(cache.lookup(k0), (True, 10))
+        self.assertEqual(cache.lookup(k1), (False, None))
+        self.assertEqual(cache.lookup(k0), (True, 10))
+        self.assertEqual(counters(cache), (2, 1, 0))
+
+
+    def test_max_entries(self):
+        cache = ProcedureCache(max_entries=3)
+        (k0, k1, k2, k3, k4) = keys(cache, 0, 1, 2, 3, 4)
+        for i, key in enumerate([k0, k1, k2]):
+            cache.store(key, i * 10)
+
+        # 使った k0 は新しくなり、最も長く使われていない k1 が捨てられる
+        cache.lookup(k0)
+        cache.store(k3, 30)
+        self.assertEqual(list(cache.entries), [k2, k0, k3])
+        self.assertEqual(counters(cache), (1, 0, 1))
+
+        cache.store(k4, 40)
+        self.assertEqual(list(cache.entries), [k0, k3, k4])
+        self.assertEqual(len(cache), 3)
+
+        self.assertEqual(cache.lookup(k1), (False, None))
+        self.assertEqual(cache.lookup(k2), (False, None))
+        self.assertEqual(cache.lookup(k0), (True, 0))
+        self.assertEqual(cache.lookup(k4), (True, 40))
+        self.assertEqual(counters(cache), (3, 2, 2))
+
+
+    def test_store_again(self):
+        cache = ProcedureCache(max_entries=2)
+        (k0, k1, k2) = keys(cache, 0, 1, 2)
+        cache.store(k0, 0)
+        cache.store(k1, 10)
+        size = cache.size
+
+        # 同じキーは置き換え、最後に使ったものにする
+        cache.store(k0, 1)
+        self.assertEqual(cache.size, size)
+        self.assertEqual(list(cache.entries), [k1, k0])
+
+        cache.store(k2, 20)
+        self.assertEqual(list(cache.entries), [k0, k2])
+        self.assertEqual(cache.lookup(k0), (True, 1))
+        self.assertEqual(counters(cache), (1, 0, 1))
+
+
+    def test_max_bytes(self):
+        (k0, k1, k2, k3) = keys(ProcedureCache(), 0, 1, 2, 3)
+        size = approximate_size(k0) + approximate_size(0)
+        cache = ProcedureCache(max_bytes=size * 2 + size // 2)
+
+        cache.store(k0, 0)
+        cache.store(k1, 1)
+        self.assertEqual(cache.size, size * 2)
+        self.assertEqual(cache.evictions, 0)
+
+        cache.lookup(k0)
+        cache.store(k2, 2)
+        self.assertEqual(list(cache.entries), [k0, k2])
+        self.assertEqual(cache.size, size * 2)
+        self.assertEqual(counters(cache), (1, 0, 1))
+
+        # 大きな結果は、入るまで古いものを捨てる
+        big = "x" * size
+        cache.store(k3, big)
+        self.assertEqual(list(cache.entries), [k3])
+        self.assertEqual(cache.lookup(k3), (True, big))
+        self.assertEqual(cache.size,
+                         approximate_size(k3) + approximate_size(big))
+        self.assertEqual(counters(cache), (2, 0, 3))
+
+
+    def test_too_large(self):
+        cache = ProcedureCache(max_bytes=1000)
+        (k0, k1) = keys(cache, 0, 1)
+        cache.store(k0, 0)
+
+        # 一つで上限を超える結果は置かない（ほかのものも捨てない）
+        cache.store(k1, "x" * 1000)
+        self.assertEqual(list(cache.entries), [k0])
+        self.assertEqual(cache.lookup(k1), (False, None))
+        self.assertEqual(counters(cache), (0, 1, 0))
+
+
+    def test_both_caps(self):
+        (k0,) = keys(ProcedureCache(), 0)
+        size = approximate_size(k0) + approximate_size(0)
+        cache = ProcedureCache(max_entries=4, max_bytes=size * 10)
+
+        # 個数の上限で捨てる
+        for i in range(6):
+            cache.store(cache.key('f', [i]), i)
+        self.assertEqual(list(cache.entries), keys(cache, 2, 3, 4, 5))
+        self.assertEqual(cache.evictions, 2)
+
+        # メモリ量の上限で捨てる
+        big = "x" * (size * 7)
+        cache.store(cache.key('g', [0]), big)
+        self.assertEqual(list(cache.entries),
+                         keys(cache, 5) + [cache.key('g', [0])])
+        self.assertEqual(cache.evictions, 5)
+        self.assertLessEqual(cache.size, cache.max_bytes)
+
+        cache.clear()
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+
+    def test_array_values(self):
+        cache = ProcedureCache()
+        key = cache.key('f', [Array([1, 2])])
+        self.assertEqual(key, cache.key('f', [Array([1, 2])]))
+        self.assertNotEqual(key, cache.key('f', [Array([1, 3])]))
+
+        result = Array([5, 6])
+        cache.store(key, result)
+        result[0] = 0
+
+        # 置いた後と取り出した後に書き換えても、キャッシュは変わらない
+        (found, value) = cache.lookup(key)
+        self.assertTrue(found)
+        self.assertEqual(value.to_list(), [5, 6])
+        value[1] = 0
+        self.assertEqual(cache.lookup(key)[1].to_list(), [5, 6])
+
+
+    def test_rope_keys(self):
+        cache = ProcedureCache()
+        string = "a" * (ROPE_MIN + 1)
+        cache.store(cache.key('f', [concat(string[:ROPE_MIN], "a")]), 1)
+        self.assertEqual(cache.lookup(cache.key('f', [string])), (True, 1))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#-*- coding:utf-8 -*-
+# -----------------------------------------------------------------------------
+# test_rope.py
+#
+# Tests for the Rope strings that long concatenations build: when a
+# concatenation becomes a Rope, Ropes sharing their parts and appending
+# to them separately, comparison and hashing against str, and the
+# operators and builtins (left, right, mid, int, len, str, +, *) on a
+# Rope.
+#
+#   python3 -m pytest tests
+#
+# Copyright (c) 2021 Shinya Sato
+# Released under the MIT license
+# https://opensource.org/licenses/mit-license.php
+# -----------------------------------------------------------------------------
+
+import copy
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from src.Rope import Rope, ROPE_MIN, ROPE_CHUNK, concat
+from src.Operators import (op_plus, op_times, builtin_len, builtin_left,
+                           builtin_right, builtin_mid, builtin_int,
+                           builtin_str, pretty_print_value)
+
+
+def rope(string):
+    """
+    string と同じ値の、二つ以上の部分からなる Rope
+    """
+    result = concat(string[:ROPE_MIN], string[ROPE_MIN:])
+    assert type(result) is Rope
+    return result
+
+
+LONG = "0123456789" * (ROPE_MIN // 10 + 1)
+
+
+
+class ConcatTest(unittest.TestCase):
+    def test_short_stays_str(self):
+        self.assertIs(type(concat("a" * (ROPE_MIN - 2), "b")), str)
+        self.assertIs(type(concat("a" * (ROPE_MIN - 1), "b")), Rope)
+
+
+    def test_repeated_append(self):
+        s = ""
+        for i in range(3 * ROPE_MIN):
+            s = concat(s, "%d" % (i % 10))
+
+        self.assertIs(type(s), Rope)
+        self.assertEqual(str(s), "".join(["%d" % (i % 10)
+                                          for i in range(3 * ROPE_MIN)]))
+        self.assertEqual(len(s), 3 * ROPE_MIN)
+        # 短い部分はまとめて足していく
+        self.assertLessEqual(len(s.parts), 3 * ROPE_MIN // ROPE_CHUNK + 2)
+
+
+    def test_shared_parts_split(self):
+        # t := s; s := s + "a"; t := t + "b"
+        s = rope(LONG)
+        t = copy.deepcopy(s)
+        s = concat(s, "a")
+        t = concat(t, "b")
+        u = concat(t, "c")
+
+        self.assertEqual(str(s), LONG + "a")
+        self.assertEqual(str(t), LONG + "b")
+        self.assertEqual(str(u), LONG + "bc")
+        self.assertEqual((len(s), len(t), len(u)),
+                         (len(LONG) + 1, len(LONG) + 1, len(LONG) + 2))
+
+        # 先に作った Rope の値は変わらない
+        s2 = concat(s, "x")
+        self.assertEqual(str(s), LONG + "a")
+        self.assertEqual(str(s2), LONG + "ax")
+
+
+    def test_rope_on_right(self):
+        self.assertEqual(str(concat("x", rope(LONG))), "x" + LONG)
+        self.assertEqual(str(concat(rope(LONG), rope(LONG))), LONG + LONG)
+
+
+
+class CompareTest(unittest.TestCase):
+    def test_equal_to_str(self):
+        self.assertEqual(rope(LONG), LONG)
+        self.assertEqual(LONG, rope(LONG))
+        self.assertEqual(rope(LONG), rope(LONG))
+        self.assertNotEqual(rope(LONG), LONG + "x")
+        self.assertNotEqual(rope(LONG), 0)
+
+
+    def test_order(self):
+        smaller = LONG[:-1] + "0"
+        self.assertTrue(rope(smaller) < LONG)
+        self.assertTrue(smaller < rope(LONG))
+        self.assertTrue(rope(smaller) <= rope(LONG))
+        self.assertTrue(rope(LONG) > smaller)
+        self.assertTrue(LONG >= rope(smaller))
+        self.assertFalse(rope(LONG) < rope(LONG))
+
+
+    def test_hash(self):
+        self.assertEqual(hash(rope(LONG)), hash(LONG))
+        self.assertIn(rope(LONG), set([LONG]))
+        self.assertEqual({LONG: 1}[rope(LONG)], 1)
+        self.assertEqual({rope(LONG): 1}[LONG], 1)
+
+
+
+class BuiltinTest(unittest.TestCase):
+    def test_builtins(self):
+        r = rope(LONG)
+        self.assertEqual(builtin_left(r, 3), "012")
+        self.assertEqual(builtin_right(r, 3), LONG[-3:])
+        self.assertEqual(builtin_mid(r, 2, 4), "1234")
+        self.assertEqual(builtin_mid(r, ROPE_MIN, 3),
+                         LONG[ROPE_MIN - 1:ROPE_MIN + 2])
+        self.assertEqual(builtin_len(r), len(LONG))
+        self.assertIs(builtin_str(r), r)
+
+
+    def test_int(self):
+        digits = "1" + "0" * ROPE_MIN
+        self.assertEqual(builtin_int(rope(digits)), 10 ** ROPE_MIN)
+
+
+    def test_operators(self):
+        r = rope(LONG)
+        self.assertEqual(str(op_plus(r, "x")), LONG + "x")
+        self.assertEqual(str(op_plus("x", r)), "x" + LONG)
+        self.assertEqual(op_times(r, 2), LONG + LONG)
+        self.assertEqual(pretty_print_value(r), '"%s"' % LONG)
+
+
+
+if __name__ == '__main__':
+    unittest.main()